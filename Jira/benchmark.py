@@ -0,0 +1,172 @@
+import getopt
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+import urllib.request
+
+import validateRelease
+from fakeJiraServer import FakeJiraServer, FixtureSet, fixtureBoardName, fixtureRelease, \
+    defaultTicketCount, defaultPullRequestsPerTicket, defaultSprintCount
+
+##### Used as the port the fake Jira server is started on for the benchmark
+benchmarkPort = 8766
+
+##### Used as the relative slowdown (wall time or request count) against the baseline that is reported as a regression
+regressionThreshold = 0.2
+
+##### Used as the scenarios every benchmark run measures: a name and the extra validateRelease arguments
+scenarios = [
+    ('serial', ['-c', '1']),
+    ('concurrent', ['-c', str(validateRelease.defaultConcurrency)]),
+    ('stream', ['-c', str(validateRelease.defaultConcurrency), '--stream']),
+    ('release report', ['-c', str(validateRelease.defaultConcurrency), '-r', 'y']),
+]
+
+
+
+def serveFixtures(port, ticketCount, pullRequestsPerTicket, sprintCount, latency, errorRate):
+    server = FakeJiraServer(FixtureSet(ticketCount, pullRequestsPerTicket, sprintCount), port, latency, errorRate)
+    server.serve_forever()
+
+
+#Runs the server in its own process so its work and memory do not count against the script being measured
+def startServer(ticketCount, pullRequestsPerTicket, sprintCount, latency, errorRate):
+    process = multiprocessing.Process(target=serveFixtures, args=(benchmarkPort, ticketCount, pullRequestsPerTicket, sprintCount, latency, errorRate), daemon=True)
+    process.start()
+    for attempt in range(100):
+        try:
+            getServerStats()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('Fake Jira server did not start on port ' + str(benchmarkPort))
+
+
+def getServerUrl():
+    return 'http://127.0.0.1:' + str(benchmarkPort)
+
+
+def getServerStats():
+    with urllib.request.urlopen(getServerUrl() + '/__stats') as response:
+        return json.loads(response.read())
+
+
+def resetServerStats():
+    urllib.request.urlopen(urllib.request.Request(getServerUrl() + '/__reset', data=b'', method='POST')).close()
+
+
+#Runs validateRelease.main() once with its report written to the null device. With measureMemory the run
+# is traced with tracemalloc, which slows it down, so memory is measured in its own pass
+def runScenario(extraArgs, measureMemory=False):
+    argv = ['-u', 'benchmark', '-p', 'benchmark', '-b', fixtureBoardName, '-n', fixtureRelease, '-r', 'n', \
+        '--host', getServerUrl(), '-o', os.devnull] + extraArgs
+    resetServerStats()
+    if measureMemory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        validateRelease.main(argv)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise RuntimeError('validateRelease exited with status ' + str(e.code))
+    wallTime = time.perf_counter() - started
+    peakMemory = None
+    if measureMemory:
+        peakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    stats = getServerStats()
+    return {'wallTime': wallTime, 'requests': stats['requests'], 'errors': stats['errors'], 'peakMemory': peakMemory}
+
+
+def compareToBaseline(results, baseline):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ('wallTime', 'requests'):
+            if baseline[name][metric] > 0 and result[metric] > baseline[name][metric] * (1 + regressionThreshold):
+                regressions.append('{0}: {1} {2:.3f} vs baseline {3:.3f}'.format(name, metric, result[metric], baseline[name][metric]))
+    return regressions
+
+
+def printResults(results):
+    print('{:<16s}{:>12s}{:>12s}{:>10s}{:>16s}'.format('scenario', 'wall (s)', 'requests', 'errors', 'peak heap (MB)'))
+    for name, result in results.items():
+        peakMemory = '{:.1f}'.format(result['peakMemory'] / (1024.0 * 1024.0)) if result['peakMemory'] is not None else '-'
+        print('{:<16s}{:>12.3f}{:>12d}{:>10d}{:>16s}'.format(name, result['wallTime'], result['requests'], result['errors'], peakMemory))
+
+
+def printHelp():
+    print('\tbenchmark.py [--tickets <count>] [--prs <per ticket>] [--sprints <count>] [--latency <ms>] [--errors <rate>] [--memory] [--baseline <file>] [--save]\n')
+
+
+def main(argv):
+    ticketCount = defaultTicketCount
+    pullRequestsPerTicket = defaultPullRequestsPerTicket
+    sprintCount = defaultSprintCount
+    latency = 0.02
+    errorRate = 0.0
+    measureMemory = False
+    baselineFile = ''
+    saveBaseline = False
+    try:
+        opts, args = getopt.getopt(argv, "h", ["tickets=", "prs=", "sprints=", "latency=", "errors=", "memory", "baseline=", "save"])
+        for opt, arg in opts:
+            if opt == '-h':
+                printHelp()
+                sys.exit()
+            elif opt == '--tickets':
+                ticketCount = int(arg)
+            elif opt == '--prs':
+                pullRequestsPerTicket = int(arg)
+            elif opt == '--sprints':
+                sprintCount = int(arg)
+            elif opt == '--latency':
+                latency = float(arg) / 1000
+            elif opt == '--errors':
+                errorRate = float(arg)
+            elif opt == '--memory':
+                measureMemory = True
+            elif opt == '--baseline':
+                baselineFile = arg
+            elif opt == '--save':
+                saveBaseline = True
+    except (getopt.GetoptError, ValueError):
+        printHelp()
+        sys.exit(2)
+
+    print('Benchmarking ' + str(ticketCount) + ' tickets over ' + str(sprintCount) + ' sprints with ' + str(int(latency * 1000)) \
+        + 'ms latency and a ' + str(errorRate) + ' error rate\n')
+    server = startServer(ticketCount, pullRequestsPerTicket, sprintCount, latency, errorRate)
+    results = {}
+    try:
+        for name, extraArgs in scenarios:
+            results[name] = runScenario(extraArgs)
+            if measureMemory:
+                results[name]['peakMemory'] = runScenario(extraArgs, True)['peakMemory']
+    finally:
+        server.terminate()
+    printResults(results)
+
+    if baselineFile != '' and saveBaseline:
+        with open(baselineFile, 'w') as baseline:
+            json.dump(results, baseline, indent=2)
+        print('\nSaved baseline to ' + baselineFile)
+    elif baselineFile != '':
+        with open(baselineFile) as baseline:
+            regressions = compareToBaseline(results, json.load(baseline))
+        if len(regressions) > 0:
+            print('\nRegressions against ' + baselineFile + ':')
+            for regression in regressions:
+                print('\t' + regression)
+            sys.exit(1)
+        print('\nNo regressions against ' + baselineFile)
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,259 @@
+import getopt
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+##### Used as the defaults for the generated fixture set and the server behaviour
+defaultTicketCount = 300
+defaultPullRequestsPerTicket = 2
+defaultSprintCount = 3
+defaultLatency = 0.0
+defaultErrorRate = 0.0
+defaultPort = 8765
+fixtureBoardName = 'Fake Dev Board'
+fixtureRelease = '79'
+
+##### Used as the page size limits the real Jira applies
+agilePageSize = 50
+searchPageSize = 100
+
+
+
+#A generated Jira board: one board with the release's sprints (plus unrelated sprints so discovery has to page
+# and filter), tickets spread over the release sprints with some tickets carried over between sprints, and
+# pull requests for most tickets. The same seed always produces the same fixtures
+class FixtureSet:
+    def __init__(self, ticketCount=defaultTicketCount, pullRequestsPerTicket=defaultPullRequestsPerTicket, sprintCount=defaultSprintCount, seed=1):
+        generator = random.Random(seed)
+        self.boards = [{'id': 7, 'name': fixtureBoardName}, {'id': 8, 'name': fixtureBoardName + ' Archive'}]
+
+        self.sprints = [{'id': 100 + i, 'name': 'MR' + str(i % 90) + '-' + str(i // 90 + 1), 'state': 'closed'} for i in range(120) if i % 90 != int(fixtureRelease)]
+        releaseSprints = [{'id': 1 + i, 'name': 'MR' + fixtureRelease + '-' + str(i + 1), 'state': 'closed' if i < sprintCount - 1 else 'active'} for i in range(sprintCount)]
+        self.sprints.extend(releaseSprints)
+        self.sprints.append({'id': 900, 'name': 'MR' + fixtureRelease + '0-1', 'state': 'future'})
+        #Sprints holding a release number outside the MR prefix: a sprint number or another kind of sprint
+        self.sprints.extend({'id': 901 + i, 'name': name, 'state': 'closed'} for i, name in enumerate(['MR12-7', 'MR12-' + fixtureRelease, 'Hotfix 7', 'Hotfix ' + fixtureRelease]))
+
+        repos = ['web-ui', 'web-ui-components', 'order-service', 'billing-service', 'reporting', 'deploy-scripts']
+        now = time.time()
+        self.issues = {}
+        self.pullRequests = {}
+        self.sprintIssues = {sprint['id']: [] for sprint in releaseSprints}
+        for i in range(ticketCount):
+            key = 'PROJ-' + str(i + 1)
+            issueId = str(10000 + i)
+            fixVersion = 'MR' + fixtureRelease if generator.random() < 0.9 else 'MR' + str(int(fixtureRelease) - 1)
+            updated = now - (generator.random() * 30 * 24 * 60 * 60 if generator.random() < 0.9 else generator.random() * 60 * 60)
+            self.issues[key] = {'id': issueId, 'key': key, 'updatedAt': updated, 'fields': {
+                'fixVersions': [{'name': fixVersion}] if generator.random() < 0.95 else [],
+                'components': [{'name': generator.choice(['Web', 'Services', 'Reports'])}] if generator.random() < 0.8 else [],
+                'labels': generator.sample(['backend', 'frontend', 'hotfix', 'techdebt'], generator.randint(0, 2)),
+                'customfield_12112': {'value': generator.choice(['Development', 'Defect', 'Spike'])} if generator.random() < 0.8 else None,
+                'updated': time.strftime('%Y-%m-%dT%H:%M:%S.000+0000', time.gmtime(updated))}}
+
+            sprintIndex = i * sprintCount // max(ticketCount, 1)
+            self.sprintIssues[releaseSprints[sprintIndex]['id']].append(key)
+            if sprintIndex + 1 < sprintCount and generator.random() < 0.1:
+                self.sprintIssues[releaseSprints[sprintIndex + 1]['id']].append(key)
+
+            prCount = generator.randint(0, pullRequestsPerTicket * 2) if generator.random() < 0.85 else 0
+            self.pullRequests[issueId] = [{
+                'destination': {'repository': {'name': generator.choice(repos)}, 'branch': generator.choice(['development', 'development', 'feature/' + key.lower()])},
+                'status': generator.choice(['MERGED', 'MERGED', 'MERGED', 'OPEN', 'DECLINED']),
+                'author': {'name': 'developer' + str(generator.randint(1, 25))},
+                'reviewers': [{'name': 'reviewer' + str(r), 'approved': generator.random() < 0.7} for r in range(generator.randint(0, 3))]}
+                for p in range(prCount)]
+
+
+class FakeJiraServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fixtures, port=defaultPort, latency=defaultLatency, errorRate=defaultErrorRate):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port), FakeJiraHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.errorRate = errorRate
+        self.random = random.Random(2)
+        self.lock = threading.Lock()
+        self.requestCount = 0
+        self.errorCount = 0
+        self.notModifiedCount = 0
+
+    def getUrl(self):
+        return 'http://127.0.0.1:' + str(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    #Counts the request and decides whether to fail it with an injected error
+    def recordRequest(self):
+        with self.lock:
+            self.requestCount += 1
+            failed = self.random.random() < self.errorRate
+            if failed:
+                self.errorCount += 1
+        return failed
+
+    def recordNotModified(self):
+        with self.lock:
+            self.notModifiedCount += 1
+
+    def resetStats(self):
+        with self.lock:
+            self.requestCount = 0
+            self.errorCount = 0
+            self.notModifiedCount = 0
+
+
+class FakeJiraHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    #Successful responses carry an ETag of their content and are answered with an empty 304 when the client
+    # already holds that version, as Jira does
+    def sendJson(self, status, body, headers=None):
+        content = json.dumps(body).encode('utf-8')
+        headers = dict(headers or {})
+        if status == 200:
+            headers['ETag'] = '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                self.server.recordNotModified()
+                status = 304
+                content = b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if self.path == '/__reset':
+            self.server.resetStats()
+        self.sendJson(200, {})
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == '/__stats':
+            return self.sendJson(200, {'requests': self.server.requestCount, 'errors': self.server.errorCount, \
+                'notModified': self.server.notModifiedCount})
+
+        if self.server.recordRequest():
+            return self.sendJson(503, {'errorMessages': ['Injected error']}, {'Retry-After': '0'})
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+        fixtures = self.server.fixtures
+        match = re.match(r'^/rest/agile/latest/board/(\d+)/sprint$', url.path)
+        if match:
+            states = query['state'].split(',') if 'state' in query else None
+            sprints = [sprint for sprint in fixtures.sprints if states is None or sprint['state'] in states]
+            return self.sendJson(200, getPage(sprints, query, agilePageSize))
+        if url.path == '/rest/agile/latest/board':
+            boards = [board for board in fixtures.boards if query.get('name', '').lower() in board['name'].lower()]
+            return self.sendJson(200, getPage(boards, query, agilePageSize))
+        if url.path == '/rest/greenhopper/1.0/rapid/charts/scopechangeburndownchart':
+            issueKeys = fixtures.sprintIssues.get(int(query['sprintId']), [])
+            return self.sendJson(200, {'issueToSummary': {key: {} for key in issueKeys}})
+        match = re.match(r'^/rest/agile/latest/issue/(.+)$', url.path)
+        if match:
+            if match.group(1) not in fixtures.issues:
+                return self.sendJson(404, {'errorMessages': ['Issue does not exist']})
+            return self.sendJson(200, getIssue(fixtures.issues[match.group(1)], None))
+        if url.path == '/rest/api/2/search':
+            return self.sendJson(200, searchIssues(fixtures, query))
+        if url.path == '/rest/dev-status/latest/issue/summary':
+            pullRequests = fixtures.pullRequests.get(query['issueId'], [])
+            state = 'MERGED' if any(pr['status'] == 'MERGED' for pr in pullRequests) else 'OPEN'
+            return self.sendJson(200, {'summary': {'pullrequest': {'overall': {'count': len(pullRequests), 'state': state}}}})
+        if url.path == '/rest/dev-status/latest/issue/detail':
+            return self.sendJson(200, {'detail': [{'pullRequests': fixtures.pullRequests.get(query['issueId'], [])}]})
+        self.sendJson(404, {'errorMessages': ['Unknown resource: ' + url.path]})
+
+
+def getPage(values, query, pageSize):
+    startAt = int(query.get('startAt', 0))
+    maxResults = min(int(query.get('maxResults', pageSize)), pageSize)
+    page = values[startAt:startAt + maxResults]
+    return {'startAt': startAt, 'maxResults': maxResults, 'isLast': startAt + maxResults >= len(values), 'values': page}
+
+
+#Supports the JQL the validateRelease script sends: "key in (...)" optionally followed by "AND updated >= -<n>m"
+def searchIssues(fixtures, query):
+    jql = query.get('jql', '')
+    keyMatch = re.search(r'key in \(([^)]*)\)', jql)
+    keys = [key.strip() for key in keyMatch.group(1).split(',')] if keyMatch else list(fixtures.issues.keys())
+    updatedMatch = re.search(r'updated >= -(\d+)m', jql)
+    updatedSince = time.time() - int(updatedMatch.group(1)) * 60 if updatedMatch else None
+    issues = [fixtures.issues[key] for key in keys if key in fixtures.issues and (updatedSince is None or fixtures.issues[key]['updatedAt'] >= updatedSince)]
+
+    startAt = int(query.get('startAt', 0))
+    maxResults = min(int(query.get('maxResults', searchPageSize)), searchPageSize)
+    fields = query['fields'].split(',') if 'fields' in query else None
+    return {'startAt': startAt, 'maxResults': maxResults, 'total': len(issues), \
+        'issues': [getIssue(issue, fields) for issue in issues[startAt:startAt + maxResults]]}
+
+
+def getIssue(issue, fields):
+    return {'id': issue['id'], 'key': issue['key'], \
+        'fields': {name: value for name, value in issue['fields'].items() if fields is None or name in fields}}
+
+
+def printHelp():
+    print('\tfakeJiraServer.py [--port <port>] [--tickets <count>] [--prs <per ticket>] [--sprints <count>] [--latency <ms>] [--errors <rate>]\n')
+
+
+def main(argv):
+    port = defaultPort
+    ticketCount = defaultTicketCount
+    pullRequestsPerTicket = defaultPullRequestsPerTicket
+    sprintCount = defaultSprintCount
+    latency = defaultLatency
+    errorRate = defaultErrorRate
+    try:
+        opts, args = getopt.getopt(argv, "h", ["port=", "tickets=", "prs=", "sprints=", "latency=", "errors="])
+        for opt, arg in opts:
+            if opt == '-h':
+                printHelp()
+                sys.exit()
+            elif opt == '--port':
+                port = int(arg)
+            elif opt == '--tickets':
+                ticketCount = int(arg)
+            elif opt == '--prs':
+                pullRequestsPerTicket = int(arg)
+            elif opt == '--sprints':
+                sprintCount = int(arg)
+            elif opt == '--latency':
+                latency = float(arg) / 1000
+            elif opt == '--errors':
+                errorRate = float(arg)
+    except (getopt.GetoptError, ValueError):
+        printHelp()
+        sys.exit(2)
+
+    server = FakeJiraServer(FixtureSet(ticketCount, pullRequestsPerTicket, sprintCount), port, latency, errorRate)
+    print('Serving board \'' + fixtureBoardName + '\' release ' + fixtureRelease + ' on ' + server.getUrl())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
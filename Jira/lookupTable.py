@@ -0,0 +1,46 @@
+import json
+import os
+import threading
+
+
+
+#Persistent board and sprint id lookups per Jira host, so repeat runs can skip discovery entirely.
+# Boards are remembered by name, sprints by board, release and requested sprint states
+class LookupTable:
+    def __init__(self, path, host):
+        self.path = path
+        self.host = host
+        self.lock = threading.Lock()
+        self.data = {}
+        if os.path.exists(path):
+            with open(path) as lookupFile:
+                self.data = json.load(lookupFile)
+        self.hostData = self.data.setdefault(host, {'boards': {}, 'sprints': {}})
+
+    def getBoardId(self, jiraBoard):
+        return self.hostData['boards'].get(jiraBoard)
+
+    def setBoardId(self, jiraBoard, boardId):
+        with self.lock:
+            self.hostData['boards'][jiraBoard] = boardId
+            self.save()
+
+    def getSprints(self, boardId, releaseNumber, sprintStates):
+        return self.hostData['sprints'].get(getSprintKey(boardId, releaseNumber, sprintStates))
+
+    #Sprints are stored as [id, name, state] lists
+    def setSprints(self, boardId, releaseNumber, sprintStates, sprints):
+        with self.lock:
+            self.hostData['sprints'][getSprintKey(boardId, releaseNumber, sprintStates)] = sprints
+            self.save()
+
+    def save(self):
+        temporaryPath = self.path + '.tmp'
+        with open(temporaryPath, 'w') as lookupFile:
+            json.dump(self.data, lookupFile, indent=2)
+        os.replace(temporaryPath, self.path)
+
+
+#Keyed on the MR release name the sprints are matched on, so sprint lists matched on the bare number are not reused
+def getSprintKey(boardId, releaseNumber, sprintStates):
+    return str(boardId) + '/MR' + str(releaseNumber) + '/' + sprintStates
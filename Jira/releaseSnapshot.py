@@ -0,0 +1,71 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+
+##### Used as a safety margin (in minutes) when asking Jira for issues updated since the last run, so clock
+#####   skew between this host and the Jira host can not hide an update
+updatedMarginMinutes = 5
+
+
+
+class ReleaseSnapshot:
+    #A reset snapshot ignores what was stored and refreshes every ticket, then saves over it
+    def __init__(self, path, reset=False):
+        self.path = path
+        self.lastRun = None
+        self.tickets = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path) and not reset:
+            with open(path) as snapshotFile:
+                data = json.load(snapshotFile)
+            self.lastRun = data['lastRun']
+            self.tickets = data['tickets']
+
+    def minutesSinceLastRun(self):
+        return int(math.ceil((time.time() - self.lastRun) / 60.0)) + updatedMarginMinutes
+
+    def hasTicket(self, key):
+        return self.lastRun is not None and key in self.tickets
+
+    def getTicket(self, key):
+        return self.tickets[key]['ticket']
+
+    #Storing a ticket that changed since it was stored drops its pull requests so the next lookup fetches them
+    # again, an unchanged ticket keeps them
+    def setTicket(self, key, ticket, updated):
+        with self.lock:
+            record = self.tickets.get(key)
+            if record is not None and updated is not None and record['updated'] == updated:
+                record['ticket'] = ticket
+            else:
+                self.tickets[key] = {'ticket': ticket, 'updated': updated}
+
+    def hasPullRequests(self, key):
+        return key in self.tickets and 'pullRequests' in self.tickets[key]
+
+    def getPullRequests(self, key):
+        record = self.tickets[key]
+        return record['prCount'], record['prState'], record['pullRequests']
+
+    def setPullRequests(self, key, prCount, prState, pullRequests):
+        with self.lock:
+            record = self.tickets[key]
+            record['prCount'] = prCount
+            record['prState'] = prState
+            record['pullRequests'] = pullRequests
+
+    #Only the tickets still in the release are kept, and runStarted becomes the "updated since" point for the next run
+    def save(self, runStarted, keys):
+        keys = set(keys)
+        data = {'lastRun': runStarted, 'tickets': {key: record for key, record in self.tickets.items() if key in keys}}
+        temporaryPath = self.path + '.tmp'
+        with open(temporaryPath, 'w') as snapshotFile:
+            json.dump(data, snapshotFile)
+        os.replace(temporaryPath, self.path)
+
+
+def getSnapshotPath(directory, jiraBoard, releaseNumber):
+    return os.path.join(directory, re.sub(r'[^A-Za-z0-9_.-]', '_', jiraBoard) + '_MR' + str(releaseNumber) + '.json')
@@ -0,0 +1,275 @@
+import csv
+import html
+import json
+
+from termcolor import colored
+
+##### Used as the list of output formats that can be selected on the command line
+outputFormats = ['console', 'json', 'csv', 'html']
+
+
+
+#A renderer writes release reports to one output stream. render() may be called once per report (batch mode
+# writes every report to the same stream) and close() finishes the stream once all reports are written.
+# Streaming mode skips render() and calls beginReport, renderSprint per sprint as it completes, then endReport
+class ReportRenderer:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def render(self, report):
+        self.beginReport(report)
+        for sprintResult in report.sprints:
+            self.renderSprint(report, sprintResult)
+        self.endReport(report)
+
+    def beginReport(self, report):
+        pass
+
+    def renderSprint(self, report, sprintResult):
+        pass
+
+    def endReport(self, report):
+        pass
+
+    def close(self):
+        self.stream.flush()
+
+
+#The batch console report lists every sprint's tickets before any pull request. When streaming, each sprint's
+# tickets are followed directly by their pull requests instead
+class ConsoleRenderer(ReportRenderer):
+    def write(self, text=''):
+        print(text, file=self.stream)
+
+    def beginReport(self, report):
+        self.renderHeader(report)
+        if report.boardId is not None:
+            self.write("\nGetting tickets and PR Status for release: MR" + str(report.releaseNumber))
+
+    def renderSprint(self, report, sprintResult):
+        self.renderSprintTickets(report, sprintResult)
+        for ticketResult in sprintResult.tickets:
+            self.renderTicketPullRequests(report, ticketResult)
+
+    def endReport(self, report):
+        if report.boardId is not None:
+            self.renderFooter(report)
+
+    def render(self, report):
+        self.renderHeader(report)
+        if report.boardId is None:
+            return
+
+        self.write("\nGetting tickets for release: MR" + str(report.releaseNumber))
+        for sprintResult in report.sprints:
+            self.renderSprintTickets(report, sprintResult)
+
+        ticketResults = report.getTicketResults()
+        self.write("\nGetting PR Status for " + colored(str(len(ticketResults)), 'yellow', attrs=[]) + " tickets in release MR" + str(report.releaseNumber))
+        for ticketResult in ticketResults:
+            self.renderTicketPullRequests(report, ticketResult)
+
+        self.renderFooter(report)
+
+    def renderHeader(self, report):
+        self.write("\n")
+        self.write("*****************************Validating Release MR" + str(report.releaseNumber) + "*****************************")
+        self.write("\nGetting id for board: " + report.jiraBoard)
+        if report.boardId is None:
+            self.write("\t" + colored("No board found named: ", 'red', attrs=[]) \
+                + colored("'" + report.jiraBoard + "'", 'yellow', attrs=['bold']) \
+                + colored(" Skipping report.", 'red', attrs=[]))
+            return
+        self.write("\tFound board id: " + str(report.boardId))
+
+        self.write("\nGetting sprints for release MR" + str(report.releaseNumber))
+        for sprint in report.sprintsFound:
+            self.write("\tFound sprint: " + colored(sprint.name, 'yellow', attrs=[]) + " with id: " + str(sprint.id))
+
+    def renderSprintTickets(self, report, sprintResult):
+        self.write("\tFound " + colored(str(len(sprintResult.tickets)), 'yellow', attrs=['bold']) + " tickets in sprint " + colored(sprintResult.sprint.name, 'magenta', attrs=[]))
+        if report.releaseCreation == False:
+            for ticketResult in sprintResult.tickets:
+                ticket = ticketResult.ticket
+                self.write('\t\t{:<40s}{:<40s}{:<40s}{:<40s}{:<40s}'.format("Found ticket: " \
+                    + colored(ticket.key, 'cyan', attrs=[]), "with Fix Version: " \
+                    + colored(ticket.fixVersion, 'cyan', attrs=[]), "for Component: " \
+                    + colored(ticket.component, 'cyan', attrs=[]), "with Labels:" \
+                    + colored(ticket.labels, 'cyan', attrs=[]), "with ActivityType: " \
+                    + colored(ticket.activityType, 'cyan', attrs=[])))
+
+    def renderTicketPullRequests(self, report, ticketResult):
+        if report.releaseCreation == True:
+            return
+        ticket = ticketResult.ticket
+        self.write('\t{:<71s}{:<15s}{:<26s}{:<35s}'.format("Ticket: " + colored(str(ticket.key), 'yellow', attrs=[]) \
+            + " has " + colored(str(ticketResult.prCount), 'yellow', attrs=[]) + " pull requests and a state of: ", \
+            colored(ticketResult.prState, 'magenta', attrs=[]), \
+            " and an activity type of: ", \
+            colored(ticket.activityType, 'yellow', attrs=[])))
+        if int(ticketResult.prCount) > 0:
+            for pullRequest in ticketResult.pullRequests:
+                self.write('\t\t{:<45s}{:<45s}{:<30s}{:<35s}{:<100s}'.format("Repository: " + colored(pullRequest.repo, 'cyan', attrs=[]), \
+                    "Merge branch: " + colored(pullRequest.branch, 'cyan', attrs=[]), \
+                    "Status: " + colored(pullRequest.status, 'cyan', attrs=[]), \
+                    "Author: " + colored(pullRequest.author, 'cyan', attrs=[]), \
+                    "Approvers: " + colored(getPRApprovers(pullRequest), 'cyan', attrs=[])))
+            self.write("\n")
+
+    def renderFooter(self, report):
+        if report.releaseCreation == True:
+            releaseIndex = report.releaseIndex
+            self.write("\tLocated " + colored(releaseIndex.mergedCount, 'yellow', attrs=[]) \
+                + " Pull Request in " + colored('MERGED', 'cyan', attrs=[]) \
+                + " status to " + colored('DEVELOPMENT', 'cyan', attrs=[]) + " branch")
+
+            self.write("\nGenerating " + colored('Release Branch Creation Report', 'magenta', attrs=[]) \
+                + " for PRs " + colored('MERGED', 'cyan', attrs=[]) \
+                + " to the " + colored('DEVELOPMENT', 'cyan', attrs=[]) \
+                + " branch for " + colored('MR' + str(report.releaseNumber), 'yellow', attrs=[]))
+
+            for repo in releaseIndex.ticketsByRepo:
+                ticketsForRepo = releaseIndex.getTicketsForRepo(repo)
+                if len(ticketsForRepo) > 0:
+                    self.write("\tRepository: " + repo)
+                    for ticket in ticketsForRepo:
+                        self.write('\t\t' + colored(ticket, 'yellow', attrs=[]))
+
+            incorrectFixVersions = releaseIndex.getTicketsWithIncorrectFixVersion()
+            if len(incorrectFixVersions) > 0:
+                self.write('\n\t' + colored('Tickets that have a', 'cyan', attrs=[]) + ' ' + colored('suspicious fix version', 'red', attrs=[]))
+                for ticket, fixVersion in incorrectFixVersions.items():
+                    self.write('\t\t' + colored(ticket, 'yellow', attrs=[]) + " Fix Version: " + colored(fixVersion, 'red', attrs=[]))
+
+        self.write("\n*****************************Validation Complete*****************************\n")
+
+
+#Writes one JSON document per report on its own line, so a batch run produces a JSON Lines file
+class JsonRenderer(ReportRenderer):
+    def beginReport(self, report):
+        self.stream.write('{"board": ' + json.dumps(report.jiraBoard) + ', "release": ' + json.dumps(str(report.releaseNumber)) \
+            + ', "boardId": ' + json.dumps(report.boardId) + ', "sprints": [')
+        self.firstSprint = True
+
+    def renderSprint(self, report, sprintResult):
+        if not self.firstSprint:
+            self.stream.write(', ')
+        self.firstSprint = False
+        sprint = sprintResult.sprint
+        json.dump({'id': sprint.id, 'name': sprint.name, 'state': sprint.state, \
+            'tickets': [ticketResultToDict(ticketResult) for ticketResult in sprintResult.tickets]}, self.stream)
+
+    def endReport(self, report):
+        self.stream.write(']')
+        if report.releaseCreation == True and report.releaseIndex is not None:
+            self.stream.write(', "releaseBranchCreation": ')
+            json.dump(releaseIndexToDict(report.releaseIndex), self.stream)
+        self.stream.write('}\n')
+
+
+#Writes one row per pull request (or one row for a ticket without pull requests) under a single header row
+class CsvRenderer(ReportRenderer):
+    def __init__(self, stream):
+        ReportRenderer.__init__(self, stream)
+        self.writer = csv.writer(stream)
+        self.writer.writerow(['board', 'release', 'sprint', 'ticket', 'fixVersion', 'component', 'labels', 'activityType', \
+            'prCount', 'prState', 'repo', 'branch', 'status', 'author', 'approvers'])
+
+    def renderSprint(self, report, sprintResult):
+        for ticketResult in sprintResult.tickets:
+            ticket = ticketResult.ticket
+            ticketColumns = [report.jiraBoard, report.releaseNumber, sprintResult.sprint.name, ticket.key, nullable(ticket.fixVersion), \
+                nullable(ticket.component), nullable(ticket.labels), nullable(ticket.activityType), ticketResult.prCount, ticketResult.prState]
+            if len(ticketResult.pullRequests) == 0:
+                self.writer.writerow(ticketColumns + ['', '', '', '', ''])
+            for pullRequest in ticketResult.pullRequests:
+                self.writer.writerow(ticketColumns + [pullRequest.repo, pullRequest.branch, pullRequest.status, pullRequest.author, \
+                    ';'.join(getApproverNames(pullRequest))])
+
+
+#Writes a static HTML email body with one section per report
+class HtmlRenderer(ReportRenderer):
+    def __init__(self, stream):
+        ReportRenderer.__init__(self, stream)
+        self.stream.write('<html>\n<body style="font-family: sans-serif;">\n')
+
+    def beginReport(self, report):
+        self.stream.write('<h2>Validating Release MR' + html.escape(str(report.releaseNumber)) + ' for ' + html.escape(report.jiraBoard) + '</h2>\n')
+        if report.boardId is None:
+            self.stream.write('<p style="color: red;">No board found named: ' + html.escape(report.jiraBoard) + '</p>\n')
+
+    def renderSprint(self, report, sprintResult):
+        self.stream.write('<h3>' + html.escape(sprintResult.sprint.name) + ' (' + str(len(sprintResult.tickets)) + ' tickets)</h3>\n')
+        self.stream.write('<table border="1" cellspacing="0" cellpadding="4">\n<tr><th>Ticket</th><th>Fix Version</th><th>Component</th>' \
+            + '<th>Labels</th><th>Activity Type</th><th>PRs</th><th>PR State</th><th>Repository</th><th>Merge Branch</th>' \
+            + '<th>Status</th><th>Author</th><th>Approvers</th></tr>\n')
+        for ticketResult in sprintResult.tickets:
+            ticket = ticketResult.ticket
+            ticketCells = [ticket.key, nullable(ticket.fixVersion) or '', nullable(ticket.component) or '', nullable(ticket.labels) or '', \
+                nullable(ticket.activityType) or '', ticketResult.prCount, ticketResult.prState]
+            pullRequestCells = [[pr.repo, pr.branch, pr.status, pr.author, ', '.join(getApproverNames(pr))] for pr in ticketResult.pullRequests]
+            for cells in pullRequestCells or [['', '', '', '', '']]:
+                self.stream.write('<tr>' + ''.join('<td>' + html.escape(str(cell)) + '</td>' for cell in ticketCells + cells) + '</tr>\n')
+        self.stream.write('</table>\n')
+
+    def endReport(self, report):
+        if report.releaseCreation == True and report.releaseIndex is not None:
+            releaseIndex = report.releaseIndex
+            self.stream.write('<h3>Release Branch Creation Report</h3>\n<p>Located ' + str(releaseIndex.mergedCount) \
+                + ' Pull Requests in MERGED status to the DEVELOPMENT branch</p>\n<ul>\n')
+            for repo in releaseIndex.ticketsByRepo:
+                ticketsForRepo = releaseIndex.getTicketsForRepo(repo)
+                if len(ticketsForRepo) > 0:
+                    self.stream.write('<li>' + html.escape(repo) + ': ' + html.escape(', '.join(ticketsForRepo)) + '</li>\n')
+            self.stream.write('</ul>\n')
+            incorrectFixVersions = releaseIndex.getTicketsWithIncorrectFixVersion()
+            if len(incorrectFixVersions) > 0:
+                self.stream.write('<p style="color: red;">Tickets that have a suspicious fix version</p>\n<ul>\n')
+                for ticket, fixVersion in incorrectFixVersions.items():
+                    self.stream.write('<li>' + html.escape(ticket) + ' Fix Version: ' + html.escape(fixVersion) + '</li>\n')
+                self.stream.write('</ul>\n')
+
+    def close(self):
+        self.stream.write('</body>\n</html>\n')
+        ReportRenderer.close(self)
+
+
+def createRenderer(outputFormat, stream):
+    if outputFormat == 'json':
+        return JsonRenderer(stream)
+    if outputFormat == 'csv':
+        return CsvRenderer(stream)
+    if outputFormat == 'html':
+        return HtmlRenderer(stream)
+    return ConsoleRenderer(stream)
+
+
+def getApproverNames(pullRequest):
+    return [reviewer.name for reviewer in pullRequest.reviewers if reviewer.didApprove]
+
+
+def getPRApprovers(pullRequest):
+    approvers = getApproverNames(pullRequest)
+    return str(approvers) if len(approvers) > 0 else "None"
+
+
+#The console report prints '<null>' for missing ticket fields, machine-readable formats use null instead
+def nullable(value):
+    return None if value == '<null>' else value
+
+
+def ticketResultToDict(ticketResult):
+    ticket = ticketResult.ticket
+    return {'key': ticket.key, 'id': ticket.id, 'fixVersion': nullable(ticket.fixVersion), 'component': nullable(ticket.component), \
+        'labels': [] if nullable(ticket.labels) is None else ticket.labels.split(','), 'activityType': nullable(ticket.activityType), \
+        'prCount': ticketResult.prCount, 'prState': ticketResult.prState, \
+        'pullRequests': [{'repo': pr.repo, 'branch': pr.branch, 'status': pr.status, 'author': pr.author, \
+            'reviewers': [{'name': reviewer.name, 'approved': reviewer.didApprove} for reviewer in pr.reviewers], \
+            'approvers': getApproverNames(pr)} for pr in ticketResult.pullRequests]}
+
+
+def releaseIndexToDict(releaseIndex):
+    return {'mergedCount': releaseIndex.mergedCount, \
+        'repositories': [{'repo': repo, 'tickets': releaseIndex.getTicketsForRepo(repo)} for repo in releaseIndex.ticketsByRepo \
+            if len(releaseIndex.ticketsByRepo[repo]) > 0], \
+        'suspiciousFixVersions': [{'ticket': ticket, 'fixVersion': fixVersion} for ticket, fixVersion in releaseIndex.getTicketsWithIncorrectFixVersion().items()]}
@@ -0,0 +1,112 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+
+##### Used as the default time to live (in seconds) for each class of Jira endpoint. Boards rarely change,
+#####   closed sprints never should, and dev-status moves every time a PR is opened, reviewed or merged
+defaultTtls = {
+    'board': 7 * 24 * 60 * 60,
+    'sprint': 60 * 60,
+    'closedSprint': 30 * 24 * 60 * 60,
+    'issue': 15 * 60,
+    'search': 15 * 60,
+    'devStatus': 5 * 60,
+    'other': 5 * 60,
+}
+
+##### Used to classify a url into an endpoint class when the caller does not supply one
+endpointPatterns = [
+    ('devStatus', re.compile(r'^/rest/dev-status/')),
+    ('search', re.compile(r'^/rest/api/2/search')),
+    ('issue', re.compile(r'^/rest/agile/latest/issue/')),
+    ('sprint', re.compile(r'^/rest/agile/latest/board/\d+/sprint|^/rest/greenhopper/')),
+    ('board', re.compile(r'^/rest/agile/latest/board')),
+]
+
+
+
+class CachedResponse:
+    def __init__(self, url, content, headers):
+        self.url = url
+        self.status_code = 200
+        self.content = content
+        self.headers = headers
+        self.fromCache = True
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class CacheEntry:
+    def __init__(self, content, headers, fetchedAt):
+        self.content = content
+        self.headers = headers
+        self.fetchedAt = fetchedAt
+
+    def conditionalHeaders(self):
+        headers = {}
+        if 'ETag' in self.headers:
+            headers['If-None-Match'] = self.headers['ETag']
+        if 'Last-Modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+
+class ResponseCache:
+    def __init__(self, path, ttls=None, offline=False):
+        self.ttls = dict(defaultTtls)
+        self.ttls.update(ttls or {})
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (user TEXT, url TEXT, content BLOB, headers TEXT, fetchedAt REAL, PRIMARY KEY (user, url))')
+        self.connection.commit()
+
+    def lookup(self, user, url):
+        with self.lock:
+            row = self.connection.execute('SELECT content, headers, fetchedAt FROM responses WHERE user = ? AND url = ?', (user, url)).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(row[0], json.loads(row[1]), row[2])
+
+    def isFresh(self, entry, endpointClass):
+        return time.time() - entry.fetchedAt < self.ttls.get(endpointClass, self.ttls['other'])
+
+    def store(self, user, url, response):
+        headers = {name: response.headers[name] for name in ('ETag', 'Last-Modified', 'Content-Type') if name in response.headers}
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', (user, url, response.content, json.dumps(headers), time.time()))
+            self.connection.commit()
+
+    def touch(self, user, url):
+        with self.lock:
+            self.connection.execute('UPDATE responses SET fetchedAt = ? WHERE user = ? AND url = ?', (time.time(), user, url))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def getEndpointClass(url):
+    for endpointClass, pattern in endpointPatterns:
+        if pattern.match(url):
+            return endpointClass
+    return 'other'
+
+
+#Parses a "class=seconds,class=seconds" command line value into a ttl dictionary
+def parseTtls(value):
+    ttls = {}
+    for item in value.split(','):
+        endpointClass, seconds = item.split('=')
+        if endpointClass.strip() not in defaultTtls:
+            raise ValueError('Unknown endpoint class: ' + endpointClass)
+        ttls[endpointClass.strip()] = int(seconds)
+    return ttls
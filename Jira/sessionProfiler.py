@@ -0,0 +1,162 @@
+import json
+import math
+import re
+import threading
+import time
+
+##### Used to turn a url into its endpoint template: the query string is dropped and ids and issue keys in the
+#####   path are replaced (not the version in /rest/api/2), so /rest/agile/latest/board/7/sprint is counted as
+#####   /rest/agile/latest/board/{id}/sprint
+templatePatterns = [
+    (re.compile(r'/[A-Z][A-Z0-9_]+-[0-9]+(?=/|$)'), '/{key}'),
+    (re.compile(r'(?<!/api)/[0-9]+(?=/|$)'), '/{id}'),
+]
+
+##### Used as the latency percentiles shown in the cost summary
+summaryPercentiles = (0.5, 0.95, 0.99)
+
+##### Used as the windows (in seconds) the peak request rate is reported over, to compare against Jira's rate limits
+peakWindows = (1, 60)
+
+
+
+class EndpointStats:
+    def __init__(self):
+        self.calls = 0
+        self.requests = 0
+        self.cacheHits = 0
+        self.revalidated = 0
+        self.retries = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latencies = []
+
+
+#Records every Session.performGet call: its endpoint template, where the response came from ('network',
+# 'cache' for a fresh cache hit, or 'revalidated' for a 304 answered from the cache), its latency including
+# retries and rate limiter waits, and the response bytes. Calls are also counted per report in batch runs, and
+# kept as trace events when a trace file is written
+class SessionProfiler:
+    def __init__(self, tracing=False):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.endpoints = {}
+        self.reports = {}
+        self.currentReport = None
+        self.requestTimes = []
+        self.tracing = tracing
+        self.traceEvents = []
+
+    #Calls recorded from now on count against the given report
+    def beginReport(self, name):
+        with self.lock:
+            self.currentReport = name
+            self.reports.setdefault(name, EndpointStats())
+
+    def recordRetry(self, url):
+        with self.lock:
+            self.getStats(getEndpointTemplate(url)).retries += 1
+
+    #Every attempt sent to Jira, retries included, counts towards the request rate
+    def recordRequest(self):
+        with self.lock:
+            self.requestTimes.append(time.perf_counter() - self.started)
+
+    def record(self, url, started, source, statusCode, size):
+        finished = time.perf_counter()
+        template = getEndpointTemplate(url)
+        with self.lock:
+            for stats in (self.getStats(template), self.reports.get(self.currentReport)):
+                if stats is None:
+                    continue
+                stats.calls += 1
+                stats.requests += 1 if source != 'cache' else 0
+                stats.cacheHits += 1 if source == 'cache' else 0
+                stats.revalidated += 1 if source == 'revalidated' else 0
+                stats.errors += 1 if statusCode >= 400 else 0
+                stats.bytes += size
+                stats.latencies.append(finished - started)
+            if self.tracing:
+                self.traceEvents.append({'name': template, 'cat': source, 'ph': 'X', 'pid': 1, 'tid': threading.get_ident(), \
+                    'ts': round((started - self.started) * 1000000), 'dur': round((finished - started) * 1000000), \
+                    'args': {'url': url, 'status': statusCode, 'bytes': size, 'report': self.currentReport}})
+
+    def getStats(self, template):
+        if template not in self.endpoints:
+            self.endpoints[template] = EndpointStats()
+        return self.endpoints[template]
+
+    #The most requests sent within any window of the given number of seconds
+    def getPeakRequests(self, seconds):
+        requestTimes = sorted(self.requestTimes)
+        peak = 0
+        first = 0
+        for last in range(len(requestTimes)):
+            while requestTimes[last] - requestTimes[first] >= seconds:
+                first += 1
+            peak = max(peak, last - first + 1)
+        return peak
+
+    def printSummary(self, stream):
+        elapsed = time.perf_counter() - self.started
+        with self.lock:
+            endpoints = sorted(self.endpoints.items(), key=lambda item: sum(item[1].latencies), reverse=True)
+            reports = list(self.reports.items())
+            requestCount = len(self.requestTimes)
+            peaks = [(seconds, self.getPeakRequests(seconds)) for seconds in peakWindows]
+
+        header = '{:<64s}{:>8s}{:>10s}{:>8s}{:>8s}{:>8s}{:>8s}' + '{:>10s}' * len(summaryPercentiles) + '{:>12s}{:>12s}'
+        row = '{:<64s}{:>8d}{:>10d}{:>8d}{:>8d}{:>8d}{:>8d}' + '{:>10.1f}' * len(summaryPercentiles) + '{:>12.2f}{:>12.1f}'
+        print('\nJira API cost summary', file=stream)
+        print(header.format('endpoint', 'calls', 'requests', 'cached', '304', 'retries', 'errors', \
+            *['p' + str(int(fraction * 100)) + ' (ms)' for fraction in summaryPercentiles], 'total (s)', 'KB'), file=stream)
+        for template, stats in endpoints + [('total', sumStats([stats for template, stats in endpoints]))]:
+            print(row.format(template, stats.calls, stats.requests, stats.cacheHits, stats.revalidated, stats.retries, stats.errors, \
+                *[getPercentile(stats.latencies, fraction) * 1000 for fraction in summaryPercentiles], sum(stats.latencies), stats.bytes / 1024.0), file=stream)
+
+        if len(reports) > 1:
+            print('\n{:<64s}{:>8s}{:>10s}{:>8s}{:>12s}{:>12s}'.format('report', 'calls', 'requests', 'cached', 'total (s)', 'KB'), file=stream)
+            for name, stats in reports:
+                print('{:<64s}{:>8d}{:>10d}{:>8d}{:>12.2f}{:>12.1f}'.format(name, stats.calls, stats.requests, stats.cacheHits, sum(stats.latencies), \
+                    stats.bytes / 1024.0), file=stream)
+
+        print('\n{0} requests sent to Jira in {1:.1f}s ({2:.1f}/s), peak {3}'.format(requestCount, elapsed, requestCount / elapsed if elapsed > 0 else 0, \
+            ', '.join('{0} in {1}s'.format(peak, seconds) for seconds, peak in peaks)), file=stream)
+
+    #Writes the recorded calls in the Chrome trace event format, viewable in chrome://tracing or Perfetto with one
+    # row per session thread
+    def writeTrace(self, path):
+        with self.lock:
+            events = list(self.traceEvents)
+        with open(path, 'w') as traceFile:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, traceFile)
+        return len(events)
+
+
+def getEndpointTemplate(url):
+    template = url.split('?', 1)[0]
+    for pattern, replacement in templatePatterns:
+        template = pattern.sub(replacement, template)
+    return template
+
+
+def sumStats(statsList):
+    total = EndpointStats()
+    for stats in statsList:
+        total.calls += stats.calls
+        total.requests += stats.requests
+        total.cacheHits += stats.cacheHits
+        total.revalidated += stats.revalidated
+        total.retries += stats.retries
+        total.errors += stats.errors
+        total.bytes += stats.bytes
+        total.latencies.extend(stats.latencies)
+    return total
+
+
+#Nearest rank percentile of a list of latencies (0 for an empty list)
+def getPercentile(values, fraction):
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeJiraServer import FakeJiraServer, FixtureSet
+
+
+#One fake Jira on a free port for the whole session, small enough that a full report runs in about a second
+@pytest.fixture(scope='session')
+def jiraServer():
+    server = FakeJiraServer(FixtureSet(ticketCount=40, pullRequestsPerTicket=1), port=0)
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
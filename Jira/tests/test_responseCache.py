@@ -0,0 +1,55 @@
+import pytest
+
+import validateRelease
+from fakeJiraServer import fixtureBoardName, fixtureRelease
+from responseCache import defaultTtls
+
+##### Used as a --cachettl value that makes every cached response stale, so each call is revalidated
+expiredTtls = ','.join(endpointClass + '=0' for endpointClass in defaultTtls)
+
+
+#Runs validateRelease.main() against the fake server and returns the report it wrote. A failed run raises SystemExit
+def runReport(server, outputPath, *extraArgs):
+    argv = ['-u', 'tester', '-p', 'tester', '-b', fixtureBoardName, '-n', fixtureRelease, '-r', 'n', \
+        '--host', server.getUrl(), '-o', str(outputPath)] + list(extraArgs)
+    server.resetStats()
+    validateRelease.main(argv)
+    with open(str(outputPath)) as report:
+        return report.read()
+
+
+def test_staleEntriesAreRevalidatedWithTheirETag(jiraServer, tmp_path):
+    cachePath = str(tmp_path / 'cache.db')
+    fetched = runReport(jiraServer, tmp_path / 'fetched.txt', '--cache', cachePath)
+    fetchedRequests = jiraServer.requestCount
+    assert fetchedRequests > 0
+    assert jiraServer.notModifiedCount == 0
+
+    revalidated = runReport(jiraServer, tmp_path / 'revalidated.txt', '--cache', cachePath, '--cachettl', expiredTtls)
+    assert revalidated == fetched
+    assert jiraServer.requestCount == fetchedRequests
+    assert jiraServer.notModifiedCount == fetchedRequests
+
+
+def test_freshEntriesAreServedWithoutRequests(jiraServer, tmp_path):
+    cachePath = str(tmp_path / 'cache.db')
+    fetched = runReport(jiraServer, tmp_path / 'fetched.txt', '--cache', cachePath)
+    cached = runReport(jiraServer, tmp_path / 'cached.txt', '--cache', cachePath)
+    assert cached == fetched
+    assert jiraServer.requestCount == 0
+
+
+#Offline replay ignores the ttls and never contacts Jira, even when every entry has expired
+def test_offlineReplaysTheCache(jiraServer, tmp_path):
+    cachePath = str(tmp_path / 'cache.db')
+    fetched = runReport(jiraServer, tmp_path / 'fetched.txt', '--cache', cachePath)
+    replayed = runReport(jiraServer, tmp_path / 'replayed.txt', '--cache', cachePath, '--cachettl', expiredTtls, '--offline')
+    assert replayed == fetched
+    assert jiraServer.requestCount == 0
+
+
+def test_offlineWithoutCachedResponseExits(jiraServer, tmp_path):
+    with pytest.raises(SystemExit) as exited:
+        runReport(jiraServer, tmp_path / 'missing.txt', '--cache', str(tmp_path / 'empty.db'), '--offline')
+    assert exited.value.code == 2
+    assert jiraServer.requestCount == 0
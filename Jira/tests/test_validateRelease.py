@@ -0,0 +1,34 @@
+import pytest
+
+import validateRelease
+from fakeJiraServer import fixtureRelease
+
+
+@pytest.fixture
+def session(jiraServer):
+    session = validateRelease.Session('tester', 'tester', jiraServer.getUrl())
+    yield session
+    session.close()
+
+
+#The fixture board also has sprints MR0-1 to MR89-2, MR790-1, MR12-79 and Hotfix 79, which only a match anchored on
+# the MR prefix and the whole number keeps out
+def test_sprintNameMatchesWholeReleaseNumber(session):
+    sprints = validateRelease.getSprintsWithName(session, 7, fixtureRelease)
+    assert sorted(sprint.name for sprint in sprints) == ['MR79-1', 'MR79-2', 'MR79-3']
+
+
+@pytest.mark.parametrize('releaseNumber, expectedNames', [
+    (7, ['MR7-1', 'MR7-2']),
+    (12, ['MR12-1', 'MR12-2', 'MR12-7', 'MR12-79']),
+    (79, ['MR79-1', 'MR79-2', 'MR79-3']),
+    (790, ['MR790-1']),
+])
+def test_sprintNameDoesNotMatchLongerReleases(session, releaseNumber, expectedNames):
+    sprints = validateRelease.getSprintsWithName(session, 7, releaseNumber)
+    assert sorted(sprint.name for sprint in sprints) == expectedNames
+
+
+def test_sprintStatesAreFiltered(session):
+    sprints = validateRelease.getSprintsWithName(session, 7, fixtureRelease, 'active')
+    assert [(sprint.name, sprint.state) for sprint in sprints] == [('MR79-3', 'active')]
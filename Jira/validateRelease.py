@@ -1,13 +1,23 @@
 import collections
+import concurrent.futures
+import csv
 import requests
 import pprint
 import getpass
 import getopt
+import re
+import threading
+import time
 import urllib
 import sys
 
 from colorama import init
 from termcolor import colored
+from responseCache import ResponseCache, CachedResponse, getEndpointClass, parseTtls
+from releaseSnapshot import ReleaseSnapshot, getSnapshotPath
+from reportRenderers import createRenderer, outputFormats
+from lookupTable import LookupTable
+from sessionProfiler import SessionProfiler
 init()
 
 ##### Used as a global variable to determine what the 'develop' branch should
@@ -18,25 +28,172 @@ developBranch = 'development'
 #####   This is set as a global for convenience in changing to run against other domains
 host = 'https://jira.mydomain.com'
 
+##### Used as global defaults for the concurrent fetch engine. Concurrency is the number of
+#####   requests in flight at once, rate limit is the max requests per second sent to the host
+#####   (0 disables it) and retries is how many times a 429/5xx response is retried with backoff
+defaultConcurrency = 8
+defaultRateLimit = 0
+defaultRetries = 4
+retryStatusCodes = (429, 500, 502, 503, 504)
+
+##### Used as global settings for bulk issue retrieval through JQL search. Keys are searched in batches
+#####   of searchBatchSize and only the fields read by the get*ForTicket helpers are requested
+searchBatchSize = 200
+searchPageSize = 100
+ticketFields = 'fixVersions,components,labels,customfield_12112'
+
+##### Used as the page size when discovering boards and sprints
+discoveryPageSize = 50
+
+
+
+class RateLimiter:
+    def __init__(self, requestsPerSecond):
+        self.interval = 1.0 / requestsPerSecond if requestsPerSecond > 0 else 0
+        self.nextSlot = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.interval == 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.nextSlot)
+            self.nextSlot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+#Remembers what a session already fetched so reports sharing the session (batch mode) never fetch the same
+# issue or dev-status twice. Concurrent lookups of the same key wait on the one fetch in flight
+class FetchMemo:
+    def __init__(self):
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def getOrFetch(self, kind, key, fetch):
+        with self.lock:
+            future = self.futures.get((kind, key))
+            isOwner = future is None
+            if isOwner:
+                future = concurrent.futures.Future()
+                self.futures[(kind, key)] = future
+        if isOwner:
+            try:
+                future.set_result(fetch())
+            except BaseException as e:
+                with self.lock:
+                    del self.futures[(kind, key)]
+                future.set_exception(e)
+        return future.result()
+
+    def getAll(self, kind, keys):
+        values = {}
+        with self.lock:
+            for key in keys:
+                future = self.futures.get((kind, key))
+                if future is not None and future.done() and future.exception() is None:
+                    values[key] = future.result()
+        return values
+
+    def putAll(self, kind, values):
+        with self.lock:
+            for key, value in values.items():
+                future = concurrent.futures.Future()
+                future.set_result(value)
+                self.futures[(kind, key)] = future
 
 
 class Session:
-    def __init__(self, username, password, host):
+    def __init__(self, username, password, host, concurrency=defaultConcurrency, rateLimit=defaultRateLimit, retries=defaultRetries, cache=None, lookupTable=None, profiler=None):
         self.username = username
         self.password = password
         self.host = host
+        self.cache = cache
+        self.lookupTable = lookupTable
+        self.profiler = profiler
+        self.concurrency = max(1, int(concurrency))
+        self.retries = retries
+        self.rateLimiter = RateLimiter(float(rateLimit))
         self.jiraSession = requests.Session()
         self.jiraSession.auth = (username, password)
-        self.auth = self.jiraSession.post(host)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.jiraSession.mount('http://', adapter)
+        self.jiraSession.mount('https://', adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        self.memo = FetchMemo()
+        if cache is None or not cache.offline:
+            self.auth = self.jiraSession.post(host)
+
+    #Every Jira call goes through here, so with a profiler each one is recorded with where its response came from
+    def performGet(self, url, endpointClass=None):
+        if self.profiler is None:
+            return self.getResponse(url, endpointClass)[0]
+        started = time.perf_counter()
+        response, source = self.getResponse(url, endpointClass)
+        self.profiler.record(url, started, source, response.status_code, len(response.content) if source == 'network' else 0)
+        return response
+
+    #The endpoint class selects the cache ttl and defaults to one derived from the url. Returns the response and
+    # its source: 'network', 'cache' or 'revalidated' (a 304 answered from the cache)
+    def getResponse(self, url, endpointClass=None):
+        if self.cache is None:
+            return self.fetch(url, {}), 'network'
+
+        entry = self.cache.lookup(self.username, self.host + url)
+        if entry is not None and (self.cache.offline or self.cache.isFresh(entry, endpointClass or getEndpointClass(url))):
+            return CachedResponse(self.host + url, entry.content, entry.headers), 'cache'
+        if self.cache.offline:
+            print("\t" + colored("Offline mode and no cached response for: ", 'red', attrs=[]) \
+                + colored(url, 'yellow', attrs=['bold']) \
+                + colored(" Exiting script.", 'red', attrs=[]))
+            sys.exit(2)
 
-    def performGet(self, url):
-        return self.jiraSession.get(self.host + url)
+        response = self.fetch(url, entry.conditionalHeaders() if entry is not None else {})
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(self.username, self.host + url)
+            return CachedResponse(self.host + url, entry.content, entry.headers), 'revalidated'
+        if response.status_code == 200:
+            self.cache.store(self.username, self.host + url, response)
+        return response, 'network'
+
+    def fetch(self, url, headers):
+        attempt = 0
+        while True:
+            self.rateLimiter.wait()
+            if self.profiler is not None:
+                self.profiler.recordRequest()
+            response = self.jiraSession.get(self.host + url, headers=headers)
+            if response.status_code not in retryStatusCodes or attempt >= self.retries:
+                return response
+            if self.profiler is not None:
+                self.profiler.recordRetry(url)
+            time.sleep(getRetryDelay(response, attempt))
+            attempt += 1
+
+    #Runs fetch over every item on the session's thread pool and returns the results in the order of items
+    def map(self, fetch, items):
+        return list(self.executor.map(fetch, items))
+
+    def close(self):
+        self.executor.shutdown()
+        self.jiraSession.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def getRetryDelay(response, attempt):
+    retryAfter = response.headers.get('Retry-After')
+    if retryAfter is not None and retryAfter.isdigit():
+        return int(retryAfter)
+    return min(0.5 * (2 ** attempt), 30)
 
 
 class Sprint:
-    def __init__(self, id, name):
+    def __init__(self, id, name, state=None):
         self.id = id
         self.name = name
+        self.state = state
 
 
 class Ticket:
@@ -65,54 +222,148 @@ class Reviewer:
         self.didApprove = didApprove
 
 
+#The result model of one run: a report per board and release, holding the sprints, their tickets and each
+# ticket's pull requests. Renderers in reportRenderers turn it into console, JSON, CSV or HTML output
+class TicketResult:
+    def __init__(self, ticket, prCount=0, prState=None, pullRequests=()):
+        self.ticket = ticket
+        self.prCount = prCount
+        self.prState = prState
+        self.pullRequests = list(pullRequests)
 
-def getBoardId(session, jiraBoard):
-    encodedName = urllib.parse.quote(jiraBoard)
-    response = session.performGet('/rest/agile/latest/board?name=' + encodedName)
-    if len(response.json()['values']) > 0:
-        boardId = response.json()['values'][0]['id']
-        print("\tFound board id: " + str(boardId))
-        return boardId
-    else:
-        print("\t" + colored("No board found named: ", 'red', attrs=[]) \
-            + colored("'" + jiraBoard + "'", 'yellow', attrs=['bold']) \
-            + colored(" Exiting script.", 'red', attrs=[]))
-        sys.exit(2)
 
+class SprintResult:
+    def __init__(self, sprint, tickets):
+        self.sprint = sprint
+        self.tickets = tickets
+
+
+class ReleaseReport:
+    def __init__(self, jiraBoard, releaseNumber, releaseCreation):
+        self.jiraBoard = jiraBoard
+        self.releaseNumber = releaseNumber
+        self.releaseCreation = releaseCreation
+        self.boardId = None
+        self.sprintsFound = list()
+        self.sprints = list()
+        self.releaseIndex = None
+
+    def getTicketResults(self):
+        return [ticketResult for sprintResult in self.sprints for ticketResult in sprintResult.tickets]
 
-def getSprintsWithName(session, boardId, releaseNumber):
-    response = session.performGet('/rest/agile/latest/board/' + str(boardId) + '/sprint')
 
+
+#Finds the board by name, paging through every board Jira matches. An exact (case insensitive) name match wins,
+# otherwise the first board Jira returns is used
+def getBoardId(session, jiraBoard):
+    if session.lookupTable is not None and session.lookupTable.getBoardId(jiraBoard) is not None:
+        return session.lookupTable.getBoardId(jiraBoard)
+
+    boards = getAllPages(session, '/rest/agile/latest/board', {'name': jiraBoard})
+    if len(boards) == 0:
+        return None
+    exactMatches = [board for board in boards if board['name'].lower() == jiraBoard.lower()]
+    boardId = (exactMatches or boards)[0]['id']
+    if session.lookupTable is not None:
+        session.lookupTable.setBoardId(jiraBoard, boardId)
+    return boardId
+
+
+#Finds every sprint on the board whose name contains the release number as a whole number, so release 7 matches
+# "MR7-1" but not "MR17-1" or "MR70-1". sprintStates is a comma separated state filter applied by Jira (empty for all)
+def getSprintsWithName(session, boardId, releaseNumber, sprintStates=''):
+    if session.lookupTable is not None and session.lookupTable.getSprints(boardId, releaseNumber, sprintStates) is not None:
+        return [Sprint(id, name, state) for id, name, state in session.lookupTable.getSprints(boardId, releaseNumber, sprintStates)]
+
+    #The release is named by its MR prefix, as in the fix versions, so "MR12-7" or "Hotfix 7" are not sprints of release 7
+    releasePattern = re.compile(r'(?<![0-9])MR' + re.escape(str(releaseNumber)) + r'(?![0-9])')
     sprints = []
-    for value in response.json()['values']:
-        if value['name'].find(str(releaseNumber)) != -1:
-            name = value['name']
-            id = value['id']
-            sprints.append(Sprint(id, name))
-            print("\tFound sprint: " + colored(name, 'yellow', attrs=[]) + " with id: " + str(id))
+    for value in getAllPages(session, '/rest/agile/latest/board/' + str(boardId) + '/sprint', {'state': sprintStates} if sprintStates else {}):
+        if releasePattern.search(value['name']):
+            sprints.append(Sprint(value['id'], value['name'], value.get('state')))
+
+    #Only a release whose sprints are all closed is remembered, an open release can still gain sprints
+    if session.lookupTable is not None and len(sprints) > 0 and all(sprint.state == 'closed' for sprint in sprints):
+        session.lookupTable.setSprints(boardId, releaseNumber, sprintStates, [[sprint.id, sprint.name, sprint.state] for sprint in sprints])
     return sprints
 
 
-def getTicketsForSprint(session, boardId, sprint, releaseCreation):
-    response = session.performGet('/rest/greenhopper/1.0/rapid/charts/scopechangeburndownchart?rapidViewId=' + str(boardId) + '&sprintId=' + str(sprint.id))
-    print("\tFound " + colored(str(len(response.json()['issueToSummary'])), 'yellow', attrs=['bold']) + " tickets in sprint " + colored(sprint.name, 'magenta', attrs=[]))
-    
+#Returns the values of every page of an agile REST resource, following startAt until Jira reports the last page
+def getAllPages(session, url, params):
+    values = []
+    startAt = 0
+    while True:
+        query = dict(params)
+        query.update({'startAt': startAt, 'maxResults': discoveryPageSize})
+        page = session.performGet(url + '?' + urllib.parse.urlencode(query)).json()
+        values.extend(page.get('values', []))
+        startAt += len(page.get('values', []))
+        if page.get('isLast', True) or len(page.get('values', [])) == 0:
+            return values
+
+
+def getTicketsForSprint(session, boardId, sprint, snapshot=None):
+    response = session.performGet('/rest/greenhopper/1.0/rapid/charts/scopechangeburndownchart?rapidViewId=' + str(boardId) + '&sprintId=' + str(sprint.id), \
+        'closedSprint' if sprint.state == 'closed' else None)
+    return getTicketsForKeys(session, list(response.json()['issueToSummary'].keys()), snapshot)
+
+
+#Returns a Ticket for every key, in key order. With a snapshot from a previous run, tickets already in the
+# snapshot are only fetched again when Jira reports them updated since that run
+def getTicketsForKeys(session, issueKeys, snapshot=None):
+    fields = ticketFields if snapshot is None else ticketFields + ',updated'
+    issuesByKey = session.memo.getAll('issue', issueKeys)
+    knownKeys = [issueKey for issueKey in issueKeys if issueKey not in issuesByKey and snapshot is not None and snapshot.hasTicket(issueKey)]
+    knownKeySet = set(knownKeys)
+    newKeys = [issueKey for issueKey in issueKeys if issueKey not in issuesByKey and issueKey not in knownKeySet]
+
+    fetchedIssues = searchIssues(session, newKeys, fields)
+    missingKeys = [issueKey for issueKey in newKeys if issueKey not in fetchedIssues]
+    for issueKey, issue in zip(missingKeys, session.map(lambda issueKey: session.performGet('/rest/agile/latest/issue/' + str(issueKey)).json(), missingKeys)):
+        fetchedIssues[issueKey] = issue
+    if len(knownKeys) > 0:
+        updatedIssues = searchIssues(session, knownKeys, fields, 'updated >= -' + str(snapshot.minutesSinceLastRun()) + 'm')
+        fetchedIssues.update({issueKey: issue for issueKey, issue in updatedIssues.items() if issueKey in knownKeySet})
+    session.memo.putAll('issue', fetchedIssues)
+    issuesByKey.update(fetchedIssues)
+
     tickets = []
-    for issueKey in response.json()['issueToSummary'].keys():
-        issueResponse = session.performGet('/rest/agile/latest/issue/' + str(issueKey))
-        issue = issueResponse.json()
-        ticket = Ticket(issue['id'], issue['key'], getFixVersionForTicket(issue), getComponentForTicket(issue), getLabelsForTicket(issue), getActivityTypeForTicket(issue))
+    for issueKey in issueKeys:
+        if issueKey in issuesByKey:
+            issue = issuesByKey[issueKey]
+            ticket = Ticket(issue['id'], issue['key'], getFixVersionForTicket(issue), getComponentForTicket(issue), getLabelsForTicket(issue), getActivityTypeForTicket(issue))
+            if snapshot is not None:
+                snapshot.setTicket(issueKey, vars(ticket), issue['fields'].get('updated'))
+        else:
+            ticket = Ticket(**snapshot.getTicket(issueKey))
         tickets.append(ticket)
-        if releaseCreation == False:
-            print('\t\t{:<40s}{:<40s}{:<40s}{:<40s}{:<40s}'.format("Found ticket: " \
-                + colored(ticket.key, 'cyan', attrs=[]), "with Fix Version: " \
-                + colored(ticket.fixVersion, 'cyan', attrs=[]), "for Component: " \
-                + colored(ticket.component, 'cyan', attrs=[]), "with Labels:" \
-                + colored(ticket.labels, 'cyan', attrs=[]), "with ActivityType: " \
-                + colored(ticket.activityType, 'cyan', attrs=[])))
     return tickets
 
 
+#Retrieves issues in bulk through JQL search and returns them keyed by issue key. Keys that the search
+# does not return under the same key (e.g. issues moved to another project) are left for the caller
+def searchIssues(session, issueKeys, fields=ticketFields, jqlFilter=''):
+    batches = [issueKeys[i:i + searchBatchSize] for i in range(0, len(issueKeys), searchBatchSize)]
+    issuesByKey = {}
+    for issues in session.map(lambda batch: searchIssueBatch(session, batch, fields, jqlFilter), batches):
+        for issue in issues:
+            issuesByKey[issue['key']] = issue
+    return issuesByKey
+
+
+def searchIssueBatch(session, issueKeys, fields, jqlFilter):
+    jql = 'key in (' + ','.join(issueKeys) + ')' + (' AND ' + jqlFilter if jqlFilter else '')
+    issues = []
+    startAt = 0
+    while True:
+        query = urllib.parse.urlencode({'jql': jql, 'fields': fields, 'validateQuery': 'warn', 'startAt': startAt, 'maxResults': searchPageSize})
+        page = session.performGet('/rest/api/2/search?' + query).json()
+        issues.extend(page.get('issues', []))
+        startAt = page.get('startAt', startAt) + len(page.get('issues', []))
+        if len(page.get('issues', [])) == 0 or startAt >= page.get('total', 0):
+            return issues
+
+
 def getFixVersionForTicket(issue):
     if "fixVersions" in issue['fields']:
         if len(issue['fields']['fixVersions']) > 0:
@@ -150,94 +401,90 @@ def getLabelsForTicket(issue):
     return '<null>'
 
 
-def getPRStatusForTicketId(session, ticket, releaseCreation):
+def fetchPRStatusForTicketId(session, ticket):
     response = session.performGet('/rest/dev-status/latest/issue/summary?issueId=' + str(ticket.id))
     prCount = response.json()['summary']['pullrequest']['overall']['count']
     prState = response.json()['summary']['pullrequest']['overall']['state']
-    if releaseCreation == False:
-        print('\t{:<71s}{:<15s}{:<26s}{:<35s}'.format("Ticket: " + colored(str(ticket.key), 'yellow', attrs=[]) \
-            + " has " + colored(str(prCount), 'yellow', attrs=[]) + " pull requests and a state of: ", \
-            colored(prState, 'magenta', attrs=[]), \
-            " and an activity type of: ", \
-            colored(ticket.activityType, 'yellow', attrs=[])))
-    return prCount
+    return prCount, prState
 
 
-def getPRDetailsForTicketId(session, ticket, releaseCreation):
+def fetchPRDetailsForTicketId(session, ticket):
     response = session.performGet('/rest/dev-status/latest/issue/detail?issueId=' + str(ticket.id) + '&applicationType=stash&dataType=pullrequest')
     detailElement = response.json()['detail'][0]
-    if len(detailElement['pullRequests']) > 0:
-        pullRequests = list()
-        for pr in detailElement['pullRequests']:
-            repo = pr['destination']['repository']['name']
-            branch = pr['destination']['branch']
-            status = pr['status']
-            author = pr['author']['name']
-            reviewers = list()
-            for r in pr['reviewers']:
-                reviewers.append(Reviewer(r['name'], r['approved']))
-            
-            pullRequest = PullRequest(repo, branch, status, author, reviewers, ticket)
-            pullRequests.append(pullRequest)
-            if releaseCreation == False:
-                print('\t\t{:<45s}{:<45s}{:<30s}{:<35s}{:<100s}'.format("Repository: " + colored(repo, 'cyan', attrs=[]), \
-                    "Merge branch: " + colored(branch, 'cyan', attrs=[]), \
-                    "Status: " + colored(status, 'cyan', attrs=[]), \
-                    "Author: " + colored(author, 'cyan', attrs=[]), \
-                    "Approvers: " + colored(getPRApprovers(pullRequest), 'cyan', attrs=[])))
-
-        return pullRequests
-
-
-def getPRApprovers(pullRequest):
-    approvers = list()
-    for reviewer in pullRequest.reviewers:
-        if reviewer.didApprove:
-            approvers.append(reviewer.name)
-
-    return str(approvers) if len(approvers) > 0 else "None"
-
-
-def getPRCountWithMergesToDevelop(pullRequests):
-    mergeCount = 0
-    for pr in pullRequests:
-        if pr.status == 'MERGED' and pr.branch.lower() in developBranch:
-            mergeCount += 1
-    return mergeCount
-
-
-def getUniqueReposForPRsToDevelop(pullRequests):
-    uniqueRepos = list()
-    for pullRequest in pullRequests:
-        if pullRequest.repo not in uniqueRepos and pullRequest.branch.lower() in developBranch:
-            uniqueRepos.append(pullRequest.repo)
-    return uniqueRepos
-
-
-def getTicketsForRepo(pullRequests, repo):
-    ticketsForRepo = list()
-    for pr in pullRequests:
-        if pr.repo in repo and pr.branch.lower() in developBranch and pr.status == 'MERGED' and pr.ticket.key not in ticketsForRepo:
-            ticketsForRepo.append(pr.ticket.key)
-
-    ticketsForRepo.sort()
-    if len(ticketsForRepo) > 0:
-        print("\tRepository: " + repo)
-        for ticket in ticketsForRepo:
-            print('\t\t' + colored(ticket, 'yellow', attrs=[]))
-
-
-def getTicketsWithIncorrectFixVersion(pullRequests, releaseNumber):
-    ticketsForRepo = {}
-    for pr in pullRequests:
-        if pr.branch.lower() in developBranch and pr.status == 'MERGED' and pr.ticket.key not in ticketsForRepo and not pr.ticket.fixVersion.startswith("MR" + str(releaseNumber)):
-            ticketsForRepo[pr.ticket.key] = pr.ticket.fixVersion
-
-    ticketsForRepoOrdered = collections.OrderedDict(sorted(ticketsForRepo.items()))
-    if len(ticketsForRepoOrdered) > 0:
-        print('\n\t' + colored('Tickets that have a', 'cyan', attrs=[]) + ' ' + colored('suspicious fix version', 'red', attrs=[]))
-        for ticket, fixVersion in ticketsForRepoOrdered.items():
-            print('\t\t' + colored(ticket, 'yellow', attrs=[]) + " Fix Version: " + colored(fixVersion, 'red', attrs=[]))
+    pullRequests = list()
+    for pr in detailElement['pullRequests']:
+        repo = pr['destination']['repository']['name']
+        branch = pr['destination']['branch']
+        status = pr['status']
+        author = pr['author']['name']
+        reviewers = list()
+        for r in pr['reviewers']:
+            reviewers.append(Reviewer(r['name'], r['approved']))
+
+        pullRequests.append(PullRequest(repo, branch, status, author, reviewers, ticket))
+    return pullRequests
+
+
+#Fetches the dev-status summary for a ticket and, only when it has pull requests, the dev-status detail.
+# Tickets that were not refreshed since the snapshot was taken reuse the snapshot's pull requests
+def fetchPullRequestsForTicket(session, ticket, snapshot=None):
+    if snapshot is not None and snapshot.hasPullRequests(ticket.key):
+        prCount, prState, pullRequests = snapshot.getPullRequests(ticket.key)
+        return prCount, prState, [pullRequestFromDict(pr, ticket) for pr in pullRequests]
+
+    prCount, prState, pullRequests = session.memo.getOrFetch('pullRequests', ticket.id, lambda: fetchDevStatusForTicket(session, ticket))
+    if snapshot is not None:
+        snapshot.setPullRequests(ticket.key, prCount, prState, [pullRequestToDict(pr) for pr in pullRequests])
+    return prCount, prState, pullRequests
+
+
+def fetchDevStatusForTicket(session, ticket):
+    prCount, prState = fetchPRStatusForTicketId(session, ticket)
+    pullRequests = fetchPRDetailsForTicketId(session, ticket) if int(prCount) > 0 else list()
+    return prCount, prState, pullRequests
+
+
+def pullRequestToDict(pullRequest):
+    return {'repo': pullRequest.repo, 'branch': pullRequest.branch, 'status': pullRequest.status, 'author': pullRequest.author, \
+        'reviewers': [vars(reviewer) for reviewer in pullRequest.reviewers]}
+
+
+def pullRequestFromDict(pullRequest, ticket):
+    return PullRequest(pullRequest['repo'], pullRequest['branch'], pullRequest['status'], pullRequest['author'], \
+        [Reviewer(**reviewer) for reviewer in pullRequest['reviewers']], ticket)
+
+
+def isPRToDevelop(pullRequest):
+    return pullRequest.branch.lower() in developBranch
+
+
+#Aggregates everything the Release Branch Creation Report needs in one pass over the pull requests:
+# the merged count, repo -> ticket set (repos in the order they are first seen) and ticket -> suspicious fix version
+class ReleaseIndex:
+    def __init__(self, releaseNumber, pullRequests=()):
+        self.fixVersionPrefix = "MR" + str(releaseNumber)
+        self.mergedCount = 0
+        self.ticketsByRepo = collections.OrderedDict()
+        self.incorrectFixVersions = {}
+        for pullRequest in pullRequests:
+            self.add(pullRequest)
+
+    def add(self, pullRequest):
+        if not isPRToDevelop(pullRequest):
+            return
+        ticketsForRepo = self.ticketsByRepo.setdefault(pullRequest.repo, set())
+        if pullRequest.status != 'MERGED':
+            return
+        self.mergedCount += 1
+        ticketsForRepo.add(pullRequest.ticket.key)
+        if not pullRequest.ticket.fixVersion.startswith(self.fixVersionPrefix):
+            self.incorrectFixVersions.setdefault(pullRequest.ticket.key, pullRequest.ticket.fixVersion)
+
+    def getTicketsForRepo(self, repo):
+        return sorted(self.ticketsByRepo[repo])
+
+    def getTicketsWithIncorrectFixVersion(self):
+        return collections.OrderedDict(sorted(self.incorrectFixVersions.items()))
 
 
 def yes_or_no(question):
@@ -269,6 +516,11 @@ def argsNotSet(username, password, jiraBoard, releaseNumber, releaseCreation):
     return False
 
 
+##### Used as the list of command line options that may be given without the required ones (which then get prompted for)
+optionalOpts = ("-c", "--concurrency", "--ratelimit", "--cache", "--cachettl", "--offline", "--snapshot", "--full", "-f", "--format", "-o", "--output", "--stream", "--sprintstate", "--lookup", "--host", \
+    "--profile", "--trace")
+
+
 def printHelp():
     print('\t' + colored("validateRelease.py ", 'yellow', attrs=[]) \
         + colored("-u ", 'cyan', attrs=[]) + colored("<username> ", 'magenta', attrs=[]) \
@@ -277,6 +529,28 @@ def printHelp():
         + colored("-n ", 'cyan', attrs=[]) + colored("<releasenum> ", 'magenta', attrs=[]) \
         + colored("-r ", 'cyan', attrs=[]) + colored("<releasereport> ", 'magenta', attrs=[]) \
         + "\n")
+    print('\tOptional: ' \
+        + colored("-c ", 'cyan', attrs=[]) + colored("<concurrency> ", 'magenta', attrs=[]) \
+        + colored("--ratelimit ", 'cyan', attrs=[]) + colored("<requests/sec> ", 'magenta', attrs=[]) \
+        + colored("--cache ", 'cyan', attrs=[]) + colored("<cachefile> ", 'magenta', attrs=[]) \
+        + colored("--cachettl ", 'cyan', attrs=[]) + colored("<class=seconds,...> ", 'magenta', attrs=[]) \
+        + colored("--offline ", 'cyan', attrs=[]) \
+        + colored("--snapshot ", 'cyan', attrs=[]) + colored("<snapshotdir> ", 'magenta', attrs=[]) \
+        + colored("--full ", 'cyan', attrs=[]) \
+        + colored("-f ", 'cyan', attrs=[]) + colored("<console|json|csv|html> ", 'magenta', attrs=[]) \
+        + colored("-o ", 'cyan', attrs=[]) + colored("<outputfile> ", 'magenta', attrs=[]) \
+        + colored("--stream ", 'cyan', attrs=[]) \
+        + colored("--sprintstate ", 'cyan', attrs=[]) + colored("<future,active,closed> ", 'magenta', attrs=[]) \
+        + colored("--lookup ", 'cyan', attrs=[]) + colored("<lookupfile> ", 'magenta', attrs=[]) \
+        + colored("--host ", 'cyan', attrs=[]) + colored("<jiraurl> ", 'magenta', attrs=[]) \
+        + colored("--profile ", 'cyan', attrs=[]) \
+        + colored("--trace ", 'cyan', attrs=[]) + colored("<tracefile> ", 'magenta', attrs=[]) \
+        + "\n")
+    print('\tBatch: ' + colored("validateRelease.py ", 'yellow', attrs=[]) \
+        + colored("-u ", 'cyan', attrs=[]) + colored("<username> ", 'magenta', attrs=[]) \
+        + colored("-p ", 'cyan', attrs=[]) + colored("<password> ", 'magenta', attrs=[]) \
+        + colored("--batch ", 'cyan', attrs=[]) + colored("<batchfile> ", 'magenta', attrs=[]) \
+        + "\n")
 
 
 def main(argv):
@@ -285,8 +559,27 @@ def main(argv):
     jiraBoard = ''
     releaseNumber = ''
     releaseCreation = ''
+    concurrency = defaultConcurrency
+    rateLimit = defaultRateLimit
+    cacheFile = ''
+    cacheTtls = {}
+    offline = False
+    snapshotDirectory = ''
+    fullRefresh = False
+    batchFile = ''
+    outputFormat = 'console'
+    outputFile = ''
+    streaming = False
+    sprintStates = ''
+    lookupFile = ''
+    jiraHost = host
+    profile = False
+    traceFile = ''
     try:
-        opts, args = getopt.getopt(argv,"hu:p:b:n:r:",["username=","password=","board=","releasenum=","releasereport="])
+        opts, args = getopt.getopt(argv,"hu:p:b:n:r:c:f:o:",["username=","password=","board=","releasenum=","releasereport=","concurrency=","ratelimit=", \
+            "cache=","cachettl=","offline","snapshot=","full","batch=","format=","output=","stream","sprintstate=","lookup=","host=", \
+            "profile","trace="])
+        requiredOpts = [opt for opt, arg in opts if opt not in optionalOpts]
         for opt, arg in opts:
             if opt == '-h':
                 printHelp()
@@ -304,81 +597,213 @@ def main(argv):
                     releaseCreation = False
                 else:
                     releaseCreation = True
+            elif opt in ("-c", "--concurrency"):
+                concurrency = int(arg)
+            elif opt == "--ratelimit":
+                rateLimit = float(arg)
+            elif opt == "--cache":
+                cacheFile = arg
+            elif opt == "--cachettl":
+                cacheTtls = parseTtls(arg)
+            elif opt == "--offline":
+                offline = True
+            elif opt == "--snapshot":
+                snapshotDirectory = arg
+            elif opt == "--full":
+                fullRefresh = True
+            elif opt == "--batch":
+                batchFile = arg
+            elif opt in ("-f", "--format"):
+                if arg.lower() not in outputFormats:
+                    raise ValueError('Unknown output format: ' + arg)
+                outputFormat = arg.lower()
+            elif opt in ("-o", "--output"):
+                outputFile = arg
+            elif opt == "--stream":
+                streaming = True
+            elif opt == "--sprintstate":
+                sprintStates = arg.lower()
+            elif opt == "--lookup":
+                lookupFile = arg
+            elif opt == "--host":
+                jiraHost = arg.rstrip('/')
+            elif opt == "--profile":
+                profile = True
+            elif opt == "--trace":
+                traceFile = arg
+
+        if offline and cacheFile == '':
+            print("\t" + colored("--offline requires a --cache file to replay from", 'red', attrs=['bold']) + "\n")
+            sys.exit(2)
 
-        if len(opts) > 0 and argsNotSet(username, password, jiraBoard, releaseNumber, releaseCreation):
+        if batchFile != '':
+            if username == '' or password == '':
+                print('\tBatch mode requires the username and password command line arguments.')
+                printHelp()
+                sys.exit(2)
+        elif len(requiredOpts) > 0 and argsNotSet(username, password, jiraBoard, releaseNumber, releaseCreation):
             print('\tIf using command line arguments, then all command line arguments must be specified.')
             printHelp()
             sys.exit(2)
-        elif len(opts) == 0:
+        elif len(requiredOpts) == 0:
             username = input("Enter jira username: ")
             password = getpass.getpass("Enter jira password: ")
             jiraBoard = input("Enter jira board name: ")
             releaseNumber = input("Enter release number: ")
             releaseCreation = yes_or_no("Generate release branch creation report")
 
-    except getopt.GetoptError:
+    except (getopt.GetoptError, ValueError):
         printHelp()
         sys.exit(2)
 
 
-    print("\n")
-    print("*****************************Validating Release MR" + str(releaseNumber) + "*****************************")    
-    print("\nGetting id for board: " + jiraBoard)
-    session = Session(username, password, host)
-    boardId = getBoardId(session, jiraBoard)
-
-    print("\nGetting sprints for release MR" + releaseNumber)
-    sprints = getSprintsWithName(session, boardId, releaseNumber)
-
-    ticketsInRelease = list()
-    print("\nGetting tickets for release: MR" + releaseNumber)
-    for sprint in sprints:
-        ticketsInSprint = getTicketsForSprint(session, boardId, sprint, releaseCreation)
-        for ticket in ticketsInSprint:
-            ticketsInRelease.append(ticket)
+    if batchFile != '':
+        try:
+            reports = readBatchFile(batchFile)
+        except ValueError as error:
+            print("\t" + colored(str(error), 'red', attrs=['bold']) + "\n")
+            sys.exit(2)
+    else:
+        reports = [(jiraBoard, releaseNumber, releaseCreation)]
+
+    #One authenticated session is shared by every report so tickets that appear on several boards are only fetched once
+    cache = ResponseCache(cacheFile, cacheTtls, offline) if cacheFile != '' else None
+    lookup = LookupTable(lookupFile, jiraHost) if lookupFile != '' else None
+    profiler = SessionProfiler(traceFile != '') if profile or traceFile != '' else None
+    session = Session(username, password, jiraHost, concurrency, rateLimit, cache=cache, lookupTable=lookup, profiler=profiler)
+    renderers = {}
+    failedReports = 0
+    for jiraBoard, releaseNumber, releaseCreation in reports:
+        renderer = getRenderer(renderers, outputFormat, outputFile, jiraBoard, releaseNumber)
+        if profiler is not None:
+            profiler.beginReport(jiraBoard + ' MR' + str(releaseNumber))
+        if not runReleaseReport(session, renderer, jiraBoard, releaseNumber, releaseCreation, snapshotDirectory, fullRefresh, streaming, sprintStates):
+            failedReports += 1
+    session.close()
+    for renderer in renderers.values():
+        renderer.close()
+        if renderer.stream is not sys.stdout:
+            renderer.stream.close()
+
+    #The cost summary goes to stderr so it never mixes with a json, csv or html report on stdout
+    if profile:
+        profiler.printSummary(sys.stderr)
+    if traceFile != '':
+        print('Wrote a trace of {0} Jira calls to {1}'.format(profiler.writeTrace(traceFile), traceFile), file=sys.stderr)
+
+    if failedReports > 0:
+        sys.exit(2)
 
-    print("\nGetting PR Status for " + colored(str(len(ticketsInRelease)), 'yellow', attrs=[]) + " tickets in release MR" + str(releaseNumber))
-    pullRequestsInTickets = list()
-    for ticket in ticketsInRelease:
-        prCount = getPRStatusForTicketId(session, ticket, releaseCreation)
-        if int(prCount) > 0:
-            pullRequestsInTicket = getPRDetailsForTicketId(session, ticket, releaseCreation)
-            for pr in pullRequestsInTicket:
-                pullRequestsInTickets.append(pr)
 
-            if releaseCreation == False:
-                print("\n")
+#Returns the renderer for a report's output file, creating it on first use. The output file name may contain
+# {board} and {release} placeholders to write one file per report, otherwise all reports share one file (or stdout)
+def getRenderer(renderers, outputFormat, outputFile, jiraBoard, releaseNumber):
+    path = outputFile.replace('{board}', re.sub(r'[^A-Za-z0-9_.-]', '_', jiraBoard)).replace('{release}', str(releaseNumber))
+    if path not in renderers:
+        renderers[path] = createRenderer(outputFormat, open(path, 'w', newline='') if path != '' else sys.stdout)
+    return renderers[path]
+
+
+#Reads a batch file with one "board,releasenum,releasereport" line per report. Blank lines and lines starting with # are skipped.
+# The releasereport column is optional and, like the -r argument, anything other than n or false turns the report on
+def readBatchFile(batchFile):
+    reports = []
+    with open(batchFile, newline='') as batch:
+        reader = csv.reader(batch)
+        for row in reader:
+            if len(row) == 0 or row[0].strip() == '' or row[0].startswith('#'):
+                continue
+            if len(row) < 2 or row[1].strip() == '':
+                raise ValueError('{0}:{1}: expected "board,releasenum,releasereport" but found "{2}"'.format(batchFile, reader.line_num, ','.join(row)))
+            releaseCreation = row[2].strip().lower() not in ('n', 'false') if len(row) > 2 else True
+            reports.append((row[0].strip(), row[1].strip(), releaseCreation))
+    return reports
+
+
+#Gathers everything a report shows into a ReleaseReport without printing anything
+def collectReleaseReport(session, jiraBoard, releaseNumber, releaseCreation, snapshot=None, sprintStates=''):
+    report = ReleaseReport(jiraBoard, releaseNumber, releaseCreation)
+    report.boardId = getBoardId(session, jiraBoard)
+    if report.boardId is None:
+        return report
+
+    report.sprintsFound = getSprintsWithName(session, report.boardId, releaseNumber, sprintStates)
+    for sprint in report.sprintsFound:
+        tickets = getTicketsForSprint(session, report.boardId, sprint, snapshot)
+        report.sprints.append(SprintResult(sprint, [TicketResult(ticket) for ticket in tickets]))
+
+    ticketResults = report.getTicketResults()
+    prResults = session.map(lambda ticketResult: fetchPullRequestsForTicket(session, ticketResult.ticket, snapshot), ticketResults)
+    for ticketResult, (prCount, prState, pullRequests) in zip(ticketResults, prResults):
+        ticketResult.prCount = prCount
+        ticketResult.prState = prState
+        ticketResult.pullRequests = pullRequests
 
     if releaseCreation == True:
-        mergedPRs = getPRCountWithMergesToDevelop(pullRequestsInTickets)
-        print("\tLocated " + colored(mergedPRs, 'yellow', attrs=[]) \
-            + " Pull Request in " + colored('MERGED', 'cyan', attrs=[]) \
-            + " status to " + colored('DEVELOPMENT', 'cyan', attrs=[]) + " branch")
-
-        print("\nGenerating " + colored('Release Branch Creation Report', 'magenta', attrs=[]) \
-            + " for PRs " + colored('MERGED', 'cyan', attrs=[]) \
-            + " to the " + colored('DEVELOPMENT', 'cyan', attrs=[]) \
-            + " branch for " + colored('MR' + str(releaseNumber), 'yellow', attrs=[]))
-
-        uniqueRepos = getUniqueReposForPRsToDevelop(pullRequestsInTickets)
-        for repo in uniqueRepos:
-            getTicketsForRepo(pullRequestsInTickets, repo)
-            
-        getTicketsWithIncorrectFixVersion(pullRequestsInTickets, releaseNumber)
+        report.releaseIndex = ReleaseIndex(releaseNumber, [pr for ticketResult in ticketResults for pr in ticketResult.pullRequests])
+    return report
+
+
+#Renders a report while it is being gathered. Tickets of the next sprint are fetched while the pull requests of
+# earlier sprints are still in flight, and each sprint is rendered (in sprint order) as soon as its pull requests are
+# in. Rendered sprints are not kept, only their ticket keys and the release index, so memory stays bounded.
+# Returns the report and the keys of every ticket in the release
+def streamReleaseReport(session, renderer, jiraBoard, releaseNumber, releaseCreation, snapshot=None, sprintStates=''):
+    report = ReleaseReport(jiraBoard, releaseNumber, releaseCreation)
+    report.boardId = getBoardId(session, jiraBoard)
+    if report.boardId is not None:
+        report.sprintsFound = getSprintsWithName(session, report.boardId, releaseNumber, sprintStates)
+        if releaseCreation == True:
+            report.releaseIndex = ReleaseIndex(releaseNumber)
+    renderer.beginReport(report)
+    renderer.stream.flush()
+
+    ticketKeys = list()
+    for sprintResult in streamSprintResults(session, report, snapshot):
+        for ticketResult in sprintResult.tickets:
+            ticketKeys.append(ticketResult.ticket.key)
+            if report.releaseIndex is not None:
+                for pullRequest in ticketResult.pullRequests:
+                    report.releaseIndex.add(pullRequest)
+        renderer.renderSprint(report, sprintResult)
+        renderer.stream.flush()
+
+    renderer.endReport(report)
+    return report, ticketKeys
+
+
+def streamSprintResults(session, report, snapshot):
+    pending = collections.deque()
+    for sprint in report.sprintsFound:
+        tickets = getTicketsForSprint(session, report.boardId, sprint, snapshot)
+        futures = [session.executor.submit(fetchPullRequestsForTicket, session, ticket, snapshot) for ticket in tickets]
+        pending.append((sprint, tickets, futures))
+        while len(pending) > 0 and all(future.done() for future in pending[0][2]):
+            yield getSprintResult(*pending.popleft())
+    while len(pending) > 0:
+        yield getSprintResult(*pending.popleft())
+
+
+def getSprintResult(sprint, tickets, futures):
+    return SprintResult(sprint, [TicketResult(ticket, *future.result()) for ticket, future in zip(tickets, futures)])
+
+
+#Runs the report for one board and release. Returns False when the board could not be found
+def runReleaseReport(session, renderer, jiraBoard, releaseNumber, releaseCreation, snapshotDirectory, fullRefresh, streaming=False, sprintStates=''):
+    runStarted = time.time()
+    snapshot = ReleaseSnapshot(getSnapshotPath(snapshotDirectory, jiraBoard, releaseNumber), fullRefresh) if snapshotDirectory != '' else None
+    if streaming:
+        report, ticketKeys = streamReleaseReport(session, renderer, jiraBoard, releaseNumber, releaseCreation, snapshot, sprintStates)
+    else:
+        report = collectReleaseReport(session, jiraBoard, releaseNumber, releaseCreation, snapshot, sprintStates)
+        renderer.render(report)
+        ticketKeys = [ticketResult.ticket.key for ticketResult in report.getTicketResults()]
 
-    print("\n*****************************Validation Complete*****************************\n")
+    if snapshot is not None and report.boardId is not None:
+        snapshot.save(runStarted, ticketKeys)
+    return report.boardId is not None
 
 
 
 if __name__ == "__main__":
     main(sys.argv[1:])
-
-
-
-
-
-
-
-
-
-	
@@ -0,0 +1,192 @@
+#############################################################################################################
+# Project               : Data Transformation Solution: Rules Engine Application
+# Description           : This python code is used in conjunction with the rules engine.
+#                           It runs ingestion as an asyncio pipeline of stages linked by bounded
+#                           queues: reading the inbound feed, resolving current state, rule
+#                           evaluation, and a write-behind sink that stores decisions to the DB
+#                           in bulk. Rule evaluation never waits on a DB round trip, and a slow
+#                           stage holds back the stages feeding it instead of buffering the feed.
+#
+# Version               : 1.0
+#############################################################################################################
+
+import asyncio
+import time
+
+from currentStateDataProvider import getCurrentStateDataBulk, updateCurrentStateDataBulk, getRecordKey
+from inboundDataProvider import saveInboundPosition
+
+##### Used as the defaults for the write-behind sink: pending decisions are written once this many are queued,
+#####   or once the oldest one has waited this many seconds
+defaultFlushSize = 500
+defaultFlushInterval = 1.0
+
+##### Used as the default number of micro-batches a pipeline queue holds before the stage feeding it has to wait
+defaultQueueSize = 4
+
+##### Used as the wait (in seconds) before a failed DB write is retried, doubled per failure up to the maximum
+retryDelay = 0.5
+maxRetryDelay = 30.0
+
+
+
+#Collects decisions from the rule actions and writes them to the DB in bulk. All DB work runs on dbExecutor,
+# which must have a single thread so lookups and writes never overlap. Decisions stay visible through
+# getPendingRecords until they are written, so lookups never miss a decision that is still queued. Writes are
+# retried until they succeed and the feed position is only saved after the decisions before it are written,
+# so after a crash a resumed run replays anything that may not have been stored (at least once). With a
+# checkpoint store, decisions already stored under their decision id are not written again
+class WriteBehindSink:
+    def __init__(self, dbExecutor, flushSize=defaultFlushSize, flushInterval=defaultFlushInterval, positionFile='', checkpointStore=None):
+        self.dbExecutor = dbExecutor
+        self.flushSize = flushSize
+        self.flushInterval = flushInterval
+        self.positionFile = positionFile
+        self.checkpointStore = checkpointStore
+        self.pending = []
+        self.writing = []
+        self.pendingKeys = {}
+        self.oldestPending = None
+        self.position = None
+        self.savedPosition = None
+        self.flushLock = asyncio.Lock()
+        self.flushNeeded = asyncio.Event()
+        self.flushCount = 0
+        self.writtenCount = 0
+
+    def add(self, record, decisionId=None):
+        self.pending.append((decisionId, record))
+        self.pendingKeys[getRecordKey(record)] = record
+        if self.oldestPending is None:
+            self.oldestPending = time.monotonic()
+        if len(self.pending) >= self.flushSize:
+            self.flushNeeded.set()
+
+    #Called once every decision of the batch ending at position has been added
+    def markPosition(self, position):
+        self.position = position
+
+    def getPendingRecords(self, keys):
+        return {key: self.pendingKeys[key] for key in keys if key in self.pendingKeys}
+
+    #The (decisionId, record) pairs not written yet, including the ones being written
+    def getPendingDecisions(self):
+        return self.writing + self.pending
+
+    def writeRecords(self, decisions, position):
+        if self.checkpointStore is not None:
+            decisions = self.checkpointStore.getUnstored(decisions)
+        if len(decisions) > 0:
+            updateCurrentStateDataBulk([record for decisionId, record in decisions])
+            if self.checkpointStore is not None:
+                self.checkpointStore.markStored([decisionId for decisionId, record in decisions])
+        if self.positionFile != '' and position is not None:
+            saveInboundPosition(self.positionFile, position)
+
+    async def flush(self):
+        async with self.flushLock:
+            if len(self.pending) == 0 and self.position == self.savedPosition:
+                return
+            decisions = self.pending
+            position = self.position
+            self.writing = decisions
+            self.pending = []
+            self.oldestPending = None
+
+            delay = retryDelay
+            while True:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(self.dbExecutor, self.writeRecords, decisions, position)
+                    break
+                except Exception as e:
+                    print('Writing {0} decisions to DB failed, retrying in {1}s: {2}'.format(len(decisions), delay, e))
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, maxRetryDelay)
+
+            for decisionId, record in decisions:
+                key = getRecordKey(record)
+                if self.pendingKeys.get(key) is record:
+                    del self.pendingKeys[key]
+            self.writing = []
+            self.savedPosition = position
+            self.flushCount += 1
+            self.writtenCount += len(decisions)
+
+    async def runFlusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flushNeeded.wait(), self.flushInterval)
+            except asyncio.TimeoutError:
+                pass
+            self.flushNeeded.clear()
+            if len(self.pending) >= self.flushSize or self.oldestPending is None \
+                    or time.monotonic() - self.oldestPending >= self.flushInterval:
+                await self.flush()
+
+
+#Runs micro-batches of (employee, position) pairs through the pipeline. evaluateBatch gets the (currentState,
+# employee) pairs of a batch and the feed position at its end, and must route its decisions to the sink. A batch
+# is only resolved once no earlier batch holding one of its employees is still waiting for evaluation, so every
+# lookup sees earlier decisions.
+# lookup resolves the current states of a list of keys on the sink's DB thread, given the states already known at
+# the same positions (or None). prefilter, when given, gets the employees of a batch and the pending decisions for
+# them on the DB thread and returns the employees to evaluate with the states it read for them
+async def runPipeline(batches, evaluateBatch, sink, queueSize=defaultQueueSize, lookup=getCurrentStateDataBulk, prefilter=None):
+    loop = asyncio.get_running_loop()
+    resolveQueue = asyncio.Queue(queueSize)
+    evaluateQueue = asyncio.Queue(queueSize)
+    inFlightKeys = set()
+    evaluated = asyncio.Condition()
+
+    async def readBatches():
+        while True:
+            batch = await loop.run_in_executor(None, next, batches, None)
+            await resolveQueue.put(batch)
+            if batch is None:
+                return
+
+    async def resolveBatches():
+        while True:
+            batch = await resolveQueue.get()
+            if batch is None:
+                await evaluateQueue.put(None)
+                return
+            keys = [(employee["employee"]["id"], employee["employee"]["storeId"]) for employee, position in batch]
+            async with evaluated:
+                await evaluated.wait_for(lambda: inFlightKeys.isdisjoint(keys))
+                inFlightKeys.update(keys)
+
+            pendingRecords = sink.getPendingRecords(keys)
+            employees = [employee for employee, position in batch]
+            knownRecords = None
+            if prefilter is not None:
+                employees, knownRecords = await loop.run_in_executor(sink.dbExecutor, prefilter, employees, pendingRecords)
+            employeeKeys = [(employee["employee"]["id"], employee["employee"]["storeId"]) for employee in employees]
+            currentStates = await loop.run_in_executor(sink.dbExecutor, lookup, employeeKeys, knownRecords)
+            currentStates = [pendingRecords.get(key, currentState) for key, currentState in zip(employeeKeys, currentStates)]
+            await evaluateQueue.put((batch, keys, employees, currentStates))
+
+    async def evaluateBatches():
+        while True:
+            item = await evaluateQueue.get()
+            if item is None:
+                return
+            batch, keys, employees, currentStates = item
+            evaluateBatch(list(zip(currentStates, employees)), batch[-1][1])
+            sink.markPosition(batch[-1][1])
+            async with evaluated:
+                inFlightKeys.difference_update(keys)
+                evaluated.notify_all()
+
+    flusher = asyncio.ensure_future(sink.runFlusher())
+    stages = [asyncio.ensure_future(stage) for stage in (readBatches(), resolveBatches(), evaluateBatches())]
+    try:
+        await asyncio.gather(*stages)
+    except BaseException:
+        for stage in stages:
+            stage.cancel()
+        raise
+    finally:
+        #Drain on shutdown: whatever was decided is written, even when a stage failed
+        flusher.cancel()
+        await sink.flush()
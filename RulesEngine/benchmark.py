@@ -0,0 +1,158 @@
+#############################################################################################################
+# Project               : Data Transformation Solution: Rules Engine Application
+# Description           : This python code benchmarks the rules engine's full ingestion path at
+#                           several scales. For every scale a registry and a change feed are
+#                           generated with feedGenerator, and rulesEngine.py is run on them in its
+#                           own process with metrics enabled. Records per second, per-rule action
+#                           latency and the peak RSS of the run are reported, and can be saved as
+#                           a baseline that later runs are compared against.
+#
+# Version               : 1.0
+#############################################################################################################
+
+import getopt
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from feedGenerator import FeedGenerator, defaultSkew
+from currentStateDataProvider import openCurrentStateStore
+from engineMetrics import getPercentile, getRecordsPerSecond
+
+##### Used as the default scales benchmarked: the number of employees in the registry, and of records in the feed
+defaultScales = [1000, 10000]
+
+##### Used as the relative slowdown (records per second or peak RSS) against the baseline that is reported as a regression
+regressionThreshold = 0.2
+
+
+
+#Writes the registry snapshot and the feed of one scale to directory. The same seed gives the same data every run
+def generateDataset(directory, scale, skew):
+    generator = FeedGenerator(skew=skew)
+    currentRecords = generator.generateCurrentState(scale)
+    storeSpec = 'snapshot:' + os.path.join(directory, 'registry.snap')
+    openCurrentStateStore(storeSpec, currentRecords).close()
+    inboundFile = os.path.join(directory, 'feed.ndjson')
+    with open(inboundFile, 'w') as output:
+        for record in generator.generateInbound(currentRecords, scale):
+            output.write(json.dumps(record) + '\n')
+    return storeSpec, inboundFile
+
+
+#Runs rulesEngine.py on a dataset in a child process, so its peak RSS is its own and nothing is shared with earlier runs
+def runScale(directory, storeSpec, inboundFile, engineName, extraArgs):
+    metricsFile = os.path.join(directory, 'metrics.json')
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rulesEngine.py'), \
+        '-t', storeSpec, '-i', inboundFile, '-e', engineName, '--metrics', metricsFile] + extraArgs
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen(command, stdout=devnull, stderr=subprocess.PIPE)
+        errors = process.stderr.read()
+        pid, status, usage = os.wait4(process.pid, 0)
+    if status != 0:
+        raise RuntimeError('rulesEngine.py failed:\n' + errors.decode('utf-8', 'replace'))
+
+    with open(metricsFile) as metrics:
+        snapshot = json.load(metrics)
+    rules = {}
+    for rulesetName, ruleName, histogram in snapshot['ruleLatency']:
+        rules[rulesetName + '.' + ruleName] = {'fires': histogram['count'], 'meanLatency': histogram['sum'] / max(histogram['count'], 1), \
+            'p95Latency': getPercentile(histogram, 0.95)}
+    #ru_maxrss is in kilobytes on Linux
+    return {'records': snapshot['records'], 'recordsPerSecond': getRecordsPerSecond(snapshot), 'elapsed': snapshot['elapsed'], \
+        'peakRss': usage.ru_maxrss * 1024, 'rules': rules}
+
+
+def compareToBaseline(results, baseline):
+    regressions = []
+    for scale, result in results.items():
+        if scale not in baseline:
+            continue
+        if result['recordsPerSecond'] < baseline[scale]['recordsPerSecond'] * (1 - regressionThreshold):
+            regressions.append('{0} records: {1:.0f} records/s vs baseline {2:.0f}'.format(scale, result['recordsPerSecond'], baseline[scale]['recordsPerSecond']))
+        if result['peakRss'] > baseline[scale]['peakRss'] * (1 + regressionThreshold):
+            regressions.append('{0} records: peak RSS {1:.1f}MB vs baseline {2:.1f}MB'.format(scale, result['peakRss'] / (1024.0 * 1024.0), \
+                baseline[scale]['peakRss'] / (1024.0 * 1024.0)))
+    return regressions
+
+
+def formatLatency(seconds):
+    return '{:.3f}'.format(seconds * 1000) if seconds is not None else '>1000'
+
+
+def printResults(results):
+    print('{:>10s}{:>14s}{:>12s}{:>16s}'.format('records', 'records/s', 'wall (s)', 'peak RSS (MB)'))
+    for scale, result in results.items():
+        print('{:>10s}{:>14.0f}{:>12.2f}{:>16.1f}'.format(scale, result['recordsPerSecond'], result['elapsed'], result['peakRss'] / (1024.0 * 1024.0)))
+    print('\n{:>10s}  {:<32s}{:>10s}{:>12s}{:>12s}'.format('records', 'rule', 'fires', 'mean (ms)', 'p95 (ms)'))
+    for scale, result in results.items():
+        for ruleName, rule in sorted(result['rules'].items()):
+            print('{:>10s}  {:<32s}{:>10d}{:>12.3f}{:>12s}'.format(scale, ruleName, rule['fires'], rule['meanLatency'] * 1000, formatLatency(rule['p95Latency'])))
+
+
+def printHelp():
+    print('\tbenchmark.py [--scales <records,...>] [-e <durable|native|compare>] [--skew <skew>] [--args "<rulesEngine.py arguments>"] [--baseline <file>] [--save]\n')
+
+
+def main(argv):
+    scales = defaultScales
+    engineName = 'durable'
+    skew = defaultSkew
+    extraArgs = []
+    baselineFile = ''
+    saveBaseline = False
+    try:
+        opts, args = getopt.getopt(argv, "he:", ["scales=", "skew=", "args=", "baseline=", "save"])
+        for opt, arg in opts:
+            if opt == '-h':
+                printHelp()
+                sys.exit()
+            elif opt == '--scales':
+                scales = [int(scale) for scale in arg.split(',')]
+            elif opt == '-e':
+                engineName = arg
+            elif opt == '--skew':
+                skew = float(arg)
+            elif opt == '--args':
+                extraArgs = shlex.split(arg)
+            elif opt == '--baseline':
+                baselineFile = arg
+            elif opt == '--save':
+                saveBaseline = True
+    except (getopt.GetoptError, ValueError):
+        printHelp()
+        sys.exit(2)
+
+    print('Benchmarking the {0} engine at {1} records\n'.format(engineName, ', '.join(str(scale) for scale in scales)))
+    results = {}
+    for scale in scales:
+        directory = tempfile.mkdtemp(prefix='rulesEngineBenchmark')
+        try:
+            storeSpec, inboundFile = generateDataset(directory, scale, skew)
+            results[str(scale)] = runScale(directory, storeSpec, inboundFile, engineName, extraArgs)
+        finally:
+            shutil.rmtree(directory)
+    printResults(results)
+
+    if baselineFile != '' and saveBaseline:
+        with open(baselineFile, 'w') as baseline:
+            json.dump(results, baseline, indent=2)
+        print('\nSaved baseline to ' + baselineFile)
+    elif baselineFile != '':
+        with open(baselineFile) as baseline:
+            regressions = compareToBaseline(results, json.load(baseline))
+        if len(regressions) > 0:
+            print('\nRegressions against ' + baselineFile + ':')
+            for regression in regressions:
+                print('\t' + regression)
+            sys.exit(1)
+        print('\nNo regressions against ' + baselineFile)
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,207 @@
+#############################################################################################################
+# Project               : Data Transformation Solution: Rules Engine Application
+# Description           : This python code reconciles a full inbound feed against the current state
+#                           in bulk, for nightly full-registry runs. Instead of sending every
+#                           record through the rules engine, the current state and the inbound
+#                           feed are loaded into numpy columns, joined on employee id and store id,
+#                           and every rule of the rulesets is evaluated for all records at once
+#                           with vectorized comparisons.
+#
+#                           The rules are the ones defined in the ruleset files: their expression
+#                           trees are taken from the native engine and evaluated over columns.
+#                           Each inbound record is compared with its own current state only, and as
+#                           in the engines the first matching rule of the record's district fires.
+#                           Every decision stores the inbound record, as the rule actions do.
+#
+# Version               : 1.0
+#############################################################################################################
+
+import getopt
+import json
+import sys
+import time
+
+import numpy
+
+import nativeEngine
+from nativeEngine import missing
+from currentStateDataProvider import getCurrentStateStore, openCurrentStateStore, setCurrentStateStore, getRecordKey, \
+    getBlankRecord, updateCurrentStateDataBulk, closeCurrentStateStore
+from inboundDataProvider import streamInboundData
+from rulesEngine import getEngineModule, registerRuleset
+
+
+
+#One column per field path of a list of records: the values, and a mask of the records that have the field.
+# Columns holding only strings are numpy string arrays so comparisons run in C; anything else stays objects.
+# The values of each parent path are kept, so employee is only looked up once for every employee.* column
+class RecordColumns:
+    def __init__(self, records):
+        self.records = records
+        self.values = {(): records}
+        self.columns = {}
+
+    def getValues(self, path):
+        if path not in self.values:
+            name = path[-1]
+            self.values[path] = [parent.get(name, missing) if type(parent) is dict else missing for parent in self.getValues(path[:-1])]
+        return self.values[path]
+
+    def get(self, path):
+        if path not in self.columns:
+            values = self.getValues(path)
+            present = numpy.array([value is not missing for value in values], dtype=bool)
+            if set(map(type, values)) <= {str, type(missing)}:
+                column = numpy.array(['' if value is missing else value for value in values], dtype=str)
+            else:
+                column = numpy.empty(len(values), dtype=object)
+                column[:] = values
+            self.columns[path] = (column, present)
+        return self.columns[path]
+
+
+#Evaluates a native engine expression for every record at once, returning a boolean mask. messageColumns are
+# the records matched by m, boundColumns the columns of the messages bound to aliases (c.current)
+def evaluateExpression(expression, messageColumns, boundColumns):
+    if expression.op == '&':
+        return evaluateExpression(expression.left, messageColumns, boundColumns) & evaluateExpression(expression.right, messageColumns, boundColumns)
+    if expression.op == '|':
+        return evaluateExpression(expression.left, messageColumns, boundColumns) | evaluateExpression(expression.right, messageColumns, boundColumns)
+
+    left, leftPresent = getOperand(expression.left, messageColumns, boundColumns)
+    if expression.op == '+':
+        return leftPresent.copy()
+    if expression.op == '-':
+        return ~leftPresent
+    right, rightPresent = getOperand(expression.right, messageColumns, boundColumns)
+    compare = nativeEngine.comparisonOperators[expression.op]
+    return leftPresent & rightPresent & numpy.asarray(compare(left, right), dtype=bool)
+
+
+def getOperand(value, messageColumns, boundColumns):
+    if not isinstance(value, nativeEngine.Field):
+        return value, True
+    columns = messageColumns if value.alias is None else boundColumns[value.alias]
+    return columns.get(value.path)
+
+
+#Returns the name of the rule that fires for each pair of current and inbound records, or None
+def classifyRecords(ruleset, currentRecords, inboundRecords):
+    currentColumns = RecordColumns(currentRecords)
+    inboundColumns = RecordColumns(inboundRecords)
+    decided = numpy.zeros(len(inboundRecords), dtype=bool)
+    ruleNames = numpy.full(len(inboundRecords), None, dtype=object)
+    for rule in ruleset.rules:
+        matched = numpy.zeros(len(inboundRecords), dtype=bool)
+        for patterns in rule.groups:
+            if len(patterns) == 1:
+                matched |= evaluateExpression(patterns[0].expression, inboundColumns, {})
+            elif len(patterns) == 2:
+                factMatched = evaluateExpression(patterns[0].expression, currentColumns, {})
+                eventMatched = evaluateExpression(patterns[1].expression, inboundColumns, {patterns[0].alias: currentColumns})
+                matched |= factMatched & eventMatched
+            else:
+                raise ValueError('Rule {0} joins more than two messages and can not be reconciled in bulk'.format(rule.action.__name__))
+        firing = matched & ~decided
+        ruleNames[firing] = rule.action.__name__
+        decided |= firing
+    return ruleNames
+
+
+#Splits the feed into rounds in which every employee appears once, so a later record of an employee is compared
+# with the state decided for the earlier one
+def getReconcileRounds(inboundRecords):
+    rounds = []
+    roundOfKey = {}
+    for record in inboundRecords:
+        key = getRecordKey(record)
+        roundNumber = roundOfKey.get(key, -1) + 1
+        roundOfKey[key] = roundNumber
+        if roundNumber == len(rounds):
+            rounds.append([])
+        rounds[roundNumber].append(record)
+    return rounds
+
+
+#Classifies the whole feed and returns the decisions as (rule name, inbound record) in feed order per round
+def reconcile(rulesets, currentState, inboundRecords):
+    decisions = []
+    for roundRecords in getReconcileRounds(inboundRecords):
+        byDistrict = {}
+        for record in roundRecords:
+            byDistrict.setdefault(record['employee']['storeLocation'], []).append(record)
+        for district, districtRecords in byDistrict.items():
+            if district not in rulesets:
+                continue
+            currentRecords = [currentState.get(getRecordKey(record)) or getBlankRecord() for record in districtRecords]
+            ruleNames = classifyRecords(rulesets[district], currentRecords, districtRecords)
+            for ruleName, record in zip(ruleNames, districtRecords):
+                if ruleName is not None:
+                    decisions.append((ruleName, record))
+                    currentState[getRecordKey(record)] = record
+    return decisions
+
+
+def printHelp():
+    print('\tbulkReconciler.py [-t <memory|sqlite:dbfile|snapshot:snapshotfile>] [-i <inboundfile|inbounddir|->] [-o <decisionsfile>] [--dryrun]\n')
+
+
+def main(argv):
+    storeSpec = ''
+    inboundSource = None
+    decisionsFile = ''
+    dryRun = False
+    try:
+        opts, args = getopt.getopt(argv, "ht:i:o:", ["dryrun"])
+        for opt, arg in opts:
+            if opt == '-h':
+                printHelp()
+                sys.exit()
+            elif opt == '-t':
+                storeSpec = arg
+            elif opt == '-i':
+                inboundSource = arg
+            elif opt == '-o':
+                decisionsFile = arg
+            elif opt == '--dryrun':
+                dryRun = True
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    if storeSpec != '':
+        setCurrentStateStore(openCurrentStateStore(storeSpec))
+
+    started = time.time()
+    currentState = {getRecordKey(record): record for record in getCurrentStateStore().records()}
+    currentCount = len(currentState)
+    inboundRecords = [employee for employee, position in streamInboundData(inboundSource)]
+    for district in set(record['employee']['storeLocation'] for record in inboundRecords):
+        registerRuleset('native', district)
+    rulesets = getEngineModule('native').rulesets
+    loaded = time.time()
+    decisions = reconcile(rulesets, currentState, inboundRecords)
+    classified = time.time()
+
+    if decisionsFile != '':
+        with open(decisionsFile, 'w') as output:
+            for ruleName, record in decisions:
+                output.write(json.dumps({'rule': ruleName, 'employee': record['employee']}) + '\n')
+    if not dryRun:
+        updateCurrentStateDataBulk([record for ruleName, record in decisions])
+    closeCurrentStateStore()
+
+    counts = {}
+    for ruleName, record in decisions:
+        counts[ruleName] = counts.get(ruleName, 0) + 1
+    print('Reconciled {0} inbound records against {1} current records'.format(len(inboundRecords), currentCount))
+    for ruleName in sorted(counts):
+        print('\t{0}: {1}'.format(ruleName, counts[ruleName]))
+    print('\tno decision: {0}'.format(len(inboundRecords) - len(decisions)))
+    print('Loaded in {0:.2f}s, classified in {1:.2f}s ({2:.0f} records/s)'.format(loaded - started, classified - loaded, \
+        len(inboundRecords) / max(classified - loaded, 1e-9)))
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
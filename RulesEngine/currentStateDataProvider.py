@@ -10,79 +10,533 @@
 #                           In the event that the rules engine asks for an unknown record,
 #                           a blank representation would be returned.
 #
+#                           Records are held in a current state store indexed on employee id
+#                           and store id: in memory, in a SQLite table, or in a memory mapped
+#                           snapshot file for very large registries.
+#
 # Created By            : Willy Demis
 # Created Date          : 2022-02-16
 # Version               : 1.0
 #############################################################################################################
 
+import getopt
+import hashlib
 import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
 
-def getCurrentStateData(employeeId, storeId):
-    json_empty_data = \
-    """
+##### Used as the file header and index entry layout of a current state snapshot file, by format version. The
+#####   header is the magic, the format version, the record count and (from version 2) the id of the field set the
+#####   content hashes were taken over. Each index entry is the key hash, data offset, data length and (from version
+#####   2) the record's content hash. Index entries are sorted by key hash so a lookup is a binary search over the
+#####   memory mapped file. Snapshots are written in the latest version
+snapshotMagic = b'CSSN'
+snapshotVersion = 2
+snapshotFormats = {
+    1: (struct.Struct('<4sII'), struct.Struct('<QQI')),
+    2: (struct.Struct('<4sII16s'), struct.Struct('<QQI16s')),
+}
+snapshotPrefix = struct.Struct('<4sI')
+
+##### Used as the default store spec: 'memory', 'sqlite:<dbfile>' or 'snapshot:<snapshotfile>'
+defaultStoreSpec = 'memory'
+
+##### Used as the number of keys sent to SQLite in one bulk query (two bound parameters per key)
+sqliteBulkSize = 400
+
+##### Used as the field paths a content hash covers (None hashes the whole record), and the content hashes of the
+#####   current state records looked up so far. The stores keep each record's hash next to it, tagged with the id of
+#####   the field set it was taken over; this is the process's cache of them, updated with the store
+contentHashFields = None
+contentHashes = {}
+
+##### Used to mark a field missing from a record when its content hash is taken
+missing = object()
+
+
+
+#The blank record returned for employees the store does not know about
+json_empty_data = \
+"""
+{
+  "employees": [
     {
-      "employees": [
-        {
-          "employee": {
-            "id": "",
-            "storeLocation": "",
-            "storeId": "",
-            "startDate": "",
-            "first": "",
-            "last": "",
-            "zipcode": ""
-          }
-        }
-      ]
+      "employee": {
+        "id": "",
+        "storeLocation": "",
+        "storeId": "",
+        "startDate": "",
+        "first": "",
+        "last": "",
+        "zipcode": ""
+      }
     }
-    """
-    
-    json_current_data = \
-    """
+  ]
+}
+"""
+
+#The sample current state used by the default in-memory store
+json_current_data = \
+"""
+{
+  "employees": [
     {
-      "employees": [
-        {
-          "employee": {
-            "id": "0001",
-            "storeLocation": "Chicago",
-            "storeId": "1111",
-            "startDate": "20220207",
-            "first": "Jane",
-            "last": "Doe",
-            "zipcode": "60131"
-          }
-        },
-        {
-          "employee": {
-            "id": "0002",
-            "storeLocation": "Chicago",
-            "storeId": "1111",
-            "startDate": "20220210",
-            "first": "James",
-            "last": "Dean",
-            "zipcode": "60602"
-          }
-        },
-        {
-          "employee": {
-            "id": "0003",
-            "storeLocation": "Indianapolis",
-            "storeId": "2222",
-            "startDate": "20220315",
-            "first": "Billy",
-            "last": "Joel",
-            "zipcode": "46268"
-          }
-        }
-      ]
+      "employee": {
+        "id": "0001",
+        "storeLocation": "Chicago",
+        "storeId": "1111",
+        "startDate": "20220207",
+        "first": "Jane",
+        "last": "Doe",
+        "zipcode": "60131"
+      }
+    },
+    {
+      "employee": {
+        "id": "0002",
+        "storeLocation": "Chicago",
+        "storeId": "1111",
+        "startDate": "20220210",
+        "first": "James",
+        "last": "Dean",
+        "zipcode": "60602"
+      }
+    },
+    {
+      "employee": {
+        "id": "0003",
+        "storeLocation": "Indianapolis",
+        "storeId": "2222",
+        "startDate": "20220315",
+        "first": "Billy",
+        "last": "Joel",
+        "zipcode": "46268"
+      }
     }
-    """
-    currentData = json.loads(json_current_data)
-    for employee in currentData['employees']:
-        dataSourceEmployeeId = employee["employee"]["id"]
-        dataSourceStoreId = employee["employee"]["storeId"]
-        if (dataSourceEmployeeId == employeeId and dataSourceStoreId == storeId):
-            return employee
-    
-    emptyData = json.loads(json_empty_data)
-    return emptyData["employees"][0]
\ No newline at end of file
+  ]
+}
+"""
+
+blankEmployee = json.loads(json_empty_data)['employees'][0]['employee']
+
+#The store behind getCurrentStateData, opened from defaultStoreSpec on first use unless one was set
+currentStateStore = None
+
+
+
+#A current state store answers "what do we know about this employee at this store" for the rules engine.
+# Every store keeps its records keyed on (employeeId, storeId), returns a fresh blank record for unknown
+# employees, and takes updates when the rules engine commits a decision to the DB
+class CurrentStateStore:
+    def get(self, employeeId, storeId):
+        raise NotImplementedError()
+
+    #Looks up a list of (employeeId, storeId) keys, returning the records in the same order
+    def getBulk(self, keys):
+        return [self.get(employeeId, storeId) for employeeId, storeId in keys]
+
+    #Looks up the content hashes of a list of keys (see getContentHash), returning a (hash, record) pair per key in
+    # the same order. The record is the current state when it had to be read for the hash, and None when the store
+    # kept the hash. This one reads every record
+    def getHashBulk(self, keys):
+        return [(getContentHash(record), record) for record in self.getBulk(keys)]
+
+    def update(self, record):
+        raise NotImplementedError()
+
+    #Writes several records at once, in order
+    def updateBulk(self, records):
+        for record in records:
+            self.update(record)
+
+    #Yields every known record, used to export one store into another
+    def records(self):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+#Keeps every record in a dict. The returned records are shared with the store, so callers must not modify them
+class InMemoryStateStore(CurrentStateStore):
+    def __init__(self, records=()):
+        self.index = {}
+        for record in records:
+            self.update(record)
+
+    def get(self, employeeId, storeId):
+        record = self.index.get((employeeId, storeId))
+        if record is None:
+            return getBlankRecord()
+        return record
+
+    def update(self, record):
+        self.index[getRecordKey(record)] = record
+
+    def records(self):
+        return iter(self.index.values())
+
+
+#Keeps the records in a SQLite table with (id, storeId) as the primary key, standing in for the employee DB.
+# Each record's content hash is kept in a second table, written in the same transaction as the record, with the
+# id of the field set it was taken over. The connection may be used from another thread, as long as only one
+# thread uses it at a time
+class SqliteStateStore(CurrentStateStore):
+    def __init__(self, path, records=()):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS employees (id TEXT NOT NULL, storeId TEXT NOT NULL, document TEXT NOT NULL, ' \
+            'PRIMARY KEY (id, storeId)) WITHOUT ROWID')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS contentHashes (id TEXT NOT NULL, storeId TEXT NOT NULL, fields BLOB NOT NULL, ' \
+            'hash BLOB NOT NULL, PRIMARY KEY (id, storeId)) WITHOUT ROWID')
+        self.updateBulk(list(records))
+
+    def get(self, employeeId, storeId):
+        row = self.connection.execute('SELECT document FROM employees WHERE id = ? AND storeId = ?', (employeeId, storeId)).fetchone()
+        if row is None:
+            return getBlankRecord()
+        return json.loads(row[0])
+
+    #One query per sqliteBulkSize keys instead of one per key
+    def getBulk(self, keys):
+        found = {}
+        for start in range(0, len(keys), sqliteBulkSize):
+            chunk = keys[start:start + sqliteBulkSize]
+            query = 'SELECT id, storeId, document FROM employees WHERE (id, storeId) IN (VALUES ' + ', '.join(['(?, ?)'] * len(chunk)) + ')'
+            for employeeId, storeId, document in self.connection.execute(query, [value for key in chunk for value in key]):
+                found[(employeeId, storeId)] = document
+        return [json.loads(found[key]) if key in found else getBlankRecord() for key in keys]
+
+    #Stored hashes of another field set are taken again from the record, and stored for the next lookup
+    def getHashBulk(self, keys):
+        fieldsId = getContentHashFieldsId()
+        found = {}
+        for start in range(0, len(keys), sqliteBulkSize):
+            chunk = keys[start:start + sqliteBulkSize]
+            query = 'SELECT id, storeId, hash FROM contentHashes WHERE fields = ? AND (id, storeId) IN (VALUES ' + ', '.join(['(?, ?)'] * len(chunk)) + ')'
+            for employeeId, storeId, contentHash in self.connection.execute(query, [fieldsId] + [value for key in chunk for value in key]):
+                found[(employeeId, storeId)] = (contentHash, None)
+
+        missingKeys = [key for key in keys if key not in found]
+        if len(missingKeys) > 0:
+            hashed = []
+            for key, record in zip(missingKeys, self.getBulk(missingKeys)):
+                found[key] = (getContentHash(record), record)
+                if getRecordKey(record) == key:
+                    hashed.append(key + (fieldsId, found[key][0]))
+            self.connection.executemany('INSERT OR REPLACE INTO contentHashes (id, storeId, fields, hash) VALUES (?, ?, ?, ?)', hashed)
+            self.connection.commit()
+        return [found[key] for key in keys]
+
+    def update(self, record):
+        self.updateBulk([record])
+
+    #One transaction for the whole list
+    def updateBulk(self, records):
+        fieldsId = getContentHashFieldsId()
+        self.connection.executemany('INSERT OR REPLACE INTO employees (id, storeId, document) VALUES (?, ?, ?)', \
+            [getRecordKey(record) + (json.dumps(record),) for record in records])
+        self.connection.executemany('INSERT OR REPLACE INTO contentHashes (id, storeId, fields, hash) VALUES (?, ?, ?, ?)', \
+            [getRecordKey(record) + (fieldsId, getContentHash(record)) for record in records])
+        self.connection.commit()
+
+    def records(self):
+        for row in self.connection.execute('SELECT document FROM employees'):
+            yield json.loads(row[0])
+
+    def close(self):
+        self.connection.close()
+
+
+#Looks records up in a read-only snapshot file (see writeSnapshot) through mmap, so only the pages that are
+# touched are read and a registry of any size opens instantly. The index holds each record's content hash. Updates
+# are kept in memory on top of the snapshot and the snapshot is rewritten with them when the store is closed, so
+# they only survive a clean close. It is also rewritten when its hashes were taken over another field set than
+# the one looked up, so they are stored for the next run
+class SnapshotStateStore(CurrentStateStore):
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = snapshotPrefix.unpack_from(self.map, 0)
+        if magic != snapshotMagic or version not in snapshotFormats:
+            raise ValueError(path + ' is not a current state snapshot')
+        self.header, self.indexEntry = snapshotFormats[version]
+        header = self.header.unpack_from(self.map, 0)
+        self.count = header[2]
+        self.hashFieldsId = header[3] if len(header) > 3 else None
+        self.updates = {}
+        self.rehashed = False
+
+    def getIndexEntry(self, position):
+        return self.indexEntry.unpack_from(self.map, self.header.size + position * self.indexEntry.size)
+
+    def readRecord(self, position):
+        entry = self.getIndexEntry(position)
+        return json.loads(self.map[entry[1]:entry[1] + entry[2]])
+
+    #The index positions of every entry with the key's hash, since different keys can share a hash
+    def getPositions(self, employeeId, storeId):
+        keyHash = getKeyHash(employeeId, storeId)
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.getIndexEntry(middle)[0] < keyHash:
+                low = middle + 1
+            else:
+                high = middle
+
+        positions = []
+        while low < self.count and self.getIndexEntry(low)[0] == keyHash:
+            positions.append(low)
+            low += 1
+        return positions
+
+    def get(self, employeeId, storeId):
+        key = (employeeId, storeId)
+        if key in self.updates:
+            return self.updates[key]
+        for position in self.getPositions(employeeId, storeId):
+            record = self.readRecord(position)
+            if getRecordKey(record) == key:
+                return record
+        return getBlankRecord()
+
+    #A key with a single index entry takes the hash from the index without reading the record. The entry can be
+    # another key's that shares the key hash, but content hashes cover the key, so that hash never matches
+    def getHashBulk(self, keys):
+        fieldsId = getContentHashFieldsId()
+        hashes = []
+        for key in keys:
+            positions = self.getPositions(*key) if key not in self.updates else None
+            if positions is not None and len(positions) == 0:
+                record = getBlankRecord()
+                hashes.append((getContentHash(record), record))
+            elif positions is not None and len(positions) == 1 and self.hashFieldsId == fieldsId:
+                hashes.append((self.getIndexEntry(positions[0])[3], None))
+            else:
+                record = self.get(*key)
+                hashes.append((getContentHash(record), record))
+                self.rehashed = self.rehashed or key not in self.updates
+        return hashes
+
+    def update(self, record):
+        self.updates[getRecordKey(record)] = record
+
+    def records(self):
+        for position in range(self.count):
+            record = self.readRecord(position)
+            if getRecordKey(record) not in self.updates:
+                yield record
+        for record in self.updates.values():
+            yield record
+
+    #writeSnapshot reads every record before it replaces the file, so the old snapshot is still mapped while it does
+    def close(self):
+        if len(self.updates) > 0 or self.rehashed:
+            writeSnapshot(self.path, self.records())
+            self.updates = {}
+            self.rehashed = False
+        self.map.close()
+        self.file.close()
+
+
+#Writes records to a snapshot file readable by SnapshotStateStore, with their content hashes over the current
+# field set. The file is written next to the target and moved into place so an open snapshot is never overwritten
+# while it is being read
+def writeSnapshot(path, records):
+    header, indexEntry = snapshotFormats[snapshotVersion]
+    entries = []
+    documents = []
+    for record in records:
+        document = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        entries.append((getKeyHash(*getRecordKey(record)), len(documents), getContentHash(record)))
+        documents.append(document)
+    entries.sort()
+
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'wb') as snapshotFile:
+        snapshotFile.write(header.pack(snapshotMagic, snapshotVersion, len(entries), getContentHashFieldsId()))
+        offset = header.size + len(entries) * indexEntry.size
+        for keyHash, position, contentHash in entries:
+            snapshotFile.write(indexEntry.pack(keyHash, offset, len(documents[position]), contentHash))
+            offset += len(documents[position])
+        for keyHash, position, contentHash in entries:
+            snapshotFile.write(documents[position])
+    os.replace(temporaryPath, path)
+
+
+#A hash of the record's key and its values at the content hash field paths, or of the whole record. Values are
+# hashed by their repr, so the same content with nested keys in another order hashes differently: such a record
+# is only sent to the engine for nothing, while a changed record can never hash the same as before
+def getContentHash(record):
+    if contentHashFields is None:
+        content = record
+    else:
+        content = [getRecordKey(record)]
+        for path in contentHashFields:
+            value = record
+            for name in path:
+                value = value.get(name, missing) if type(value) is dict else missing
+            content.append(() if value is missing else (value,))
+    return hashlib.blake2b(repr(content).encode('utf-8'), digest_size=16).digest()
+
+
+#Identifies the field set content hashes are taken over, so a stored hash is only used for the same field set
+def getContentHashFieldsId():
+    return hashlib.blake2b(repr(contentHashFields).encode('utf-8'), digest_size=16).digest()
+
+
+def setContentHashFields(paths):
+    global contentHashFields
+    contentHashFields = paths
+    contentHashes.clear()
+
+
+def getKeyHash(employeeId, storeId):
+    return int.from_bytes(hashlib.blake2b((employeeId + '\0' + storeId).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def getRecordKey(record):
+    return (record['employee']['id'], record['employee']['storeId'])
+
+
+#The blank template is parsed once; every miss gets its own copy so callers can not change the template
+def getBlankRecord():
+    return {'employee': dict(blankEmployee)}
+
+
+#Reads current state records from a JSON document shaped like json_current_data, or the sample data without a file
+def loadCurrentStateRecords(path=None):
+    if path is None:
+        return json.loads(json_current_data)['employees']
+    with open(path) as sourceFile:
+        return json.load(sourceFile)['employees']
+
+
+#Opens a store from its spec. Records given to a sqlite or snapshot store are written into it first
+def openCurrentStateStore(storeSpec, records=None):
+    kind, separator, path = storeSpec.partition(':')
+    if kind == 'memory':
+        return InMemoryStateStore(loadCurrentStateRecords() if records is None else records)
+    elif kind == 'sqlite' and path != '':
+        return SqliteStateStore(path, records or ())
+    elif kind == 'snapshot' and path != '':
+        if records is not None:
+            writeSnapshot(path, records)
+        return SnapshotStateStore(path)
+    raise ValueError('Unknown current state store: ' + storeSpec)
+
+
+def setCurrentStateStore(store):
+    global currentStateStore
+    currentStateStore = store
+    contentHashes.clear()
+
+
+def getCurrentStateStore():
+    if currentStateStore is None:
+        setCurrentStateStore(openCurrentStateStore(defaultStoreSpec))
+    return currentStateStore
+
+
+#Closes the store, which is what makes the updates to a snapshot store last
+def closeCurrentStateStore():
+    global currentStateStore
+    if currentStateStore is not None:
+        currentStateStore.close()
+    setCurrentStateStore(None)
+
+
+def getCurrentStateData(employeeId, storeId):
+    return getCurrentStateStore().get(employeeId, storeId)
+
+
+#knownRecords, when given, holds a record already read for the key at the same position (or None), and only the
+# other keys are read from the store
+def getCurrentStateDataBulk(keys, knownRecords=None):
+    if knownRecords is None:
+        return getCurrentStateStore().getBulk(keys)
+    unknownKeys = [key for key, record in zip(keys, knownRecords) if record is None]
+    records = iter(getCurrentStateStore().getBulk(unknownKeys) if len(unknownKeys) > 0 else [])
+    return [record if record is not None else next(records) for record in knownRecords]
+
+
+#Returns a (hash, record) pair with the content hash of the current state of each key (see getHashBulk). Keys
+# hashed earlier in the process come from the cache and the others from the hashes kept in the store, so the
+# record is only read, and returned, when the store had no hash for it over the current field set
+def getCurrentStateHashBulk(keys):
+    missingKeys = [key for key in keys if key not in contentHashes]
+    readRecords = {}
+    if len(missingKeys) > 0:
+        for key, (contentHash, record) in zip(missingKeys, getCurrentStateStore().getHashBulk(missingKeys)):
+            contentHashes[key] = contentHash
+            if record is not None:
+                readRecords[key] = record
+    return [(contentHashes[key], readRecords.get(key)) for key in keys]
+
+
+#Called once a decision is stored, so the next lookup for the employee sees the committed state
+def updateCurrentStateData(jsonObj):
+    record = toRecord(jsonObj)
+    getCurrentStateStore().update(record)
+    updateContentHashes([record])
+
+
+def updateCurrentStateDataBulk(jsonObjs):
+    records = [toRecord(jsonObj) for jsonObj in jsonObjs]
+    getCurrentStateStore().updateBulk(records)
+    updateContentHashes(records)
+
+
+#Only hashes that were already looked up are kept current; other keys are hashed when they are first needed
+def updateContentHashes(records):
+    if len(contentHashes) > 0:
+        for record in records:
+            key = getRecordKey(record)
+            if key in contentHashes:
+                contentHashes[key] = getContentHash(record)
+
+
+#Rule actions hand over durable_rules content objects, which are unwrapped to a plain record
+def toRecord(jsonObj):
+    data = getattr(jsonObj, '_d', jsonObj)
+    return {'employee': dict(getattr(data['employee'], '_d', data['employee']))}
+
+
+def printHelp():
+    print('\tcurrentStateDataProvider.py -s <sourcefile> -t <sqlite:dbfile|snapshot:snapshotfile>\n')
+
+
+#Builds a sqlite or snapshot store from a JSON current state document (the sample data without -s)
+def main(argv):
+    sourceFile = None
+    storeSpec = ''
+    try:
+        opts, args = getopt.getopt(argv, "hs:t:")
+        for opt, arg in opts:
+            if opt == '-h':
+                printHelp()
+                sys.exit()
+            elif opt == '-s':
+                sourceFile = arg
+            elif opt == '-t':
+                storeSpec = arg
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    if storeSpec == '':
+        printHelp()
+        sys.exit(2)
+    records = loadCurrentStateRecords(sourceFile)
+    openCurrentStateStore(storeSpec, records).close()
+    print('Wrote {0} records to {1}'.format(len(records), storeSpec))
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,118 @@
+#############################################################################################################
+# Project               : Data Transformation Solution: Rules Engine Application
+# Description           : This python code is used in conjunction with the rules engine.
+#                           It keeps checkpoints of a rules engine run in a local SQLite file:
+#                           the inbound feed position, the facts still held per ruleset and the
+#                           decisions queued on the write-behind sink but not written yet. A
+#                           restarted run resumes from the last checkpoint instead of the start
+#                           of the feed.
+#
+#                           It also journals every decision stored to the DB under a decision id
+#                           taken from the fact and event pair its rule fired on, how many times
+#                           that pair fired since the last checkpoint and the checkpoint itself.
+#                           A decision made again after a restart has the same id and is skipped.
+#                           The journal lives in this file and the current state in its own
+#                           store, so a decision is journaled right after its DB write rather than
+#                           in the same transaction: storing is at-least-once, and a crash between
+#                           the two only writes that decision's record again.
+#
+# Version               : 1.0
+#############################################################################################################
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+
+class CheckpointStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS checkpoint (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS facts (ruleset TEXT NOT NULL, fact TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS pendingDecisions (decisionId TEXT PRIMARY KEY, record TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS storedDecisions (decisionId TEXT PRIMARY KEY)')
+        self.connection.commit()
+        self.checkpointCount = 0
+        self.skippedCount = 0
+        self.generation = 0
+        self.occurrences = {}
+
+    #Returns the position, the facts per ruleset and the pending (decisionId, record) pairs of the last
+    # checkpoint, or None when there is none yet. Decisions made from here on get the ids they had in the run
+    # that took the checkpoint
+    def load(self):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM checkpoint WHERE name = 'position'").fetchone()
+            if row is None:
+                return None
+            generation = self.connection.execute("SELECT value FROM checkpoint WHERE name = 'generation'").fetchone()
+            self.generation = json.loads(generation[0]) if generation is not None else 0
+            self.occurrences = {}
+            facts = {}
+            for ruleset, fact in self.connection.execute('SELECT ruleset, fact FROM facts'):
+                facts.setdefault(ruleset, []).append(json.loads(fact))
+            pendingDecisions = [(decisionId, json.loads(record)) for decisionId, record in \
+                self.connection.execute('SELECT decisionId, record FROM pendingDecisions ORDER BY rowid')]
+            return json.loads(row[0]), facts, pendingDecisions
+
+    #Writes a checkpoint in one transaction. Decisions stored before it can not be made again after a restart
+    # (their records are before the position), so their journal entries are dropped
+    def save(self, position, facts, pendingDecisions):
+        with self.lock:
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO checkpoint (name, value) VALUES ('position', ?)", (json.dumps(position),))
+                self.connection.execute("INSERT OR REPLACE INTO checkpoint (name, value) VALUES ('generation', ?)", (json.dumps(self.generation + 1),))
+                self.connection.execute("INSERT OR REPLACE INTO checkpoint (name, value) VALUES ('created', ?)", (json.dumps(time.time()),))
+                self.connection.execute('DELETE FROM facts')
+                self.connection.executemany('INSERT INTO facts (ruleset, fact) VALUES (?, ?)', \
+                    [(ruleset, json.dumps(fact)) for ruleset, rulesetFacts in facts.items() for fact in rulesetFacts])
+                self.connection.execute('DELETE FROM pendingDecisions')
+                self.connection.executemany('INSERT OR REPLACE INTO pendingDecisions (decisionId, record) VALUES (?, ?)', \
+                    [(decisionId, json.dumps(record)) for decisionId, record in pendingDecisions])
+                pendingIds = set(decisionId for decisionId, record in pendingDecisions)
+                self.connection.execute('DELETE FROM storedDecisions' + (' WHERE decisionId NOT IN (' + ', '.join(['?'] * len(pendingIds)) + ')' \
+                    if len(pendingIds) > 0 else ''), list(pendingIds))
+            self.checkpointCount += 1
+            self.generation += 1
+            self.occurrences = {}
+
+    #The id a decision is journaled under. The same pair can fire again later (an employee changed back and forth),
+    # so the pair id is qualified by how many times it fired since the last checkpoint and by that checkpoint.
+    # A run resumed from the checkpoint replays the same pairs in the same order and so gives them the same ids.
+    # Decisions must be passed in the order they were made for each employee
+    def getDecisionId(self, pairId):
+        occurrence = self.occurrences.get(pairId, 0)
+        self.occurrences[pairId] = occurrence + 1
+        return '{0}:{1}:{2}'.format(self.generation, occurrence, pairId)
+
+    #Returns the decisions (decisionId, record) not stored yet, counting the others as skipped
+    def getUnstored(self, decisions):
+        with self.lock:
+            unstored = []
+            for decisionId, record in decisions:
+                if self.connection.execute('SELECT 1 FROM storedDecisions WHERE decisionId = ?', (decisionId,)).fetchone() is None:
+                    unstored.append((decisionId, record))
+                else:
+                    self.skippedCount += 1
+            return unstored
+
+    #Called once the decisions are written to the DB
+    def markStored(self, decisionIds):
+        with self.lock:
+            with self.connection:
+                self.connection.executemany('INSERT OR IGNORE INTO storedDecisions (decisionId) VALUES (?)', [(decisionId,) for decisionId in decisionIds])
+
+    def close(self):
+        self.connection.close()
+
+
+#Identifies the fact and event pair a rule fired on
+def getPairId(current, ingest):
+    content = json.dumps([current, ingest], sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
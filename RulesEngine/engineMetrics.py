@@ -0,0 +1,256 @@
+#############################################################################################################
+# Project               : Data Transformation Solution: Rules Engine Application
+# Description           : This python code is used in conjunction with the rules engine.
+#                           It collects metrics on how the rules engine behaves while ingesting:
+#                           rule fires and rule action latency per ruleset and rule, assert and
+#                           post latency histograms, events no rule fired on, current state lookup
+#                           time and records per second. Metrics are exported as Prometheus
+#                           text or a JSON snapshot, written to a file or served over HTTP.
+#
+#                           Metrics are only collected when a collector is installed; without one
+#                           every instrumentation point in the rules engine is a single None check.
+#
+# Version               : 1.0
+#############################################################################################################
+
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+##### Used as the upper bounds (in seconds) of the latency histogram buckets
+latencyBuckets = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+##### Used as the prefix of every exported metric name
+metricPrefix = 'rules_engine_'
+
+
+
+#Counts observations per bucket; the last count is for observations above the highest bound
+class Histogram:
+    def __init__(self, buckets=latencyBuckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def getSnapshot(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'count': self.count, 'sum': self.sum}
+
+
+#Collects the metrics of one process. Snapshots are plain dicts so partition workers can send theirs to the
+# parent, which merges them with its own (see mergeSnapshots)
+class EngineMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self.recordCount = 0
+        self.fireCount = 0
+        self.ruleFires = {}
+        self.ruleLatency = {}
+        self.unmatched = {}
+        self.assertLatency = {}
+        self.postLatency = {}
+        self.lookupLatency = Histogram()
+        self.lookupCount = 0
+        self.unchangedCount = 0
+
+    def recordFire(self, rulesetName, ruleName, seconds):
+        key = (rulesetName, ruleName)
+        self.ruleFires[key] = self.ruleFires.get(key, 0) + 1
+        if key not in self.ruleLatency:
+            self.ruleLatency[key] = Histogram()
+        self.ruleLatency[key].observe(seconds)
+        self.fireCount += 1
+
+    def recordAssert(self, rulesetName, seconds):
+        if rulesetName not in self.assertLatency:
+            self.assertLatency[rulesetName] = Histogram()
+        self.assertLatency[rulesetName].observe(seconds)
+
+    def recordPost(self, rulesetName, seconds):
+        if rulesetName not in self.postLatency:
+            self.postLatency[rulesetName] = Histogram()
+        self.postLatency[rulesetName].observe(seconds)
+
+    #One inbound record evaluated. fired tells whether any rule fired on it, while its current state fact was
+    # asserted or while its event was posted
+    def recordEvaluation(self, rulesetName, fired):
+        self.recordCount += 1
+        if not fired:
+            self.unmatched[rulesetName] = self.unmatched.get(rulesetName, 0) + 1
+
+    #One bulk lookup of recordCount current state records
+    def recordLookup(self, seconds, recordCount):
+        self.lookupLatency.observe(seconds)
+        self.lookupCount += recordCount
+
+    #Inbound records skipped before the engine since they did not change
+    def recordUnchanged(self, count):
+        self.unchangedCount += count
+
+    #The dicts are copied first since the HTTP server takes snapshots from its own threads
+    def getSnapshot(self):
+        return {
+            'elapsed': time.time() - self.started,
+            'records': self.recordCount,
+            'ruleFires': [[rulesetName, ruleName, count] for (rulesetName, ruleName), count in sorted(dict(self.ruleFires).items())],
+            'ruleLatency': [[rulesetName, ruleName, histogram.getSnapshot()] for (rulesetName, ruleName), histogram in sorted(dict(self.ruleLatency).items())],
+            'unmatched': dict(sorted(dict(self.unmatched).items())),
+            'assertLatency': {rulesetName: histogram.getSnapshot() for rulesetName, histogram in sorted(dict(self.assertLatency).items())},
+            'postLatency': {rulesetName: histogram.getSnapshot() for rulesetName, histogram in sorted(dict(self.postLatency).items())},
+            'lookupLatency': self.lookupLatency.getSnapshot(),
+            'lookupRecords': self.lookupCount,
+            'unchanged': self.unchangedCount}
+
+
+#Adds up the snapshots of several processes. Elapsed time is the longest one, so records per second is the
+# throughput of all of them together
+def mergeSnapshots(snapshots):
+    merged = {'elapsed': 0.0, 'records': 0, 'ruleFires': [], 'ruleLatency': [], 'unmatched': {}, 'assertLatency': {}, 'postLatency': {}, \
+        'lookupLatency': Histogram().getSnapshot(), 'lookupRecords': 0, 'unchanged': 0}
+    ruleFires = {}
+    ruleLatency = {}
+    for snapshot in snapshots:
+        merged['elapsed'] = max(merged['elapsed'], snapshot['elapsed'])
+        merged['records'] += snapshot['records']
+        merged['lookupRecords'] += snapshot['lookupRecords']
+        merged['unchanged'] += snapshot['unchanged']
+        for rulesetName, ruleName, count in snapshot['ruleFires']:
+            ruleFires[(rulesetName, ruleName)] = ruleFires.get((rulesetName, ruleName), 0) + count
+        for rulesetName, ruleName, histogram in snapshot['ruleLatency']:
+            ruleLatency[(rulesetName, ruleName)] = addHistograms(ruleLatency.get((rulesetName, ruleName)), histogram)
+        for rulesetName, count in snapshot['unmatched'].items():
+            merged['unmatched'][rulesetName] = merged['unmatched'].get(rulesetName, 0) + count
+        for name in ('assertLatency', 'postLatency'):
+            for rulesetName, histogram in snapshot[name].items():
+                merged[name][rulesetName] = addHistograms(merged[name].get(rulesetName), histogram)
+        merged['lookupLatency'] = addHistograms(merged['lookupLatency'], snapshot['lookupLatency'])
+    merged['ruleFires'] = [[rulesetName, ruleName, count] for (rulesetName, ruleName), count in sorted(ruleFires.items())]
+    merged['ruleLatency'] = [[rulesetName, ruleName, histogram] for (rulesetName, ruleName), histogram in sorted(ruleLatency.items())]
+    for name in ('unmatched', 'assertLatency', 'postLatency'):
+        merged[name] = dict(sorted(merged[name].items()))
+    return merged
+
+
+def addHistograms(histogram, other):
+    if histogram is None:
+        return dict(other)
+    return {'buckets': histogram['buckets'], 'counts': [a + b for a, b in zip(histogram['counts'], other['counts'])], \
+        'count': histogram['count'] + other['count'], 'sum': histogram['sum'] + other['sum']}
+
+
+#The upper bound of the bucket holding the given fraction of a histogram's observations, or None when the
+# fraction falls above the highest bound
+def getPercentile(histogram, fraction):
+    target = histogram['count'] * fraction
+    cumulative = 0
+    for bound, count in zip(histogram['buckets'], histogram['counts']):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return None
+
+
+def getRecordsPerSecond(snapshot):
+    return snapshot['records'] / max(snapshot['elapsed'], 1e-9)
+
+
+#Renders a snapshot in the Prometheus text exposition format
+def formatPrometheus(snapshot):
+    lines = []
+    def addMetric(name, kind, help, samples):
+        lines.append('# HELP {0}{1} {2}'.format(metricPrefix, name, help))
+        lines.append('# TYPE {0}{1} {2}'.format(metricPrefix, name, kind))
+        for suffix, labels, value in samples:
+            labelText = ','.join('{0}="{1}"'.format(label, labelValue) for label, labelValue in labels)
+            lines.append('{0}{1}{2}{3} {4}'.format(metricPrefix, name, suffix, '{' + labelText + '}' if labelText != '' else '', value))
+
+    def getHistogramSamples(histogram, labels):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(list(histogram['buckets']) + ['+Inf'], histogram['counts']):
+            cumulative += count
+            samples.append(('_bucket', labels + [('le', bound)], cumulative))
+        samples.append(('_sum', labels, histogram['sum']))
+        samples.append(('_count', labels, histogram['count']))
+        return samples
+
+    rulesetFires = {}
+    for rulesetName, ruleName, count in snapshot['ruleFires']:
+        rulesetFires[rulesetName] = rulesetFires.get(rulesetName, 0) + count
+    addMetric('records_total', 'counter', 'Inbound records evaluated.', [('', [], snapshot['records'])])
+    addMetric('records_per_second', 'gauge', 'Inbound records evaluated per second since the start of the run.', [('', [], getRecordsPerSecond(snapshot))])
+    addMetric('ruleset_fires_total', 'counter', 'Rule fires per ruleset.', \
+        [('', [('ruleset', rulesetName)], count) for rulesetName, count in sorted(rulesetFires.items())])
+    addMetric('rule_fires_total', 'counter', 'Rule fires per rule.', \
+        [('', [('ruleset', rulesetName), ('rule', ruleName)], count) for rulesetName, ruleName, count in snapshot['ruleFires']])
+    addMetric('rule_action_seconds', 'histogram', 'Time spent in a rule action, including its DB write.', \
+        [sample for rulesetName, ruleName, histogram in snapshot['ruleLatency'] for sample in getHistogramSamples(histogram, [('ruleset', rulesetName), ('rule', ruleName)])])
+    addMetric('unmatched_events_total', 'counter', 'Inbound records no rule fired on, neither when their fact was asserted nor when their event was posted.', \
+        [('', [('ruleset', rulesetName)], count) for rulesetName, count in snapshot['unmatched'].items()])
+    addMetric('assert_seconds', 'histogram', 'Time to assert a current state fact.', \
+        [sample for rulesetName, histogram in snapshot['assertLatency'].items() for sample in getHistogramSamples(histogram, [('ruleset', rulesetName)])])
+    addMetric('post_seconds', 'histogram', 'Time to post an inbound event, including the rule actions.', \
+        [sample for rulesetName, histogram in snapshot['postLatency'].items() for sample in getHistogramSamples(histogram, [('ruleset', rulesetName)])])
+    addMetric('lookup_seconds', 'histogram', 'Time of a bulk current state lookup.', getHistogramSamples(snapshot['lookupLatency'], []))
+    addMetric('unchanged_records_total', 'counter', 'Inbound records skipped before the engine since they did not change.', [('', [], snapshot['unchanged'])])
+    addMetric('lookup_records_total', 'counter', 'Current state records looked up.', [('', [], snapshot['lookupRecords'])])
+    return '\n'.join(lines) + '\n'
+
+
+#Writes a snapshot as JSON when the file name ends in .json, as Prometheus text otherwise (for the node
+# exporter's textfile collector). The file is replaced in one step so readers never see a partial file
+def writeSnapshot(path, snapshot):
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'w') as metricsFile:
+        if path.endswith('.json'):
+            json.dump(dict(snapshot, recordsPerSecond=getRecordsPerSecond(snapshot)), metricsFile, indent=2)
+        else:
+            metricsFile.write(formatPrometheus(snapshot))
+    os.replace(temporaryPath, path)
+
+
+#Serves the current snapshot as Prometheus text on /metrics and as JSON on /metrics.json. getSnapshot is called
+# for every request
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, getSnapshot):
+        ThreadingHTTPServer.__init__(self, ('', port), MetricsHandler)
+        self.getSnapshot = getSnapshot
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body = formatPrometheus(self.server.getSnapshot())
+            contentType = 'text/plain; version=0.0.4'
+        elif path == '/metrics.json':
+            snapshot = self.server.getSnapshot()
+            body = json.dumps(dict(snapshot, recordsPerSecond=getRecordsPerSecond(snapshot)))
+            contentType = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
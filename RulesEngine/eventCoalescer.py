@@ -0,0 +1,81 @@
+#############################################################################################################
+# Project               : Data Transformation Solution: Rules Engine Application
+# Description           : This python code is used in conjunction with the rules engine.
+#                           It coalesces bursts of inbound updates for one employee: updates for
+#                           the same employee id and store id that arrive within a count or time
+#                           window are merged into their net change before rule evaluation, so a
+#                           burst costs one current state lookup, one evaluation and one DB write.
+#
+#                           Inbound records carry the whole employee, so the net change is the
+#                           latest record. An update that changes whether a field the rules test
+#                           is set (a hire followed by a termination, a first sale) is a
+#                           transition a rule may need to see, so it is kept as its own record
+#                           instead of being merged away.
+#
+# Version               : 1.0
+#############################################################################################################
+
+import collections
+import time
+
+
+
+#Holds the updates of an employee until its window closes. Employees are released in the order their first
+# update arrived, with the records kept for them in inbound order. Every released record carries the feed
+# position just before the oldest update still held back, so a resumed run never skips a held update (it may
+# replay a few released ones)
+class EventCoalescer:
+    def __init__(self, fieldPaths, windowSize=0, windowSeconds=0.0):
+        self.fieldPaths = fieldPaths
+        self.windowSize = windowSize
+        self.windowSeconds = windowSeconds
+        self.pending = collections.OrderedDict()
+        self.lastPosition = None
+        self.receivedCount = 0
+        self.emittedCount = 0
+        self.transitionCount = 0
+
+    #Which of the fields the rules read are set (present and not empty)
+    def getSignature(self, employee):
+        signature = []
+        for path in self.fieldPaths:
+            value = employee
+            for name in path:
+                value = value.get(name) if type(value) is dict else None
+            signature.append(value is not None and value != '')
+        return tuple(signature)
+
+    #Takes and yields (employee, position) pairs
+    def coalesce(self, records):
+        for employee, position in records:
+            key = (employee["employee"]["id"], employee["employee"]["storeId"])
+            entry = self.pending.get(key)
+            if entry is None:
+                self.pending[key] = [self.receivedCount, time.monotonic(), self.lastPosition, [employee]]
+            else:
+                kept = entry[3]
+                if self.getSignature(kept[-1]) == self.getSignature(employee):
+                    kept[-1] = employee
+                else:
+                    kept.append(employee)
+                    self.transitionCount += 1
+            self.receivedCount += 1
+            self.lastPosition = position
+            for record in self.release(False):
+                yield record
+        for record in self.release(True):
+            yield record
+
+    #A time window is only checked when a record arrives, so on a quiet feed updates wait for the next record
+    def release(self, flushAll):
+        now = time.monotonic()
+        while len(self.pending) > 0:
+            key, (firstIndex, firstTime, startPosition, kept) = next(iter(self.pending.items()))
+            if not flushAll and not (self.windowSize > 0 and self.receivedCount - firstIndex >= self.windowSize) \
+                    and not (self.windowSeconds > 0 and now - firstTime >= self.windowSeconds):
+                return
+            del self.pending[key]
+            position = next(iter(self.pending.values()))[2] if len(self.pending) > 0 else self.lastPosition
+            for employee in kept:
+                self.emittedCount += 1
+                yield employee, position
@@ -0,0 +1,180 @@
+#############################################################################################################
+# Project               : Data Transformation Solution: Rules Engine Application
+# Description           : This python code generates synthetic employee registries and change
+#                           feeds for the rules engine, so it can be run and benchmarked at any
+#                           size instead of on the handful of sample employees.
+#
+#                           A current state registry of employees spread over the stores of
+#                           each district is generated first, then an inbound feed of changes
+#                           to it: hires, terminations, name changes, first sales and unchanged
+#                           records in set proportions. Busy stores and busy employees are
+#                           skewed, so a few employees change many times in one feed, each
+#                           change made to the employee's state after the previous one.
+#
+# Version               : 1.0
+#############################################################################################################
+
+import getopt
+import json
+import random
+import sys
+
+from currentStateDataProvider import openCurrentStateStore, getRecordKey
+
+##### Used as the default proportions of the inbound changes. A hire is a new employee; the other kinds change
+#####   (or repeat) the current state of an existing employee
+defaultMix = {'hire': 0.1, 'termination': 0.05, 'namechange': 0.1, 'sales': 0.05, 'unchanged': 0.7}
+
+##### Used as the default districts and number of stores per district. Only districts with a ruleset can be fed
+#####   to the rules engine
+defaultDistricts = ['Chicago', 'Indianapolis']
+defaultStoresPerDistrict = 20
+
+##### Used as the default skew of stores and employees: 0 picks them uniformly, higher values favour a few
+defaultSkew = 1.0
+
+##### Used as the names generated employees are given
+firstNames = ['Jane', 'John', 'Billy', 'Maria', 'Ahmed', 'Wei', 'Olga', 'Carlos', 'Priya', 'Kofi', 'Emma', 'Liam', 'Noah', 'Ava', 'Mia']
+lastNames = ['Doe', 'Smith', 'Joel', 'Garcia', 'Khan', 'Chen', 'Ivanova', 'Lopez', 'Patel', 'Mensah', 'Brown', 'Wilson', 'Clark', 'Young']
+
+
+
+class FeedGenerator:
+    def __init__(self, districts=defaultDistricts, storesPerDistrict=defaultStoresPerDistrict, skew=defaultSkew, seed=1):
+        self.random = random.Random(seed)
+        self.skew = skew
+        self.stores = [(district, '{0}{1:03d}'.format(districtNumber + 1, storeNumber + 1)) \
+            for storeNumber in range(storesPerDistrict) for districtNumber, district in enumerate(districts)]
+        self.nextId = 1
+
+    #Picks an index below count, favouring low indexes more the higher the skew
+    def getSkewedIndex(self, count):
+        return int(count * self.random.random() ** (1.0 + self.skew))
+
+    def getDate(self, firstYear, lastYear):
+        return '{0}{1:02d}{2:02d}'.format(self.random.randint(firstYear, lastYear), self.random.randint(1, 12), self.random.randint(1, 28))
+
+    def newEmployee(self, startDate):
+        district, storeId = self.stores[self.getSkewedIndex(len(self.stores))]
+        employee = {'id': '{0:07d}'.format(self.nextId), 'storeLocation': district, 'storeId': storeId, 'startDate': startDate, \
+            'first': self.random.choice(firstNames), 'last': self.random.choice(lastNames), 'zipcode': '{0:05d}'.format(self.random.randint(10000, 99999))}
+        self.nextId += 1
+        return {'employee': employee}
+
+    #Employees already terminated and employees with sales are part of the registry too
+    def generateCurrentState(self, count):
+        records = []
+        for number in range(count):
+            record = self.newEmployee(self.getDate(2010, 2021))
+            if self.random.random() < 0.05:
+                record['employee']['endDate'] = self.getDate(2021, 2021)
+            elif self.random.random() < 0.2:
+                record['employee']['sales'] = [{'sale': {'id': str(self.random.randint(1, 1000))}}]
+            records.append(record)
+        return records
+
+    #Yields count inbound records changing the given registry, which is updated as the feed is generated
+    def generateInbound(self, currentRecords, count, mix=defaultMix):
+        current = {getRecordKey(record): record for record in currentRecords}
+        keys = list(current)
+        self.random.shuffle(keys)
+        kinds = list(mix)
+        weights = [mix[kind] for kind in kinds]
+        for number in range(count):
+            kind = self.random.choices(kinds, weights)[0]
+            if kind == 'hire' or len(keys) == 0:
+                record = self.newEmployee(self.getDate(2022, 2022))
+                keys.append(getRecordKey(record))
+            else:
+                record = {'employee': dict(current[keys[self.getSkewedIndex(len(keys))]]['employee'])}
+                employee = record['employee']
+                if kind == 'termination':
+                    employee['endDate'] = self.getDate(2022, 2022)
+                elif kind == 'namechange':
+                    if self.random.random() < 0.5:
+                        employee['first'] = self.random.choice([name for name in firstNames if name != employee['first']])
+                    else:
+                        employee['last'] = self.random.choice([name for name in lastNames if name != employee['last']])
+                elif kind == 'sales':
+                    employee['sales'] = employee.get('sales', []) + [{'sale': {'id': str(self.random.randint(1, 1000))}}]
+            current[getRecordKey(record)] = record
+            yield record
+
+
+def parseMix(text):
+    mix = {}
+    for item in text.split(','):
+        kind, separator, weight = item.partition('=')
+        if kind not in defaultMix:
+            raise ValueError('Unknown change kind: ' + kind)
+        mix[kind] = float(weight)
+    return mix
+
+
+def printHelp():
+    print('\tfeedGenerator.py -c <currentcount> -n <inboundcount> [-t <sqlite:dbfile|snapshot:snapshotfile>] [-s <currentstatefile>] [-o <inboundfile|->]\n' \
+        '\t\t[--districts <district,...>] [--stores <per district>] [--skew <skew>] [--mix <kind=weight,...>] [--seed <seed>]\n')
+
+
+def main(argv):
+    currentCount = 0
+    inboundCount = 0
+    storeSpec = ''
+    currentStateFile = ''
+    inboundFile = '-'
+    districts = defaultDistricts
+    storesPerDistrict = defaultStoresPerDistrict
+    skew = defaultSkew
+    mix = defaultMix
+    seed = 1
+    try:
+        opts, args = getopt.getopt(argv, "hc:n:t:s:o:", ["districts=", "stores=", "skew=", "mix=", "seed="])
+        for opt, arg in opts:
+            if opt == '-h':
+                printHelp()
+                sys.exit()
+            elif opt == '-c':
+                currentCount = int(arg)
+            elif opt == '-n':
+                inboundCount = int(arg)
+            elif opt == '-t':
+                storeSpec = arg
+            elif opt == '-s':
+                currentStateFile = arg
+            elif opt == '-o':
+                inboundFile = arg
+            elif opt == '--districts':
+                districts = arg.split(',')
+            elif opt == '--stores':
+                storesPerDistrict = max(1, int(arg))
+            elif opt == '--skew':
+                skew = float(arg)
+            elif opt == '--mix':
+                mix = parseMix(arg)
+            elif opt == '--seed':
+                seed = int(arg)
+    except (getopt.GetoptError, ValueError):
+        printHelp()
+        sys.exit(2)
+
+    generator = FeedGenerator(districts, storesPerDistrict, skew, seed)
+    currentRecords = generator.generateCurrentState(currentCount)
+    if storeSpec != '':
+        openCurrentStateStore(storeSpec, currentRecords).close()
+    if currentStateFile != '':
+        with open(currentStateFile, 'w') as output:
+            json.dump({'employees': currentRecords}, output)
+
+    output = sys.stdout if inboundFile == '-' else open(inboundFile, 'w')
+    try:
+        for record in generator.generateInbound(currentRecords, inboundCount, mix):
+            output.write(json.dumps(record) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print('Generated {0} current and {1} inbound records'.format(currentCount, inboundCount), file=sys.stderr)
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
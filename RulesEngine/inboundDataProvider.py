@@ -5,12 +5,33 @@
 #                           rules engine to process. The data is an abbreviated version of a real
 #                           data model, and represents employee data for a brand with multiple stores.
 #
+#                           Real change feeds are streamed instead: NDJSON files, large JSON arrays
+#                           parsed incrementally, stdin, or a directory of rolling feed files. Each
+#                           record comes with its byte position so an interrupted run can resume.
+#
 # Created By            : Willy Demis
 # Created Date          : 2022-02-16
 # Version               : 1.0
 #############################################################################################################
 
+import codecs
+import itertools
 import json
+import os
+import re
+import sys
+
+##### Used as the number of bytes read from a feed at a time
+readChunkSize = 65536
+
+##### Used as the file extensions picked up from an inbound feed directory
+inboundExtensions = ('.json', '.ndjson', '.jsonl')
+
+##### Used to skip the whitespace and commas between JSON array elements
+separatorPattern = re.compile(r'[ \t\r\n,]*')
+
+##### Used to tell a {"employees": [...]} document from an NDJSON feed, whose objects start with the "employee" key
+wrappedDocumentPattern = re.compile(rb'\{\s*"employees"\s*:')
 
 def generateInboundData():
     json_inbound_data = \
@@ -73,4 +94,155 @@ def generateInboundData():
     }
     """
     inboundData = json.loads(json_inbound_data)
-    return inboundData
\ No newline at end of file
+    return inboundData
+
+
+#Yields (employee, position) pairs from an inbound feed without loading the feed into memory. The source is a
+# file, a directory of feed files read in file name order, or '-' for stdin. Without a source the sample data
+# above is used (with no positions). A position is [path, byteOffset] just past the record; handing a saved
+# position back in resumes the feed right after that record
+def streamInboundData(source=None, position=None):
+    if source is None:
+        for employee in generateInboundData()['employees']:
+            yield employee, None
+        return
+
+    if source != '-' and os.path.isdir(source):
+        paths = sorted(os.path.join(source, name) for name in os.listdir(source) if name.endswith(inboundExtensions))
+        if position is not None:
+            paths = [path for path in paths if path >= position[0]]
+    else:
+        paths = [source]
+
+    for path in paths:
+        offset = position[1] if position is not None and path == position[0] else 0
+        for employee, recordOffset in readInboundFile(path, offset):
+            yield employee, [path, recordOffset]
+
+
+#Reads one feed file (or stdin) from a byte offset. The format is detected from the start of the feed: a
+# top-level array or a {"employees": [...]} document is parsed incrementally, anything else is NDJSON
+def readInboundFile(path, offset):
+    stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    try:
+        head = stream.read(readChunkSize)
+        isArray = isJsonArrayFeed(head)
+        if offset == 0:
+            chunks = itertools.chain([head], readChunks(stream))
+        elif path == '-':
+            chunks = skipBytes(itertools.chain([head], readChunks(stream)), offset)
+        else:
+            stream.seek(offset)
+            chunks = readChunks(stream)
+
+        if isArray:
+            records = readJsonArray(chunks, offset)
+        else:
+            records = readNdjson(chunks, offset)
+        for record in records:
+            yield record
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+
+#Decided from the first non-whitespace byte alone, so it does not matter how long the first record is: '[' starts
+# an array feed and '{' an NDJSON record, unless the object opens with the "employees" key of a wrapped document
+def isJsonArrayFeed(head):
+    text = head.lstrip()
+    if text.startswith(b'['):
+        return True
+    return wrappedDocumentPattern.match(text) is not None
+
+
+def readChunks(stream):
+    while True:
+        chunk = stream.read(readChunkSize)
+        if not chunk:
+            return
+        yield chunk
+
+
+def skipBytes(chunks, count):
+    for chunk in chunks:
+        if count >= len(chunk):
+            count -= len(chunk)
+            continue
+        yield chunk[count:]
+        count = 0
+
+
+def readNdjson(chunks, offset):
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            offset += len(line) + 1
+            if line.strip():
+                yield json.loads(line), offset
+    if pending.strip():
+        yield json.loads(pending), offset + len(pending)
+
+
+#Decodes the array elements one at a time, only keeping the unparsed tail of the feed in memory. Starting at
+# offset 0 skips to the first '[' (the employees array of a document); any other offset must be a position
+# returned for an earlier record, which is inside the array
+def readJsonArray(chunks, offset):
+    decoder = json.JSONDecoder()
+    textDecoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    index = 0
+    insideArray = offset > 0
+    finished = False
+    while True:
+        if not insideArray:
+            start = buffer.find('[', index)
+            if start >= 0:
+                offset += len(buffer[index:start + 1].encode('utf-8'))
+                index = start + 1
+                insideArray = True
+                continue
+        else:
+            #Separators are single byte characters, so characters skipped equal bytes skipped
+            skipped = separatorPattern.match(buffer, index).end()
+            offset += skipped - index
+            index = skipped
+            if buffer.startswith(']', index):
+                return
+            if index < len(buffer):
+                try:
+                    record, end = decoder.raw_decode(buffer, index)
+                except ValueError:
+                    if finished:
+                        raise
+                else:
+                    offset += len(buffer[index:end].encode('utf-8'))
+                    index = end
+                    yield record, offset
+                    continue
+
+        if finished:
+            return
+        chunk = next(chunks, None)
+        buffer = buffer[index:]
+        index = 0
+        if chunk is None:
+            buffer += textDecoder.decode(b'', True)
+            finished = True
+        else:
+            buffer += textDecoder.decode(chunk)
+
+
+def loadInboundPosition(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as positionFile:
+        return json.load(positionFile)
+
+
+def saveInboundPosition(path, position):
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'w') as positionFile:
+        json.dump(position, positionFile)
+    os.replace(temporaryPath, path)
@@ -0,0 +1,468 @@
+#############################################################################################################
+# Project               : Data Transformation Solution: Rules Engine Application
+# Description           : This python code is a small, native rules engine that can stand in for
+#                           durable_rules in the rules engine application. It mirrors the subset of
+#                           the durable.lang syntax the rulesets use (ruleset, when_all, when_any,
+#                           all, m, c, the << alias operator, +/- presence tests, comparisons and
+#                           &/|) and compiles every pattern into plain python predicates.
+#
+#                           Rules are evaluated directly when an event is posted: the event is
+#                           matched against the last pattern of a rule and the asserted facts of
+#                           the ruleset (newest first) against the patterns before it. The first
+#                           rule that matches, in definition order, fires and consumes the event.
+#                           As in durable_rules, facts stay in the ruleset until they are retracted,
+#                           and asserting a fact or posting an event identical to a fact that is
+#                           already in the ruleset raises MessageObservedException. Unlike
+#                           durable_rules, an event that fires no rule is dropped instead of held,
+#                           and a fact never stands in for the event of a rule, so a rule only
+#                           decides when an event is posted. These are the semantics the rules are
+#                           written for and the reference the engine comparison checks
+#                           durable_rules against; the two agree as long as each record's fact
+#                           and event are retracted once it was evaluated. Facts are kept
+#                           in per-pattern memories hash indexed on the rules' equality joins (the
+#                           "m.employee.id == c.current.employee.id" tests), so an event is only
+#                           tested against the facts it can pair with.
+#
+# Version               : 1.0
+#############################################################################################################
+
+import builtins
+import json
+import operator
+
+##### Used as the comparison operators supported between a field and a value or another field
+comparisonOperators = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+##### Used as the registered rulesets by name, and the ruleset whose "with" block is being defined
+rulesets = {}
+definingRuleset = None
+
+#Returned for a field path that does not exist in a message
+missing = object()
+
+
+
+class MessageObservedException(Exception):
+    pass
+
+
+#A reference to a message field: m.employee.id for the message being matched, c.current.employee.id for the
+# message bound to the "current" alias. Operators build the expressions patterns are made of
+class Field:
+    def __init__(self, alias, path):
+        self.alias = alias
+        self.path = path
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return Field(self.alias, self.path + (name,))
+
+    #c.current << expression names the message matched by the expression
+    def __lshift__(self, expression):
+        expression.alias = self.alias
+        return expression
+
+    def __pos__(self):
+        return Expression('+', self)
+
+    def __neg__(self):
+        return Expression('-', self)
+
+    def __eq__(self, other):
+        return Expression('==', self, other)
+
+    def __ne__(self, other):
+        return Expression('!=', self, other)
+
+    def __lt__(self, other):
+        return Expression('<', self, other)
+
+    def __le__(self, other):
+        return Expression('<=', self, other)
+
+    def __gt__(self, other):
+        return Expression('>', self, other)
+
+    def __ge__(self, other):
+        return Expression('>=', self, other)
+
+
+class Closure:
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return Field(name, ())
+
+
+class Expression:
+    def __init__(self, op, left, right=None):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.alias = None
+
+    #The alias set on one side of & or | (c.ingest << a & b binds as (c.ingest << a) & b) names the whole expression
+    def __and__(self, other):
+        combined = Expression('&', self, other)
+        combined.alias = self.alias or other.alias
+        return combined
+
+    def __or__(self, other):
+        combined = Expression('|', self, other)
+        combined.alias = self.alias or other.alias
+        return combined
+
+
+m = Field(None, ())
+c = Closure()
+
+
+#Compiles an expression into a predicate taking the message being matched and the messages bound so far
+def compileExpression(expression):
+    if expression.op in ('&', '|'):
+        operands = []
+        flattenExpression(expression, expression.op, operands)
+        predicates = [compileExpression(operand) for operand in operands]
+        if expression.op == '&':
+            return lambda message, bound: builtins.all(predicate(message, bound) for predicate in predicates)
+        return lambda message, bound: builtins.any(predicate(message, bound) for predicate in predicates)
+
+    getLeft = compileValue(expression.left)
+    if expression.op == '+':
+        return lambda message, bound: getLeft(message, bound) is not missing
+    if expression.op == '-':
+        return lambda message, bound: getLeft(message, bound) is missing
+
+    compare = comparisonOperators[expression.op]
+    getRight = compileValue(expression.right)
+    def predicate(message, bound):
+        left = getLeft(message, bound)
+        right = getRight(message, bound)
+        return left is not missing and right is not missing and compare(left, right)
+    return predicate
+
+
+def flattenExpression(expression, op, operands):
+    if isinstance(expression, Expression) and expression.op == op:
+        flattenExpression(expression.left, op, operands)
+        flattenExpression(expression.right, op, operands)
+    else:
+        operands.append(expression)
+
+
+#Compiles a field reference (or a constant) into a getter returning the value or missing
+def compileValue(value):
+    if not isinstance(value, Field):
+        return lambda message, bound: value
+    alias = value.alias
+    path = value.path
+    def getValue(message, bound):
+        current = message if alias is None else bound[alias]
+        for name in path:
+            if not isinstance(current, dict) or name not in current:
+                return missing
+            current = current[name]
+        return current
+    return getValue
+
+
+class Pattern:
+    def __init__(self, expression):
+        if expression.alias is None:
+            raise ValueError('Patterns must be named with the << operator, e.g. c.current << m.employee.id == ""')
+        self.alias = expression.alias
+        self.expression = expression
+        self.matches = compileExpression(expression)
+
+    #Finds an "m.x == c.<alias>.y" test among the top level & operands, which lets the facts bound to alias be
+    # hash indexed on y and looked up by the event's x. Returns the (event, fact) value getters or None
+    def getJoin(self, alias):
+        operands = []
+        flattenExpression(self.expression, '&', operands)
+        for operand in operands:
+            if not isinstance(operand, Expression) or operand.op != '==':
+                continue
+            for eventField, factField in ((operand.left, operand.right), (operand.right, operand.left)):
+                if isinstance(eventField, Field) and isinstance(factField, Field) and eventField.alias is None and factField.alias == alias:
+                    return compileValue(eventField), compileValue(Field(None, factField.path))
+        return None
+
+
+#when_all(...) is one group of patterns; when_any(all(...), all(...)) is several, any of which can match
+class all:
+    def __init__(self, *patterns):
+        self.patterns = [Pattern(pattern) for pattern in patterns]
+
+
+class any:
+    def __init__(self, *groups):
+        self.groups = [group.patterns if isinstance(group, all) else [Pattern(group)] for group in groups]
+
+
+class Rule:
+    def __init__(self, groups):
+        self.groups = groups
+        self.action = None
+
+    def __call__(self, action):
+        if definingRuleset is None:
+            raise Exception('Rules must be defined inside a "with ruleset(name)" block')
+        self.action = action
+        definingRuleset.rules.append(self)
+        return action
+
+
+def when_all(*patterns):
+    return Rule([all(*patterns).patterns])
+
+
+def when_any(*groups):
+    return Rule(any(*groups).groups)
+
+
+#Matches a single pattern group against the event alone
+class EventMatcher:
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def match(self, event, facts):
+        if self.pattern.matches(event, {}):
+            return {self.pattern.alias: event}
+        return None
+
+
+#The usual fact/event pair. Facts passing the fact pattern are kept in this matcher's own memory when they are
+# asserted, hash indexed on the join field when the event pattern joins on one, so posting an event only tests
+# the facts that can pair with it instead of every fact in the ruleset
+class FactMemory:
+    def __init__(self, factPattern, eventPattern):
+        self.factPattern = factPattern
+        self.eventPattern = eventPattern
+        self.facts = {}
+        self.join = eventPattern.getJoin(factPattern.alias)
+        self.index = {}
+
+    def getBucket(self, fact):
+        if self.join is None:
+            return self.facts
+        joinValue = getJoinValue(self.join[1](fact, None))
+        if joinValue is missing:
+            return None
+        return self.index.setdefault(joinValue, {})
+
+    def add(self, key, fact):
+        if self.factPattern.matches(fact, {}):
+            self.facts[key] = fact
+            bucket = self.getBucket(fact)
+            if bucket is not None:
+                bucket[key] = fact
+
+    def remove(self, key, fact):
+        if self.facts.pop(key, None) is not None and self.join is not None:
+            joinValue = getJoinValue(self.join[1](fact, None))
+            bucket = self.index.get(joinValue) if joinValue is not missing else None
+            if bucket is not None:
+                bucket.pop(key, None)
+                if len(bucket) == 0:
+                    del self.index[joinValue]
+
+    def match(self, event, facts):
+        if self.join is None:
+            candidates = self.facts
+        else:
+            candidates = self.index.get(getJoinValue(self.join[0](event, None)), {})
+        for fact in reversed(candidates.values()):
+            bound = {self.factPattern.alias: fact}
+            if self.eventPattern.matches(event, bound):
+                bound[self.eventPattern.alias] = event
+                return bound
+        return None
+
+
+#Any longer pattern group binds its patterns to distinct facts by scanning all of them
+class FactScanMatcher:
+    def __init__(self, patterns):
+        self.patterns = patterns
+
+    def match(self, event, facts):
+        return matchPatterns(self.patterns, event, list(reversed(facts.values())), {})
+
+
+class ruleset:
+    def __init__(self, name):
+        if name in rulesets:
+            raise Exception('Ruleset with name {0} already registered'.format(name))
+        self.name = name
+        self.rules = []
+        self.facts = {}
+        self.factKeys = {}
+        self.matchers = []
+        self.memories = []
+
+    def __enter__(self):
+        global definingRuleset
+        definingRuleset = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global definingRuleset
+        definingRuleset = None
+        if exc_type is None:
+            for rule in self.rules:
+                ruleMatchers = [self.createMatcher(patterns) for patterns in rule.groups]
+                self.matchers.append((rule, ruleMatchers))
+            rulesets[self.name] = self
+
+    def createMatcher(self, patterns):
+        if len(patterns) == 1:
+            return EventMatcher(patterns[0])
+        if len(patterns) == 2:
+            memory = FactMemory(patterns[0], patterns[1])
+            self.memories.append(memory)
+            return memory
+        return FactScanMatcher(patterns)
+
+    def assertFact(self, fact):
+        key = getFactKey(fact)
+        if key in self.facts:
+            raise MessageObservedException(fact)
+        self.facts[key] = fact
+        self.factKeys[id(fact)] = key
+        for memory in self.memories:
+            memory.add(key, fact)
+
+    #Rule actions retract the fact object they were handed, which is found by identity before falling back to content
+    def retractFact(self, fact):
+        key = self.factKeys.get(id(fact))
+        if key is None or self.facts.get(key) is not fact:
+            key = getFactKey(fact)
+        fact = self.facts.pop(key, None)
+        if fact is not None:
+            del self.factKeys[id(fact)]
+            for memory in self.memories:
+                memory.remove(key, fact)
+
+    #As in durable_rules, an event identical to a fact in the ruleset is rejected
+    def post(self, event):
+        if getFactKey(event) in self.facts:
+            raise MessageObservedException(event)
+        for rule, ruleMatchers in self.matchers:
+            for matcher in ruleMatchers:
+                bound = matcher.match(event, self.facts)
+                if bound is not None:
+                    rule.action(Context(self, bound))
+                    return True
+        return False
+
+
+#Binds the patterns before the last one to distinct facts and the last one to the event, depth first
+def matchPatterns(patterns, event, facts, bound):
+    if len(patterns) == 1:
+        if patterns[0].matches(event, bound):
+            bound = dict(bound)
+            bound[patterns[0].alias] = event
+            return bound
+        return None
+    for fact in facts:
+        if builtins.any(fact is boundMessage for boundMessage in bound.values()):
+            continue
+        if patterns[0].matches(fact, bound):
+            candidate = dict(bound)
+            candidate[patterns[0].alias] = fact
+            result = matchPatterns(patterns[1:], event, facts, candidate)
+            if result is not None:
+                return result
+    return None
+
+
+#Join values are used as dict keys; lists and dicts are keyed by their JSON form
+def getJoinValue(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+#Like durable_rules, messages are told apart by their serialized content, key order included
+def getFactKey(fact):
+    return repr(getattr(fact, '_d', fact))
+
+
+#Read access to a message in a rule action, printed and compared like durable_rules content
+class Content:
+    def __init__(self, data):
+        self.__dict__['_d'] = data
+
+    def items(self):
+        return self._d.items()
+
+    def __getitem__(self, key):
+        if key in self._d:
+            data = self._d[key]
+            if isinstance(data, dict):
+                data = Content(data)
+            return data
+        return None
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.__getitem__(name)
+
+    def __contains__(self, key):
+        return key in self._d
+
+    def __repr__(self):
+        return repr(self._d)
+
+    def __str__(self):
+        return str(self._d)
+
+
+#The "c" handed to a rule action: the bound messages by alias, plus fact and event calls on the same ruleset
+class Context:
+    def __init__(self, ruleset, bound):
+        self.__dict__['ruleset'] = ruleset
+        self.__dict__['bound'] = bound
+
+    def __getattr__(self, name):
+        if name in self.bound:
+            return Content(self.bound[name])
+        raise AttributeError(name)
+
+    def assert_fact(self, fact):
+        self.ruleset.assertFact(getattr(fact, '_d', fact))
+
+    def retract_fact(self, fact):
+        self.ruleset.retractFact(getattr(fact, '_d', fact))
+
+    def post(self, event):
+        self.ruleset.post(getattr(event, '_d', event))
+
+
+def getRuleset(rulesetName):
+    if rulesetName not in rulesets:
+        raise Exception('Ruleset with name {0} not found'.format(rulesetName))
+    return rulesets[rulesetName]
+
+
+def assert_fact(rulesetName, fact):
+    getRuleset(rulesetName).assertFact(fact)
+
+
+def retract_fact(rulesetName, fact):
+    getRuleset(rulesetName).retractFact(fact)
+
+
+def post(rulesetName, event):
+    getRuleset(rulesetName).post(event)
+
+
+def get_facts(rulesetName):
+    return list(getRuleset(rulesetName).facts.values())
+
+
+#Events are never held: one that fires no rule is dropped when it is posted
+def get_pending_events(rulesetName):
+    getRuleset(rulesetName)
+    return []
@@ -12,9 +12,9 @@
 #                                   a) Determine first sales event\
 #
 #                           Of course the rules are arbitrary and contrived for this example.
-#                           In the real world, rulesets would be in their own files and likely
-#                           very complicated. This example ultimately just shows durable_rules
-#                           in action.
+#                           The rulesets are defined in their own files in the Rulesets
+#                           directory (see rulesetLoader), mapped to the districts they apply
+#                           to. This example ultimately just shows durable_rules in action.
 #
 #                           The durable_rules engine documentation can be found here:
 #                               https://github.com/jruizgit/rules/blob/master/docs/py/reference.md
@@ -24,74 +24,846 @@
 # Version               : 1.0
 #############################################################################################################
 
-from durable.lang import *
-from inboundDataProvider import generateInboundData
-from currentStateDataProvider import getCurrentStateData
+from inboundDataProvider import streamInboundData, loadInboundPosition, saveInboundPosition
+from currentStateDataProvider import getCurrentStateDataBulk, updateCurrentStateData, openCurrentStateStore, setCurrentStateStore, toRecord, \
+    getCurrentStateHashBulk, getContentHash, setContentHashFields, closeCurrentStateStore
+from asyncPipeline import WriteBehindSink, runPipeline, defaultFlushSize, defaultFlushInterval, defaultQueueSize
+from eventCoalescer import EventCoalescer
+from engineCheckpoint import CheckpointStore, getPairId
+from rulesetLoader import RulesetCatalog, buildRuleset, defaultRulesetDirectory
+from engineMetrics import EngineMetrics, MetricsServer, mergeSnapshots, writeSnapshot, getRecordsPerSecond
 from jsondiff import diff
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import getopt
+import importlib
+import io
 import json
+import multiprocessing
+import sys
+import time
+import traceback
+import zlib
 
-#This would be a serivce level call to update the DB with the incoming data
-def storeEventToDB(jsonObj):
+#This would be a serivce level call to update the DB with the incoming data. The decision goes to the current
+# decision sink, which writes it directly or, in a partition worker, collects it for the parent process. pairId
+# identifies the fact and event pair the decision was made on when checkpoints are taken
+def storeEventToDB(jsonObj, pairId=None):
+    decisionSink(jsonObj, pairId)
+
+def writeDecisionToDB(jsonObj, pairId):
     print('Store employee {0} to DB'.format(jsonObj["employee"]["id"]))
+    storeDecision(getJournalDecisionId(pairId), toRecord(jsonObj))
+
+#With checkpoints, the id a decision is journaled under (see CheckpointStore.getDecisionId)
+def getJournalDecisionId(pairId):
+    return checkpointStore.getDecisionId(pairId) if checkpointStore is not None else None
+
+#With checkpoints, a decision already stored under its id (before a restart) is not stored again
+def storeDecision(decisionId, record):
+    if checkpointStore is None:
+        updateCurrentStateData(record)
+    elif len(checkpointStore.getUnstored([(decisionId, record)])) > 0:
+        updateCurrentStateData(record)
+        checkpointStore.markStored([decisionId])
+
+decisionSink = writeDecisionToDB
+
+##### Used as the engine modules the rulesets can run on: durable_rules, or the native engine mirroring its syntax.
+#####   'compare' runs both and reports where durable_rules disagrees with the native engine
+engineModules = {'durable': 'durable.lang', 'native': 'nativeEngine'}
+engineExceptionModules = {'durable': 'durable.engine', 'native': 'nativeEngine'}
+engineNames = ['durable', 'native', 'compare']
+defaultEngineName = 'durable'
+
+##### Used as the selected engine (a module or a DifferentialEngine) and the exceptions it raises for a message
+#####   identical to one it already holds
+engine = None
+selectedEngineName = None
+observedExceptions = ()
+
+##### Used as the rulesets loaded from the ruleset files (a RulesetCatalog), and the (engine, district) pairs whose
+#####   ruleset is defined. A district's ruleset is only defined on an engine when its first record arrives
+rulesetCatalog = None
+registeredRulesets = set()
+
+##### Used as the default fact lifecycle: 'event' retracts each current state fact once its event is processed,
+#####   'ttl:<seconds>' once the fact is older than the TTL, and 'none' leaves retraction to the rule actions. Only
+#####   the native engine can hold facts across records
+defaultFactLifecycle = 'event'
+factLifecycle = None
+
+##### Used as the metrics collector (an EngineMetrics) when metrics are enabled, and the default number of seconds
+#####   between writes of the metrics file
+metrics = None
+defaultMetricsInterval = 10.0
+
+##### Used as the change filter (a ChangeFilter) when unchanged inbound records are skipped before the engine
+changeFilter = None
+
+##### Used as the checkpoint store (a CheckpointStore) when checkpoints are taken, the default number of seconds
+#####   between checkpoints, whether rule actions identify the pair they fired on (with checkpoints, also in
+#####   partition workers), and the write-behind sink of an async run
+checkpointStore = None
+defaultCheckpointInterval = 30.0
+trackDecisionIds = False
+writeBehindSink = None
+
+#The rule actions the ruleset files name. Their rulesets are defined in the Rulesets directory, one file per
+# district or group of districts (see rulesetLoader), and each action is the decision of a rule: it prints the
+# current and ingest states it was matched with, stores the ingest state and retracts the current state fact.
+# The engine uses "forward occurance" to store state about the fact (labeled "current" in the rules) and compare
+# it to the next event to pass through the ruleset (labeled "ingest")
+def releaseEvent(c):
+    print('Current state: \t{0}\nIngest state: \t{1}\nDecision: {2} was fired from store {3}'.format(c.current, c.ingest, c.ingest.employee.first + " " + c.ingest.employee.last, c.ingest.employee.storeId))
+    storeEventToDB(c.ingest, getFiredPairId(c))
+    c.retract_fact(c.current)
+
+def hireEvent(c):
+    print('Current state: \t{0}\nIngest state: \t{1}\nDecision: {2} was hired at store {3}'.format(c.current, c.ingest, c.ingest.employee.first + " " + c.ingest.employee.last, c.ingest.employee.storeId))
+    storeEventToDB(c.ingest, getFiredPairId(c))
+    c.retract_fact(c.current)
+
+def nameChangeEvent(c):
+    print('Decision: Employee {0} had name change event\nCurrent state: \t{1}\nIngest state: \t{2}\nJSON Diff: \t{3}'.format(c.ingest.employee.id, c.current, c.ingest, diff(c.current, c.ingest)))
+    storeEventToDB(c.ingest, getFiredPairId(c))
+    c.retract_fact(c.current)
+
+def firstSalesEvent(c):
+    print('Current state: \t{0}\nIngest state: \t{1}\nDecision: {2} had first sales event at store {3}'.format(c.current, c.ingest, c.ingest.employee.first + " " + c.ingest.employee.last, c.ingest.employee.storeId))
+    storeEventToDB(c.ingest, getFiredPairId(c))
+    c.retract_fact(c.current)
+
+ruleActions = {action.__name__: action for action in (releaseEvent, hireEvent, nameChangeEvent, firstSalesEvent)}
+
+#The pair a rule fired on identifies its decision, since a single record can be decided on with more than one fact
+def getFiredPairId(c):
+    if not trackDecisionIds:
+        return None
+    return getPairId(getattr(c.current, '_d', c.current), getattr(c.ingest, '_d', c.ingest))
+
+
+#Counts and times the fires of a rule action when metrics are enabled
+def instrumentRule(rulesetName):
+    def decorator(action):
+        @functools.wraps(action)
+        def instrumentedAction(c):
+            if metrics is None:
+                action(c)
+                return
+            started = time.perf_counter()
+            action(c)
+            metrics.recordFire(rulesetName, action.__name__, time.perf_counter() - started)
+        return instrumentedAction
+    return decorator
+
+
+#Runs every fact and event through a reference and a candidate engine and reports any message on which the two
+# decide differently. The native engine is the reference: a rule decides on the event just posted, paired with
+# the facts asserted before it. durable_rules can also match a held fact against a rule's ingest pattern, which is
+# why main only holds facts across records on the native engine. Only the reference engine's decisions are stored
+# and printed; the candidate runs with its own decision sink and metrics
+class DifferentialEngine:
+    def __init__(self, reference, candidate):
+        self.reference = reference
+        self.candidate = candidate
+        self.candidateMetrics = None
+        self.mismatchCount = 0
+
+    def assert_fact(self, rulesetName, fact):
+        self.callEngines('assert_fact', lambda engineModule, message: engineModule.assert_fact(rulesetName, message), fact)
+
+    def retract_fact(self, rulesetName, fact):
+        self.callEngines('retract_fact', lambda engineModule, message: engineModule.retract_fact(rulesetName, message), fact)
+
+    def post(self, rulesetName, event):
+        self.callEngines('post', lambda engineModule, message: engineModule.post(rulesetName, message), event)
+
+    #Each engine retracts its own event, since one engine can reject an event as a duplicate that the other accepts
+    def postEvent(self, rulesetName, event):
+        self.callEngines('post', lambda engineModule, message: postEvent(engineModule, rulesetName, message), event)
+
+    def get_facts(self, rulesetName):
+        return self.reference.get_facts(rulesetName)
+
+    def get_pending_events(self, rulesetName):
+        return self.reference.get_pending_events(rulesetName)
+
+    #The candidate gets a copy of the message, since rule actions retract the object they were handed
+    def callEngines(self, operation, call, message):
+        global decisionSink, metrics
+        sink = decisionSink
+        collector = metrics
+        if collector is not None and self.candidateMetrics is None:
+            self.candidateMetrics = EngineMetrics()
+        candidateDecisions = []
+        referenceDecisions = []
+        def recordDecision(jsonObj, pairId):
+            referenceDecisions.append(toRecord(jsonObj))
+            sink(jsonObj, pairId)
+        try:
+            decisionSink = lambda jsonObj, pairId: candidateDecisions.append(toRecord(jsonObj))
+            metrics = self.candidateMetrics if collector is not None else None
+            with contextlib.redirect_stdout(io.StringIO()):
+                candidateError = callEngine(call, self.candidate, copy.deepcopy(message))
+            decisionSink = recordDecision
+            metrics = collector
+            referenceError = callEngine(call, self.reference, message)
+        finally:
+            decisionSink = sink
+            metrics = collector
+        self.compare(operation, message, referenceDecisions, candidateDecisions, referenceError, candidateError)
+
+    #Errors are compared by type name, since each engine has its own exception classes
+    def compare(self, operation, message, referenceDecisions, candidateDecisions, referenceError, candidateError):
+        if referenceDecisions != candidateDecisions or type(referenceError).__name__ != type(candidateError).__name__:
+            self.mismatchCount += 1
+            print('Engine mismatch on {0} for employee {1}: {2} decisions and {3} from the reference engine, {4} decisions and {5} from the candidate'.format( \
+                operation, message["employee"]["id"] or '(blank)', len(referenceDecisions), type(referenceError).__name__, len(candidateDecisions), \
+                type(candidateError).__name__), file=sys.stderr)
+        if referenceError is not None:
+            raise referenceError
+
+
+def callEngine(call, engineModule, message):
+    try:
+        call(engineModule, message)
+    except Exception as e:
+        return e
+    return None
+
+
+#Posts an event and retracts it again, which does nothing when a rule consumed it. A duplicate raises before it
+# is retracted, since the engine never took it and its content is that of a fact the engine does hold
+def postEvent(engineModule, rulesetName, event):
+    if isinstance(engineModule, DifferentialEngine):
+        engineModule.postEvent(rulesetName, event)
+        return
+    engineModule.post(rulesetName, event)
+    engineModule.retract_fact(rulesetName, event)
+
+
+#Keeps engine state bounded. The current state fact asserted for an inbound record is only needed to pair with
+# that record's event, but a rule action only retracts it when the rule fires, so facts of records matching no
+# rule would stay in the engine forever. Facts are retracted right after their event or once older than a TTL.
+# The same goes for the event: one that no rule consumed would be held by durable_rules and pair with the facts of
+# later records, so it is retracted as soon as it was evaluated. A record identical to its fact is rejected by the
+# engines as a duplicate message and dropped without evaluation; it is counted since no rule can decide on it
+class FactLifecycle:
+    def __init__(self, policy):
+        self.policy = policy
+        self.ttl = None
+        if policy.startswith('ttl:'):
+            self.ttl = float(policy[len('ttl:'):])
+        elif policy not in ('event', 'none'):
+            raise ValueError('Unknown fact lifecycle: ' + policy)
+        self.expiring = collections.deque()
+        self.districts = set()
+        self.retractedCount = 0
+        self.duplicateCount = 0
+
+    def assertFact(self, district, fact):
+        if district not in self.districts:
+            registerDistrict(district)
+            self.districts.add(district)
+        started = time.perf_counter() if metrics is not None else None
+        try:
+            engine.assert_fact(district, fact)
+        except observedExceptions:
+            #The same fact is still held from an earlier record (only possible with a TTL, on the native engine), so
+            # that one is used
+            pass
+        if started is not None:
+            metrics.recordAssert(district, time.perf_counter() - started)
+
+    def postEvent(self, district, event):
+        started = time.perf_counter() if metrics is not None else None
+        try:
+            postEvent(engine, district, event)
+        except observedExceptions:
+            self.duplicateCount += 1
+        if started is not None:
+            metrics.recordPost(district, time.perf_counter() - started)
+
+    def afterEvent(self, district, fact):
+        if self.policy == 'event':
+            engine.retract_fact(district, fact)
+            self.retractedCount += 1
+        elif self.ttl is not None:
+            self.expiring.append((time.monotonic() + self.ttl, district, fact))
+        self.expireFacts()
+
+    def expireFacts(self):
+        now = time.monotonic()
+        while len(self.expiring) > 0 and self.expiring[0][0] <= now:
+            expires, district, fact = self.expiring.popleft()
+            engine.retract_fact(district, fact)
+            self.retractedCount += 1
+
+    #durable_rules keeps a session state fact ('$s') per ruleset, which is not one of ours
+    def getLiveFacts(self):
+        return {district: [fact for fact in engine.get_facts(district) if '$s' not in fact] for district in sorted(self.districts)}
+
+    def getLiveFactCounts(self):
+        return {district: len(facts) for district, facts in self.getLiveFacts().items()}
+
+    #Events still held by the engine, which should always be none since every event is retracted once evaluated.
+    # durable_rules also holds a '$pulse' event of its own in a ruleset that fired
+    def getHeldEventCounts(self):
+        return {district: len([event for event in engine.get_pending_events(district) if event.get('id') != '$pulse']) \
+            for district in sorted(self.districts)}
+
+    #Asserts the facts held when a checkpoint was taken; with a TTL they expire one TTL after the restart
+    def restoreFacts(self, facts):
+        for district, districtFacts in facts.items():
+            for fact in districtFacts:
+                self.assertFact(district, fact)
+                if self.ttl is not None:
+                    self.expiring.append((time.monotonic() + self.ttl, district, fact))
+
+    def getStats(self):
+        return {'liveFacts': self.getLiveFactCounts(), 'heldEvents': self.getHeldEventCounts(), 'retracted': self.retractedCount, \
+            'duplicates': self.duplicateCount}
+
+
+#Drops inbound records whose rule-relevant fields (every field a rule reads) hash the same as their current
+# state, so no fact/event pair is sent for them. New employees hash differently from the blank record and are
+# always forwarded. The store keeps each record's hash next to it, so an unchanged employee is compared without
+# reading its record. pendingRecords are decisions not written to the store yet
+class ChangeFilter:
+    def __init__(self):
+        setContentHashFields(getRuleFieldPaths())
+        self.forwardedCount = 0
+        self.unchangedCount = 0
+
+    #Returns the changed employees and, at the same positions, the current states read to hash them (None where
+    # the hash was kept), so the batch lookup does not read them again
+    def filterBatch(self, employees, pendingRecords=None):
+        if pendingRecords is None:
+            pendingRecords = {}
+        keys = [(employee["employee"]["id"], employee["employee"]["storeId"]) for employee in employees]
+        currentHashes = iter(getCurrentStateHashBulk([key for key in keys if key not in pendingRecords]))
+        changed = []
+        knownRecords = []
+        for key, employee in zip(keys, employees):
+            if key in pendingRecords:
+                currentHash, currentState = getContentHash(pendingRecords[key]), pendingRecords[key]
+            else:
+                currentHash, currentState = next(currentHashes)
+            if getContentHash(employee) != currentHash:
+                changed.append(employee)
+                knownRecords.append(currentState)
+        self.forwardedCount += len(changed)
+        self.unchangedCount += len(employees) - len(changed)
+        if metrics is not None:
+            metrics.recordUnchanged(len(employees) - len(changed))
+        return changed, knownRecords
+
+
+#The message field paths the rules of every district read, taken from the ruleset files
+def getRuleFieldPaths():
+    return getRulesetCatalog().getFieldPaths()
+
+
+#Loads the ruleset files of a directory; their compiled forms come from the cache when the files did not change
+def loadRulesets(directory=defaultRulesetDirectory):
+    global rulesetCatalog
+    rulesetCatalog = RulesetCatalog(directory, set(ruleActions))
+
+
+def getRulesetCatalog():
+    if rulesetCatalog is None:
+        loadRulesets()
+    return rulesetCatalog
+
+
+def getEngineModule(engineName):
+    return importlib.import_module(engineModules[engineName])
+
+
+#Defines the ruleset of a district on an engine the first time it is needed. A district without a ruleset file is
+# left undefined, so the engine rejects its records
+def registerRuleset(engineName, district):
+    if (engineName, district) in registeredRulesets or not getRulesetCatalog().hasRuleset(district):
+        return
+    buildRuleset(getEngineModule(engineName), district, rulesetCatalog.getRules(district), \
+        lambda actionName: instrumentRule(district)(ruleActions[actionName]))
+    registeredRulesets.add((engineName, district))
+
+
+#Registers a district's ruleset on the selected engine, or on both engines when comparing them
+def registerDistrict(district):
+    for engineName in (('durable', 'native') if selectedEngineName == 'compare' else (selectedEngineName,)):
+        registerRuleset(engineName, district)
+
+
+def selectEngine(engineName, lifecyclePolicy=defaultFactLifecycle):
+    global engine, selectedEngineName, observedExceptions, factLifecycle
+    if engineName == 'compare':
+        engine = DifferentialEngine(getEngineModule('native'), getEngineModule('durable'))
+        observedExceptions = tuple(getObservedException(name) for name in ('durable', 'native'))
+    else:
+        engine = getEngineModule(engineName)
+        observedExceptions = (getObservedException(engineName),)
+    selectedEngineName = engineName
+    factLifecycle = FactLifecycle(lifecyclePolicy)
+
+
+def getObservedException(engineName):
+    return importlib.import_module(engineExceptionModules[engineName]).MessageObservedException
+
+
+#The metrics of this process, merged with the last ones each partition worker returned
+def getMetricsSnapshot(partitionPool=None):
+    snapshots = [metrics.getSnapshot()]
+    if partitionPool is not None:
+        snapshots.extend(partitionPool.metricsSnapshots.values())
+    return mergeSnapshots(snapshots)
+
+
+#Prints the live fact and held event counts per ruleset (summed over the partition workers when there are any) to stderr
+def printFactStats(partitionPool=None):
+    stats = factLifecycle.getStats() if partitionPool is None else partitionPool.getFactStats()
+    print('Live facts: {0}, held events: {1} (retracted {2}, duplicate messages dropped without evaluation {3})'.format( \
+        ', '.join('{0}={1}'.format(district, count) for district, count in stats['liveFacts'].items()) or 'none', \
+        ', '.join('{0}={1}'.format(district, count) for district, count in stats['heldEvents'].items()) or 'none', \
+        stats['retracted'], stats['duplicates']), file=sys.stderr)
+
+
+##### Used as the default number of inbound records whose current state is looked up together
+defaultBatchSize = 100
+
+
+
+#Groups (employee, position) pairs from the inbound stream into micro-batches of up to batchSize records. A batch
+# is cut early when an employee shows up twice, since the second record has to see the current state stored by
+# the first one's decision
+def getMicroBatches(records, batchSize):
+    batch = []
+    batchKeys = set()
+    for record in records:
+        employee = record[0]
+        key = (employee["employee"]["id"], employee["employee"]["storeId"])
+        if len(batch) >= batchSize or key in batchKeys:
+            yield batch
+            batch = []
+            batchKeys = set()
+        batch.append(record)
+        batchKeys.add(key)
+    if len(batch) > 0:
+        yield batch
+
+
+#Resolves the current state of a whole micro-batch with one bulk lookup, then feeds the engine fact/event pairs in
+# inbound order, either here or spread over the workers of a partition pool
+def processMicroBatch(batch, partitionPool=None):
+    knownRecords = None
+    if changeFilter is not None:
+        batch, knownRecords = changeFilter.filterBatch(batch)
+    currentStates = lookupCurrentStates([(employee["employee"]["id"], employee["employee"]["storeId"]) for employee in batch], knownRecords)
+    if partitionPool is not None:
+        partitionPool.process(list(zip(currentStates, batch)))
+    else:
+        processRecords(zip(currentStates, batch))
+
+
+#getCurrentStateDataBulk, timed when metrics are enabled. Only the keys actually read are counted
+def lookupCurrentStates(keys, knownRecords=None):
+    if metrics is None:
+        return getCurrentStateDataBulk(keys, knownRecords)
+    started = time.perf_counter()
+    currentStates = getCurrentStateDataBulk(keys, knownRecords)
+    readCount = len(keys) if knownRecords is None else knownRecords.count(None)
+    metrics.recordLookup(time.perf_counter() - started, readCount)
+    return currentStates
+
+
+def processRecords(records):
+    for currentState, employee in records:
+        employeeId = employee["employee"]["id"]
+        storeId = employee["employee"]["storeId"]
+        district = employee["employee"]["storeLocation"]
+
+        #The durable_rules engine needs to get the current state as a 'fact'
+        # After the current state is sent, then the ingest state needs to be sent as an 'event'
+        # Fact/Event, Fact/Event, etc... this logical ordering is very important for it to work properly
+
+        #A rule can fire while the fact is asserted as well as while the event is posted; both count for this record
+        fireCount = metrics.fireCount if metrics is not None else None
+
+        #This simulates going to a DB to get the current state data for comparison. This submits the data as an Event to the rules engine
+        print('Sending current DB state fact to processor for district {0} on employee id: {1} and store id: {2}'.format(district, employeeId, storeId))
+        factLifecycle.assertFact(district, currentState)
+
+        #This presents the inbound data as a fact to the rules engine. A Fact can be compared against a subesquent Event
+        print('Sending inbound event to processor for employee id: {0}'.format(employeeId))
+        factLifecycle.postEvent(district, employee)
+        if fireCount is not None:
+            metrics.recordEvaluation(district, metrics.fireCount > fireCount)
+        factLifecycle.afterEvent(district, currentState)
+        print('')
+
+
+#Runs the rulesets in worker processes. Records are partitioned by a hash of district and employee id, so all
+# records of one employee go to the same worker in inbound order and each worker only holds the engine state of
+# its own employees. Current state lookups and DB writes stay in the parent: workers return their decisions and
+# their output, which is printed in partition order once the whole batch is done
+class PartitionPool:
+    def __init__(self, workerCount):
+        self.workerCount = workerCount
+        self.applyDecision = lambda pairId, record: storeDecision(getJournalDecisionId(pairId), record)
+        self.factStats = {}
+        self.metricsSnapshots = {}
+        self.resultQueue = multiprocessing.Queue()
+        self.inputQueues = []
+        self.workers = []
+        for partition in range(workerCount):
+            inputQueue = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=runPartitionWorker, args=(partition, selectedEngineName, factLifecycle.policy, getRulesetCatalog().directory, \
+                metrics is not None, trackDecisionIds, inputQueue, self.resultQueue), daemon=True)
+            worker.start()
+            self.inputQueues.append(inputQueue)
+            self.workers.append(worker)
+
+    def getPartition(self, employee):
+        key = employee["employee"]["storeLocation"] + '\0' + employee["employee"]["id"]
+        return zlib.crc32(key.encode('utf-8')) % self.workerCount
+
+    def process(self, records):
+        partitions = [[] for worker in self.workers]
+        for currentState, employee in records:
+            partitions[self.getPartition(employee)].append((currentState, employee))
+
+        pending = 0
+        for partition, partitionRecords in enumerate(partitions):
+            if len(partitionRecords) > 0:
+                self.inputQueues[partition].put(partitionRecords)
+                pending += 1
+
+        results = {}
+        while pending > 0:
+            partition, output, decisions, factStats, metricsSnapshot, error = self.resultQueue.get()
+            if error is not None:
+                raise RuntimeError('Partition worker {0} failed:\n{1}'.format(partition, error))
+            results[partition] = (output, decisions)
+            self.factStats[partition] = factStats
+            if metricsSnapshot is not None:
+                self.metricsSnapshots[partition] = metricsSnapshot
+            pending -= 1
+
+        for partition in sorted(results):
+            output, decisions = results[partition]
+            sys.stdout.write(output)
+            for pairId, record in decisions:
+                self.applyDecision(pairId, record)
+
+    #Sums the fact stats the workers returned with their last batch
+    def getFactStats(self):
+        totals = {'liveFacts': {}, 'heldEvents': {}, 'retracted': 0, 'duplicates': 0}
+        for factStats in self.factStats.values():
+            for counts in ('liveFacts', 'heldEvents'):
+                for district, count in factStats[counts].items():
+                    totals[counts][district] = totals[counts].get(district, 0) + count
+            totals['retracted'] += factStats['retracted']
+            totals['duplicates'] += factStats['duplicates']
+        totals['liveFacts'] = dict(sorted(totals['liveFacts'].items()))
+        totals['heldEvents'] = dict(sorted(totals['heldEvents'].items()))
+        return totals
+
+    def close(self):
+        for inputQueue in self.inputQueues:
+            inputQueue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+#The worker side of the partition pool: decisions are printed as usual but collected instead of written to the DB
+def runPartitionWorker(partition, engineName, lifecyclePolicy, rulesetDirectory, metricsEnabled, decisionIdsEnabled, inputQueue, resultQueue):
+    global decisionSink, metrics, trackDecisionIds
+    if engine is None:
+        loadRulesets(rulesetDirectory)
+        selectEngine(engineName, lifecyclePolicy)
+    metrics = EngineMetrics() if metricsEnabled else None
+    trackDecisionIds = decisionIdsEnabled
+    decisions = []
+    def collectDecision(jsonObj, pairId):
+        print('Store employee {0} to DB'.format(jsonObj["employee"]["id"]))
+        decisions.append((pairId, toRecord(jsonObj)))
+    decisionSink = collectDecision
+
+    for records in iter(inputQueue.get, None):
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                processRecords(records)
+            resultQueue.put((partition, output.getvalue(), list(decisions), factLifecycle.getStats(), \
+                metrics.getSnapshot() if metrics is not None else None, None))
+        except Exception:
+            resultQueue.put((partition, output.getvalue(), [], None, None, traceback.format_exc()))
+        del decisions[:]
+
+
+#Runs the micro-batches through the asyncio pipeline. Decisions are printed when they are made and queued on
+# the write-behind sink, which stores them in bulk (and saves the feed position) on its own DB thread
+def runAsyncPipeline(batches, partitionPool, positionFile, flushSize, flushInterval, queueSize, afterBatch):
+    global decisionSink, writeBehindSink
+    dbExecutor = concurrent.futures.ThreadPoolExecutor(1)
+    sink = WriteBehindSink(dbExecutor, flushSize, flushInterval, positionFile, checkpointStore)
+    def queueDecision(jsonObj, pairId):
+        print('Store employee {0} to DB'.format(jsonObj["employee"]["id"]))
+        sink.add(toRecord(jsonObj), getJournalDecisionId(pairId))
+    decisionSink = queueDecision
+    writeBehindSink = sink
+
+    processBatch = processRecords
+    if partitionPool is not None:
+        partitionPool.applyDecision = lambda pairId, record: sink.add(record, getJournalDecisionId(pairId))
+        processBatch = partitionPool.process
+    def evaluateBatch(records, position):
+        processBatch(records)
+        afterBatch(position)
+    try:
+        asyncio.run(runPipeline(batches, evaluateBatch, sink, queueSize, lookupCurrentStates, \
+            changeFilter.filterBatch if changeFilter is not None else None))
+    finally:
+        decisionSink = writeDecisionToDB
+        writeBehindSink = None
+        dbExecutor.shutdown()
+
+
+#Writes a checkpoint at the end of a processed batch: the feed position, the facts the engine still holds and the
+# decisions the write-behind sink has not written yet. A feed without positions (the sample data) can not resume,
+# so it is never checkpointed
+def saveCheckpoint(position):
+    if position is None:
+        return
+    pendingDecisions = writeBehindSink.getPendingDecisions() if writeBehindSink is not None else []
+    checkpointStore.save(position, factLifecycle.getLiveFacts(), pendingDecisions)
+
+
+#Restores the last checkpoint, if there is one, and returns its feed position (None without a checkpoint). The
+# facts are asserted again and the pending decisions stored, skipping any that were stored before the restart
+def restoreCheckpoint():
+    checkpoint = checkpointStore.load()
+    if checkpoint is None:
+        return None
+    position, facts, pendingDecisions = checkpoint
+    factLifecycle.restoreFacts(facts)
+    for pendingDecisionId, record in pendingDecisions:
+        storeDecision(pendingDecisionId, record)
+    print('Resuming from checkpoint at {0}: {1} facts restored, {2} pending decisions, {3} already stored'.format(position, \
+        sum(len(districtFacts) for districtFacts in facts.values()), len(pendingDecisions), checkpointStore.skippedCount), file=sys.stderr)
+    return position
+
+
+def printHelp():
+    print('\trulesEngine.py [-b <batchsize>] [-t <memory|sqlite:dbfile|snapshot:snapshotfile>] [-i <inboundfile|inbounddir|->] [--resume <positionfile>] [-w <workers>] [-e <durable|native|compare>]\n\t\t[--async [--flushsize <decisions>] [--flushinterval <seconds>] [--queuesize <batches>]] [--facts <event|ttl:seconds|none>] [--factreport <batches>]\n\t\t[--metrics <metricsfile>] [--metricsport <port>] [--metricsinterval <seconds>] [--skipunchanged]\n\t\t[--coalesce <records>] [--coalescetime <seconds>] [--checkpoint <checkpointfile> [--checkpointinterval <seconds>]]\n\t\t[--rulesets <rulesetdir>]\n')
+
+
+def main(argv):
+    global metrics, changeFilter, checkpointStore, trackDecisionIds
+    batchSize = defaultBatchSize
+    storeSpec = ''
+    inboundSource = None
+    positionFile = ''
+    workerCount = 0
+    asyncMode = False
+    flushSize = defaultFlushSize
+    flushInterval = defaultFlushInterval
+    queueSize = defaultQueueSize
+    engineName = defaultEngineName
+    lifecyclePolicy = defaultFactLifecycle
+    factReport = 0
+    metricsFile = ''
+    metricsPort = 0
+    metricsInterval = defaultMetricsInterval
+    skipUnchanged = False
+    coalesceSize = 0
+    coalesceSeconds = 0.0
+    checkpointFile = ''
+    checkpointInterval = defaultCheckpointInterval
+    rulesetDirectory = defaultRulesetDirectory
+    try:
+        opts, args = getopt.getopt(argv, "hb:t:i:w:e:", ["resume=", "async", "flushsize=", "flushinterval=", "queuesize=", "facts=", "factreport=", "metrics=", "metricsport=", "metricsinterval=", "skipunchanged", "coalesce=", "coalescetime=", "checkpoint=", \
+            "checkpointinterval=", "rulesets="])
+        for opt, arg in opts:
+            if opt == '-h':
+                printHelp()
+                sys.exit()
+            elif opt == '-b':
+                batchSize = max(1, int(arg))
+            elif opt == '-t':
+                storeSpec = arg
+            elif opt == '-i':
+                inboundSource = arg
+            elif opt == '--resume':
+                positionFile = arg
+            elif opt == '-w':
+                workerCount = int(arg)
+            elif opt == '-e':
+                if arg not in engineNames:
+                    raise ValueError(arg)
+                engineName = arg
+            elif opt == '--async':
+                asyncMode = True
+            elif opt == '--flushsize':
+                flushSize = max(1, int(arg))
+            elif opt == '--flushinterval':
+                flushInterval = float(arg)
+            elif opt == '--queuesize':
+                queueSize = max(1, int(arg))
+            elif opt == '--facts':
+                lifecyclePolicy = arg
+            elif opt == '--factreport':
+                factReport = int(arg)
+            elif opt == '--metrics':
+                metricsFile = arg
+            elif opt == '--metricsport':
+                metricsPort = int(arg)
+            elif opt == '--metricsinterval':
+                metricsInterval = float(arg)
+            elif opt == '--skipunchanged':
+                skipUnchanged = True
+            elif opt == '--coalesce':
+                coalesceSize = int(arg)
+            elif opt == '--coalescetime':
+                coalesceSeconds = float(arg)
+            elif opt == '--checkpoint':
+                checkpointFile = arg
+            elif opt == '--checkpointinterval':
+                checkpointInterval = float(arg)
+            elif opt == '--rulesets':
+                rulesetDirectory = arg
+    except (getopt.GetoptError, ValueError):
+        printHelp()
+        sys.exit(2)
+
+    if storeSpec != '':
+        setCurrentStateStore(openCurrentStateStore(storeSpec))
+    #A ruleset file that does not validate stops the run before any record is processed
+    try:
+        loadRulesets(rulesetDirectory)
+    except (OSError, ValueError) as e:
+        print('Could not load the rulesets: {0}'.format(e), file=sys.stderr)
+        sys.exit(2)
+    try:
+        selectEngine(engineName, lifecyclePolicy)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        printHelp()
+        sys.exit(2)
+
+    #durable_rules also matches a held fact against a rule's ingest pattern, so facts held across records get paired
+    # with each other or consumed before their own event arrives, and those records are decided wrongly or not at all
+    # (new employees all share the blank current state fact). Facts can only outlive their event on the native engine
+    if engineName != 'native' and lifecyclePolicy != 'event':
+        print('--facts {0} needs the native engine (-e native); durable_rules pairs held facts with each other'.format(lifecyclePolicy), file=sys.stderr)
+        printHelp()
+        sys.exit(2)
+
+    #With --checkpoint a restarted run resumes from the last checkpoint, which holds its own feed position.
+    # Partition workers hold their facts in their own processes, so only a pool that keeps none can be checkpointed
+    if checkpointFile != '' and workerCount > 1 and lifecyclePolicy != 'event':
+        print('Checkpoints with partition workers need --facts event', file=sys.stderr)
+        printHelp()
+        sys.exit(2)
+    #A snapshot store only writes its decisions when it is closed, so after a crash the saved position would skip
+    # records whose decisions were never written
+    if storeSpec.startswith('snapshot:') and (positionFile != '' or checkpointFile != ''):
+        print('--resume and --checkpoint need a store that writes each decision (sqlite), not a snapshot', file=sys.stderr)
+        printHelp()
+        sys.exit(2)
+    position = loadInboundPosition(positionFile) if positionFile != '' else None
+    if checkpointFile != '':
+        checkpointStore = CheckpointStore(checkpointFile)
+        trackDecisionIds = True
+        checkpointPosition = restoreCheckpoint()
+        if checkpointPosition is not None:
+            position = checkpointPosition
+
+    #Simulate getting json data from event grid location. Without an inbound source the sample data is used
+    inboundData = streamInboundData(inboundSource, position)
+    print('')
+
+    #Bursts of updates for one employee are merged into their net change before they are batched
+    coalescer = None
+    if coalesceSize > 0 or coalesceSeconds > 0:
+        coalescer = EventCoalescer(getRuleFieldPaths(), coalesceSize, coalesceSeconds)
+        inboundData = coalescer.coalesce(inboundData)
+
+    #Metrics are only collected when they are exported somewhere
+    if metricsFile != '' or metricsPort > 0:
+        metrics = EngineMetrics()
+    if metricsPort > 0:
+        MetricsServer(metricsPort, lambda: getMetricsSnapshot(partitionPool)).start()
+
+    partitionPool = PartitionPool(workerCount) if workerCount > 1 else None
+    if skipUnchanged:
+        changeFilter = ChangeFilter()
+
+    #With --factreport the live fact counts are printed every so many batches, to watch engine state over a long feed
+    batchCount = [0]
+    metricsWritten = [time.monotonic()]
+    checkpointed = [time.monotonic()]
+    lastPosition = [None]
+    def afterBatch(position):
+        batchCount[0] += 1
+        lastPosition[0] = position
+        if factReport > 0 and batchCount[0] % factReport == 0:
+            printFactStats(partitionPool)
+        if metricsFile != '' and time.monotonic() - metricsWritten[0] >= metricsInterval:
+            writeSnapshot(metricsFile, getMetricsSnapshot(partitionPool))
+            metricsWritten[0] = time.monotonic()
+        if checkpointStore is not None and time.monotonic() - checkpointed[0] >= checkpointInterval:
+            saveCheckpoint(position)
+            checkpointed[0] = time.monotonic()
+
+    #The feed position is saved once a whole batch has been processed, so a resumed run starts at the next batch
+    try:
+        if asyncMode:
+            runAsyncPipeline(getMicroBatches(inboundData, batchSize), partitionPool, positionFile, flushSize, flushInterval, queueSize, afterBatch)
+        else:
+            for batch in getMicroBatches(inboundData, batchSize):
+                processMicroBatch([employee for employee, position in batch], partitionPool)
+                afterBatch(batch[-1][1])
+                if positionFile != '' and batch[-1][1] is not None:
+                    saveInboundPosition(positionFile, batch[-1][1])
+        #Every decision is written by now, so the last checkpoint holds no pending ones
+        if checkpointStore is not None:
+            saveCheckpoint(lastPosition[0])
+    finally:
+        if factReport > 0:
+            printFactStats(partitionPool)
+        if metrics is not None:
+            snapshot = getMetricsSnapshot(partitionPool)
+            if metricsFile != '':
+                writeSnapshot(metricsFile, snapshot)
+            print('Processed {0} records in {1:.2f}s ({2:.0f} records/s), {3} rule fires, {4} records without a decision'.format( \
+                snapshot['records'], snapshot['elapsed'], getRecordsPerSecond(snapshot), sum(count for rulesetName, ruleName, count in snapshot['ruleFires']), \
+                sum(snapshot['unmatched'].values())), file=sys.stderr)
+        if partitionPool is not None:
+            partitionPool.close()
+        if coalescer is not None:
+            print('Coalesced {0} inbound records into {1} ({2} intermediate transitions kept)'.format( \
+                coalescer.receivedCount, coalescer.emittedCount, coalescer.transitionCount), file=sys.stderr)
+        if changeFilter is not None:
+            print('Skipped {0} unchanged records, {1} forwarded to the engine'.format(changeFilter.unchangedCount, changeFilter.forwardedCount), file=sys.stderr)
+        if isinstance(engine, DifferentialEngine):
+            print('Engine comparison: {0} mismatched messages'.format(engine.mismatchCount), file=sys.stderr)
+            if engine.candidateMetrics is not None:
+                candidateFires = sum(count for rulesetName, ruleName, count in engine.candidateMetrics.getSnapshot()['ruleFires'])
+                print('The durable_rules candidate made {0} rule fires'.format(candidateFires), file=sys.stderr)
+        if checkpointStore is not None:
+            print('Took {0} checkpoints, skipped {1} decisions already stored'.format(checkpointStore.checkpointCount, \
+                checkpointStore.skippedCount), file=sys.stderr)
+            checkpointStore.close()
+        closeCurrentStateStore()
+
+
 
-#This shows the ability to have rulesets per store since some stores might want to track different metrics for employees
-with ruleset('Chicago'):
-    
-    #When the "<<" operator is used, then "passes" through the ruleset will match each line represented by the operator.
-    # The engine uses "forward occurance" to store state about the fact (labeled below as "current") and compare it to the 
-    # next event to pass through the ruleset (labeled below as "ingest"). So the ruleset is comparing the current rule definition
-    # to the ingest rule definition in order to make a decision if the overall "when_all" rule criteria can be applied
-    @when_all(c.current << (-m.employee.endDate) & (+m.employee.startDate) & (m.employee.startDate != ''),
-              c.ingest << (+m.employee.endDate) & (m.employee.id == c.current.employee.id))
-    def releaseEvent(c):
-        print('Current state: \t{0}\nIngest state: \t{1}\nDecision: {2} was fired from store {3}'.format(c.current, c.ingest, c.ingest.employee.first + " " + c.ingest.employee.last, c.ingest.employee.storeId))
-        storeEventToDB(c.ingest)
-        c.retract_fact(c.current)
-
-    @when_all(c.current << (m.employee.startDate == ''), 
-              c.ingest << (m.employee.startDate != '') & (-m.employee.endDate))
-    def hireEvent(c):
-        print('Current state: \t{0}\nIngest state: \t{1}\nDecision: {2} was hired at store {3}'.format(c.current, c.ingest, c.ingest.employee.first + " " + c.ingest.employee.last, c.ingest.employee.storeId))
-        storeEventToDB(c.ingest)
-        c.retract_fact(c.current)
-
-    @when_any(all(c.current << (+m.employee.first), 
-                  c.ingest << (+m.employee.first) & (m.employee.first != c.current.employee.first) & (m.employee.id == c.current.employee.id)),
-              all(c.current << (+m.employee.last), 
-                  c.ingest << (+m.employee.last) & (m.employee.last != c.current.employee.last) & (m.employee.id == c.current.employee.id)))
-    def nameChangeEvent(c):
-        print('Decision: Employee {0} had name change event\nCurrent state: \t{1}\nIngest state: \t{2}\nJSON Diff: \t{3}'.format(c.ingest.employee.id, c.current, c.ingest, diff(c.current, c.ingest)))
-        storeEventToDB(c.ingest)
-        c.retract_fact(c.current)
-
-#This shows a different rule set with different logic for another store
-with ruleset('Indianapolis'):
-    @when_all(c.current << (-m.empoyee.sales),
-              c.ingest << (+m.employee.sales) & (m.employee.id == c.current.employee.id))
-    def firstSalesEvent(c):
-        print('Current state: \t{0}\nIngest state: \t{1}\nDecision: {2} had first sales event at store {3}'.format(c.current, c.ingest, c.ingest.employee.first + " " + c.ingest.employee.last, c.ingest.employee.storeId))
-        storeEventToDB(c.ingest)
-        c.retract_fact(c.current)
-
-
-#Simulate getting json data from event grid location
-inboundData = generateInboundData()
-print('')
-
-for employee in inboundData['employees']:
-    employeeId = employee["employee"]["id"]
-    storeId = employee["employee"]["storeId"]
-    district = employee["employee"]["storeLocation"]
-
-    #The durable_rules engine needs to get the current state as a 'fact'
-    # After the current state is sent, then the ingest state needs to be sent as an 'event'
-    # Fact/Event, Fact/Event, etc... this logical ordering is very important for it to work properly
-    
-    #This simulates going to a DB to get the current state data for comparison. This submits the data as an Event to the rules engine
-    print('Sending current DB state fact to processor for district {0} on employee id: {1} and store id: {2}'.format(district, employeeId, storeId))
-    assert_fact(district, getCurrentStateData(employeeId, storeId))
-
-    #This presents the inbound data as a fact to the rules engine. A Fact can be compared against a subesquent Event
-    print('Sending inbound event to processor for employee id: {0}'.format(employeeId))
-    post(district, employee)
-    print('')
\ No newline at end of file
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,286 @@
+#############################################################################################################
+# Project               : Data Transformation Solution: Rules Engine Application
+# Description           : This python code is used in conjunction with the rules engine.
+#                           It loads the rulesets from declarative ruleset files (JSON, or YAML
+#                           when PyYAML is installed). Each file maps one or more storeLocation
+#                           values (districts) to a list of rules, whose patterns are conditions
+#                           written in the durable.lang syntax:
+#
+#                               {"storeLocations": ["Chicago"],
+#                                "rules": [{"action": "hireEvent",
+#                                           "when_all": [{"current": "m.employee.startDate == ''"},
+#                                                        {"ingest": "(m.employee.startDate != '') & -m.employee.endDate"}]}]}
+#
+#                           Conditions are parsed (never evaluated) and validated when the file is
+#                           loaded: unknown message fields, aliases used before they are bound and
+#                           unknown actions are reported with the file and rule they are in. The
+#                           compiled form of every file is cached on disk under the hash of its
+#                           content, so an unchanged file is not parsed again, and a district's
+#                           ruleset is only built on an engine when it is first needed.
+#
+# Version               : 1.0
+#############################################################################################################
+
+import ast
+import hashlib
+import json
+import operator
+import os
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+##### Used as the directory the ruleset files are read from by default, and the directory (inside it) their
+#####   compiled forms are cached in
+defaultRulesetDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Rulesets')
+cacheDirectoryName = '__pycache__'
+
+##### Used as the version of the compiled form. Changing it (or knownFields) invalidates every cached ruleset file
+compilerVersion = 1
+
+##### Used as the message fields a rule can test, by record type. A field outside them (a typo such as
+#####   m.empoyee.sales) fails validation when the ruleset file is loaded
+knownFields = {'employee': ['id', 'storeLocation', 'storeId', 'startDate', 'endDate', 'first', 'last', 'zipcode', 'sales']}
+
+##### Used as the comparison operators a condition can use
+comparisonOperators = {ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>='}
+builtOperators = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+rulesetExtensions = ('.json', '.yaml', '.yml')
+
+
+
+#The rulesets of every file in a directory, by district. Files are compiled (or read from the cache) when the
+# catalog is created; nothing is defined on an engine until buildRuleset is called for a district
+class RulesetCatalog:
+    def __init__(self, directory=defaultRulesetDirectory, actionNames=None):
+        self.directory = directory
+        self.rulesets = {}
+        self.compiledCount = 0
+        self.cachedCount = 0
+        for fileName in sorted(os.listdir(directory)):
+            if not fileName.endswith(rulesetExtensions):
+                continue
+            path = os.path.join(directory, fileName)
+            compiled = self.loadCompiled(path)
+            for district in compiled['storeLocations']:
+                if district in self.rulesets:
+                    raise ValueError('{0}: district {1} already has a ruleset in {2}'.format(fileName, district, self.rulesets[district][0]))
+                self.rulesets[district] = (fileName, compiled['rules'])
+            if actionNames is not None:
+                for rule in compiled['rules']:
+                    if rule['action'] not in actionNames:
+                        raise ValueError('{0}: unknown action {1} (one of {2})'.format(fileName, rule['action'], ', '.join(sorted(actionNames))))
+
+    #The cache is only an optimization, so a cache directory that can not be written is ignored
+    def loadCompiled(self, path):
+        with open(path, 'rb') as rulesetFile:
+            content = rulesetFile.read()
+        #The compiled form was validated against knownFields, so a change to them must not reuse it
+        compilerKey = json.dumps([compilerVersion, knownFields], sort_keys=True).encode('utf-8')
+        contentHash = hashlib.sha256(content + compilerKey).hexdigest()
+        cachePath = os.path.join(self.directory, cacheDirectoryName, contentHash + '.json')
+        try:
+            with open(cachePath) as cacheFile:
+                compiled = json.load(cacheFile)
+            self.cachedCount += 1
+            return compiled
+        except (OSError, ValueError):
+            pass
+
+        compiled = compileRulesetFile(os.path.basename(path), content)
+        self.compiledCount += 1
+        try:
+            os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+            with open(cachePath + '.tmp', 'w') as cacheFile:
+                json.dump(compiled, cacheFile)
+            os.replace(cachePath + '.tmp', cachePath)
+        except OSError:
+            pass
+        return compiled
+
+    def getDistricts(self):
+        return sorted(self.rulesets)
+
+    def hasRuleset(self, district):
+        return district in self.rulesets
+
+    def getRules(self, district):
+        return self.rulesets[district][1]
+
+    #The message field paths the rules of every district read
+    def getFieldPaths(self):
+        paths = set()
+        for fileName, rules in self.rulesets.values():
+            for rule in rules:
+                for patterns in rule['groups']:
+                    for pattern in patterns:
+                        for alias, path in getConditionFields(pattern['condition']):
+                            paths.add(tuple(path))
+        return sorted(paths)
+
+
+#Parses and validates a ruleset file into its compiled form: the districts, and per rule the action and the
+# pattern groups (one for when_all, one per alternative for when_any) of (alias, condition tree)
+def compileRulesetFile(fileName, content):
+    if fileName.endswith('.json'):
+        document = json.loads(content)
+    elif yaml is None:
+        raise ValueError('{0}: reading YAML ruleset files needs PyYAML (pip install pyyaml)'.format(fileName))
+    else:
+        document = yaml.safe_load(content)
+
+    if not isinstance(document, dict) or set(document) != {'storeLocations', 'rules'}:
+        raise ValueError('{0}: a ruleset file has a "storeLocations" list and a "rules" list'.format(fileName))
+    districts = document['storeLocations']
+    if not isinstance(districts, list) or len(districts) == 0 or not all(isinstance(district, str) for district in districts):
+        raise ValueError('{0}: "storeLocations" must be a list of district names'.format(fileName))
+    if not isinstance(document['rules'], list):
+        raise ValueError('{0}: "rules" must be a list'.format(fileName))
+
+    rules = []
+    for number, rule in enumerate(document['rules']):
+        try:
+            rules.append(compileRule(rule))
+        except ValueError as e:
+            name = rule.get('action') if isinstance(rule, dict) else None
+            raise ValueError('{0}: rule {1}{2}: {3}'.format(fileName, number + 1, ' (' + name + ')' if isinstance(name, str) else '', e))
+    return {'storeLocations': districts, 'rules': rules}
+
+
+def compileRule(rule):
+    if not isinstance(rule, dict) or not isinstance(rule.get('action'), str) or len(set(rule) & {'when_all', 'when_any'}) != 1 \
+            or len(set(rule) - {'action', 'when_all', 'when_any'}) > 0:
+        raise ValueError('a rule has an "action" and either "when_all" or "when_any"')
+    if 'when_all' in rule:
+        groups = [rule['when_all']]
+    else:
+        groups = rule['when_any']
+        if not isinstance(groups, list) or len(groups) == 0:
+            raise ValueError('"when_any" must be a list of alternatives')
+        groups = [group if isinstance(group, list) else [group] for group in groups]
+    return {'action': rule['action'], 'groups': [compileGroup(group) for group in groups]}
+
+
+#A group is a list of {alias: condition} patterns; the last one matches the event and the ones before it facts
+def compileGroup(group):
+    if not isinstance(group, list) or len(group) == 0:
+        raise ValueError('patterns must be a list of {"<alias>": "<condition>"}')
+    patterns = []
+    aliases = []
+    for pattern in group:
+        if not isinstance(pattern, dict) or len(pattern) != 1:
+            raise ValueError('patterns must be a list of {"<alias>": "<condition>"}')
+        (alias, text), = pattern.items()
+        if not isinstance(text, str):
+            raise ValueError('the condition of {0} must be a string'.format(alias))
+        if not alias.isidentifier() or alias in aliases:
+            raise ValueError('pattern name {0} is not a name, or is used twice'.format(alias))
+        condition = parseCondition(text)
+        for fieldAlias, path in getConditionFields(condition):
+            if fieldAlias is not None and fieldAlias not in aliases:
+                raise ValueError('{0}: c.{1} is not bound by an earlier pattern'.format(text, fieldAlias))
+            validateFieldPath(text, path)
+        aliases.append(alias)
+        patterns.append({'alias': alias, 'condition': condition})
+    return patterns
+
+
+def validateFieldPath(text, path):
+    if len(path) == 0 or path[0] not in knownFields:
+        raise ValueError('{0}: unknown field {1}'.format(text, '.'.join(path)))
+    if len(path) > 1 and path[1] not in knownFields[path[0]]:
+        raise ValueError('{0}: unknown field {1}'.format(text, '.'.join(path)))
+
+
+#Conditions are python expressions over m (the message matched) and c.<alias> (a message bound before), and
+# only presence tests (+/-), comparisons, & and | are accepted. As in durable.lang, & and | bind tighter than
+# comparisons, so a comparison combined with them has to be parenthesized
+def parseCondition(text):
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError('{0}: {1}'.format(text, e.msg))
+    return compileNode(text, tree.body)
+
+
+def compileNode(text, node):
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+        return {'op': '&' if isinstance(node.op, ast.BitAnd) else '|', 'left': compileNode(text, node.left), 'right': compileNode(text, node.right)}
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        return {'op': '+' if isinstance(node.op, ast.UAdd) else '-', 'field': compileField(text, node.operand)}
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in comparisonOperators:
+        return {'op': comparisonOperators[type(node.ops[0])], 'left': compileOperand(text, node.left), 'right': compileOperand(text, node.comparators[0])}
+    raise ValueError('{0}: expected a presence test (+/-), a comparison, & or |, not {1}'.format(text, ast.get_source_segment(text.strip(), node)))
+
+
+def compileOperand(text, node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (str, int, float, bool)):
+        return {'value': node.value}
+    return compileField(text, node)
+
+
+#m.employee.id is {"alias": null, "path": ["employee", "id"]}, c.current.employee.id has the alias "current"
+def compileField(text, node):
+    path = []
+    while isinstance(node, ast.Attribute):
+        path.insert(0, node.attr)
+        node = node.value
+    if isinstance(node, ast.Name) and node.id == 'm' and len(path) > 0:
+        return {'alias': None, 'path': path}
+    if isinstance(node, ast.Name) and node.id == 'c' and len(path) > 1:
+        return {'alias': path[0], 'path': path[1:]}
+    raise ValueError('{0}: expected a field (m.<field> or c.<alias>.<field>){1}'.format(text, \
+        ', parenthesize comparisons combined with & and |' if isinstance(node, ast.BinOp) else ''))
+
+
+#Yields the (alias, path) of every field a condition reads
+def getConditionFields(condition):
+    for key in ('field', 'left', 'right'):
+        value = condition.get(key)
+        if value is None:
+            continue
+        if 'op' in value:
+            yield from getConditionFields(value)
+        elif 'path' in value:
+            yield value['alias'], value['path']
+
+
+#Defines the ruleset of a district on an engine module (durable.lang or nativeEngine). getAction returns the
+# action function for an action name
+def buildRuleset(lang, name, rules, getAction):
+    with lang.ruleset(name):
+        for rule in rules:
+            groups = [[buildPattern(lang, pattern) for pattern in patterns] for patterns in rule['groups']]
+            if len(groups) == 1:
+                lang.when_all(*groups[0])(getAction(rule['action']))
+            else:
+                lang.when_any(*[lang.all(*patterns) for patterns in groups])(getAction(rule['action']))
+
+
+def buildPattern(lang, pattern):
+    return getattr(lang.c, pattern['alias']) << buildCondition(lang, pattern['condition'])
+
+
+def buildCondition(lang, condition):
+    op = condition['op']
+    if op == '&':
+        return buildCondition(lang, condition['left']) & buildCondition(lang, condition['right'])
+    if op == '|':
+        return buildCondition(lang, condition['left']) | buildCondition(lang, condition['right'])
+    if op == '+':
+        return +buildOperand(lang, condition['field'])
+    if op == '-':
+        return -buildOperand(lang, condition['field'])
+    return builtOperators[op](buildOperand(lang, condition['left']), buildOperand(lang, condition['right']))
+
+
+def buildOperand(lang, operand):
+    if 'value' in operand:
+        return operand['value']
+    value = lang.m if operand['alias'] is None else getattr(lang.c, operand['alias'])
+    for name in operand['path']:
+        value = getattr(value, name)
+    return value
@@ -0,0 +1,8 @@
+import pytest
+
+from engineRuns import Feed
+
+
+@pytest.fixture(scope='session')
+def feed(tmp_path_factory):
+    return Feed(str(tmp_path_factory.mktemp('feed')))
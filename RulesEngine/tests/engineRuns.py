@@ -0,0 +1,74 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+
+##### Used as the directory of the rules engine scripts, which import each other by module name
+engineDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, engineDirectory)
+
+##### Used as the size of the generated feed the engine runs are checked on: current state records, inbound
+#####   records and the generator seed
+feedCurrentCount = 600
+feedInboundCount = 1500
+feedSeed = 7
+
+
+
+#Runs one of the scripts in its own process, the way it is run from the command line
+def runScript(script, args, timeout=300):
+    return subprocess.run([sys.executable, os.path.join(engineDirectory, script)] + [str(arg) for arg in args], cwd=engineDirectory, \
+        capture_output=True, text=True, timeout=timeout)
+
+
+#The employees table of a SQLite current state store, ordered by key
+def readFinalState(dbPath):
+    connection = sqlite3.connect(dbPath)
+    try:
+        return connection.execute('SELECT id, storeId, document FROM employees ORDER BY id, storeId').fetchall()
+    finally:
+        connection.close()
+
+
+#A generated current state store and inbound feed, shared by the tests of the session. Runs copy the store
+class Feed:
+    def __init__(self, directory):
+        self.directory = directory
+        self.dbPath = os.path.join(directory, 'current.db')
+        self.feedPath = os.path.join(directory, 'inbound.ndjson')
+        result = runScript('feedGenerator.py', ['-c', feedCurrentCount, '-n', feedInboundCount, '-t', 'sqlite:' + self.dbPath, '-o', self.feedPath, \
+            '--seed', feedSeed])
+        assert result.returncode == 0, result.stderr
+
+    #Runs rulesEngine.py over the feed on a fresh copy of the store and returns the finished process and the
+    # store's final state
+    def run(self, name, *args):
+        dbPath = self.copyStore(name)
+        result = runScript('rulesEngine.py', self.getArguments(dbPath, args))
+        return result, readFinalState(dbPath)
+
+    #Starts rulesEngine.py over the feed on a fresh copy of the store without waiting for it, for runs that are
+    # killed part way. Returns the process and the store path
+    def start(self, name, *args):
+        dbPath = self.copyStore(name)
+        process = subprocess.Popen([sys.executable, os.path.join(engineDirectory, 'rulesEngine.py')] + self.getArguments(dbPath, args), \
+            cwd=engineDirectory, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return process, dbPath
+
+    #Runs rulesEngine.py over the feed again on the store a started run left behind
+    def resume(self, dbPath, *args):
+        result = runScript('rulesEngine.py', self.getArguments(dbPath, args))
+        return result, readFinalState(dbPath)
+
+    def copyStore(self, name):
+        dbPath = os.path.join(self.directory, name + '.db')
+        shutil.copyfile(self.dbPath, dbPath)
+        return dbPath
+
+    def getArguments(self, dbPath, args):
+        return ['-t', 'sqlite:' + dbPath, '-i', self.feedPath] + [str(arg) for arg in args]
+
+
+def getDecisionCount(result):
+    return sum(1 for line in result.stdout.splitlines() if line.startswith('Store employee '))
@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+import currentStateDataProvider
+from currentStateDataProvider import openCurrentStateStore, getRecordKey, getContentHash, setContentHashFields, setCurrentStateStore, \
+    getCurrentStateHashBulk, getCurrentStateDataBulk
+from engineRuns import getDecisionCount, readFinalState, runScript
+
+
+def getEmployee(employeeId, first):
+    return {'employee': {'id': employeeId, 'storeLocation': 'Chicago', 'storeId': '1001', 'startDate': '20200101', 'first': first, \
+        'last': 'Lee', 'zipcode': '60601'}}
+
+
+@pytest.fixture
+def ruleFields():
+    setContentHashFields([('employee', 'first'), ('employee', 'last')])
+    yield
+    setContentHashFields(None)
+    setCurrentStateStore(None)
+
+
+def test_snapshotUpdatesSurviveClose(tmp_path):
+    storeSpec = 'snapshot:' + str(tmp_path / 'registry.snap')
+    openCurrentStateStore(storeSpec, [getEmployee('0001', 'Ann'), getEmployee('0002', 'Bob')]).close()
+
+    store = openCurrentStateStore(storeSpec)
+    store.update(getEmployee('0002', 'Beth'))
+    store.update(getEmployee('0003', 'Cal'))
+    store.close()
+
+    store = openCurrentStateStore(storeSpec)
+    try:
+        assert [store.get(employeeId, '1001')['employee']['first'] for employeeId in ('0001', '0002', '0003')] == ['Ann', 'Beth', 'Cal']
+        assert sorted(getRecordKey(record) for record in store.records()) == [('0001', '1001'), ('0002', '1001'), ('0003', '1001')]
+    finally:
+        store.close()
+
+
+#A run on a snapshot store must leave the same registry behind as the same run on a sqlite store
+def test_runOnSnapshotStoresDecisions(feed, tmp_path):
+    sqliteRun, sqliteState = feed.run('snapshot_reference', '-e', 'native')
+    sqliteStore = openCurrentStateStore('sqlite:' + feed.dbPath)
+    try:
+        storeSpec = 'snapshot:' + str(tmp_path / 'registry.snap')
+        openCurrentStateStore(storeSpec, list(sqliteStore.records())).close()
+    finally:
+        sqliteStore.close()
+
+    snapshotRun = runScript('rulesEngine.py', ['-t', storeSpec, '-i', feed.feedPath, '-e', 'native'])
+    assert snapshotRun.returncode == 0, snapshotRun.stderr
+    assert getDecisionCount(snapshotRun) == getDecisionCount(sqliteRun) > 0
+    store = openCurrentStateStore(storeSpec)
+    try:
+        snapshotState = sorted((record['employee']['id'], record['employee']['storeId'], record) for record in store.records())
+    finally:
+        store.close()
+    assert snapshotState == [(employeeId, storeId, json.loads(document)) for employeeId, storeId, document in sqliteState]
+
+
+def test_snapshotRefusesResume(feed, tmp_path):
+    storeSpec = 'snapshot:' + str(tmp_path / 'registry.snap')
+    openCurrentStateStore(storeSpec, [getEmployee('0001', 'Ann')]).close()
+    result = runScript('rulesEngine.py', ['-t', storeSpec, '-i', feed.feedPath, '--resume', tmp_path / 'feed.position'])
+    assert result.returncode == 2
+    assert 'need a store that writes each decision' in result.stderr
+
+
+#A reopened store answers from the hashes written with the records, and only reads records for another field set
+@pytest.mark.parametrize('storeType', ['sqlite', 'snapshot'])
+def test_storedHashesSkipRecordReads(ruleFields, tmp_path, storeType):
+    storeSpec = storeType + ':' + str(tmp_path / 'registry')
+    records = [getEmployee('0001', 'Ann'), getEmployee('0002', 'Bob')]
+    openCurrentStateStore(storeSpec, records).close()
+    keys = [('0001', '1001'), ('0002', '1001')]
+
+    store = openCurrentStateStore(storeSpec)
+    try:
+        assert store.getHashBulk(keys) == [(getContentHash(record), None) for record in records]
+        setContentHashFields([('employee', 'first')])
+        assert store.getHashBulk(keys) == [(getContentHash(record), record) for record in records]
+    finally:
+        store.close()
+
+    store = openCurrentStateStore(storeSpec)
+    try:
+        assert store.getHashBulk(keys) == [(getContentHash(record), None) for record in records]
+        blankRecord = store.getHashBulk([('0003', '1001')])[0][1]
+        assert getRecordKey(blankRecord) == ('', '')
+    finally:
+        store.close()
+
+
+#Records read for their hash are handed to the batch lookup, which only reads the others
+def test_changedRecordIsReadOnce(ruleFields, tmp_path):
+    store = openCurrentStateStore('sqlite:' + str(tmp_path / 'registry.db'), [getEmployee('0001', 'Ann')])
+    setContentHashFields([('employee', 'first')])
+    readKeys = []
+    getBulk = store.getBulk
+    def countedGetBulk(keys):
+        readKeys.extend(keys)
+        return getBulk(keys)
+    store.getBulk = countedGetBulk
+    setCurrentStateStore(store)
+    try:
+        keys = [('0001', '1001'), ('0002', '1001')]
+        knownRecords = [record for contentHash, record in getCurrentStateHashBulk(keys)]
+        assert readKeys == [('0001', '1001'), ('0002', '1001')]
+        currentStates = getCurrentStateDataBulk(keys, knownRecords)
+        assert readKeys == [('0001', '1001'), ('0002', '1001')]
+        assert [getRecordKey(record) for record in currentStates] == [('0001', '1001'), ('', '')]
+        assert currentStateDataProvider.contentHashes[('0001', '1001')] == getContentHash(getEmployee('0001', 'Ann'))
+    finally:
+        store.close()
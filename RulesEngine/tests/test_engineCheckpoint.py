@@ -0,0 +1,70 @@
+import json
+import os
+import signal
+
+import pytest
+
+from currentStateDataProvider import openCurrentStateStore
+from engineRuns import getDecisionCount, readFinalState, runScript
+
+
+##### Used as the runs checkpoints are checked on: engine and mode arguments
+checkpointedRuns = [['-e', 'durable'], ['-e', 'native', '--async'], ['-e', 'native', '--async', '--facts', 'ttl:600'], ['-e', 'durable', '-w', 2]]
+
+##### Used as an employee whose name changes back and forth within one checkpoint interval, so the same current
+#####   state and inbound record pair is decided on twice
+employee = {'id': '0000001', 'storeLocation': 'Chicago', 'storeId': '1001', 'startDate': '20200101', 'first': 'Ann', 'last': 'Lee', 'zipcode': '60601'}
+
+
+
+def getCheckpointArguments(tmp_path, name, runArgs):
+    return list(runArgs) + ['-b', 50, '--checkpoint', os.path.join(str(tmp_path), name + '.checkpoint'), '--checkpointinterval', 0]
+
+
+#Every decision of a run has its own id, so a checkpointed run skips none of them and ends as an unchecked run does
+@pytest.mark.parametrize('runArgs', checkpointedRuns)
+def test_checkpointedRunStoresEveryDecision(feed, tmp_path, runArgs):
+    plain, plainState = feed.run('plain', *runArgs)
+    checkpointed, checkpointedState = feed.run('checkpointed', *getCheckpointArguments(tmp_path, 'checkpointed', runArgs))
+    assert checkpointed.returncode == 0, checkpointed.stderr
+    assert 'skipped 0 decisions already stored' in checkpointed.stderr
+    assert getDecisionCount(checkpointed) == getDecisionCount(plain)
+    assert checkpointedState == plainState
+
+
+@pytest.mark.parametrize('engineName', ['durable', 'native'])
+def test_repeatedDecisionIsStoredAgain(tmp_path, engineName):
+    dbPath = str(tmp_path / 'current.db')
+    openCurrentStateStore('sqlite:' + dbPath, [{'employee': employee}]).close()
+    feedPath = tmp_path / 'inbound.ndjson'
+    names = ['Beth', 'Ann', 'Beth']
+    feedPath.write_text(''.join(json.dumps({'employee': dict(employee, first=name)}) + '\n' for name in names))
+
+    result = runScript('rulesEngine.py', ['-t', 'sqlite:' + dbPath, '-i', feedPath, '-e', engineName, '--checkpoint', tmp_path / 'run.checkpoint'])
+    assert result.returncode == 0, result.stderr
+    assert getDecisionCount(result) == len(names)
+    assert 'skipped 0 decisions already stored' in result.stderr
+    assert json.loads(readFinalState(dbPath)[0][2])['employee']['first'] == names[-1]
+
+
+#A run killed part way and started again resumes from its last checkpoint and ends as a run that was never killed
+@pytest.mark.parametrize('runArgs', checkpointedRuns)
+@pytest.mark.parametrize('killAfter', [20, 120])
+def test_resumedRunMatchesFullRun(feed, tmp_path, runArgs, killAfter):
+    full, fullState = feed.run('full', *runArgs)
+    arguments = getCheckpointArguments(tmp_path, 'killed', runArgs)
+    process, dbPath = feed.start('killed', *arguments)
+    decisionCount = 0
+    for line in process.stdout:
+        decisionCount += line.startswith('Store employee ')
+        if decisionCount >= killAfter:
+            process.send_signal(signal.SIGKILL)
+            break
+    process.stdout.close()
+    process.wait()
+    assert process.returncode == -signal.SIGKILL
+
+    resumed, resumedState = feed.resume(dbPath, *arguments)
+    assert resumed.returncode == 0, resumed.stderr
+    assert 'Resuming from checkpoint' in resumed.stderr
+    assert resumedState == fullState
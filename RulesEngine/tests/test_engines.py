@@ -0,0 +1,53 @@
+import pytest
+
+from engineRuns import getDecisionCount
+
+
+#durable_rules and the native engine must store the same decisions for every record of the feed
+def test_enginesStoreSameDecisions(feed):
+    native, nativeState = feed.run('native', '-e', 'native')
+    durable, durableState = feed.run('durable', '-e', 'durable')
+    assert native.returncode == 0, native.stderr
+    assert durable.returncode == 0, durable.stderr
+    assert getDecisionCount(durable) == getDecisionCount(native) > 0
+    assert durableState == nativeState
+
+
+#The native engine holds no events, so keeping facts across records must not change what it decides
+@pytest.mark.parametrize('lifecyclePolicy', ['ttl:600', 'none'])
+def test_heldFactsReachSameFinalState(feed, lifecyclePolicy):
+    native, nativeState = feed.run('native_event', '-e', 'native')
+    held, heldState = feed.run('native_' + lifecyclePolicy.replace(':', ''), '-e', 'native', '--facts', lifecyclePolicy)
+    assert held.returncode == 0, held.stderr
+    assert getDecisionCount(held) == getDecisionCount(native) > 0
+    assert heldState == nativeState
+
+
+def test_compareFindsNoMismatch(feed):
+    native, nativeState = feed.run('native_reference', '-e', 'native')
+    compared, comparedState = feed.run('compare', '-e', 'compare')
+    assert compared.returncode == 0, compared.stderr
+    assert 'Engine comparison: 0 mismatched messages' in compared.stderr
+    assert getDecisionCount(compared) == getDecisionCount(native)
+    assert comparedState == nativeState
+
+
+#durable_rules pairs facts held across records with each other and loses decisions, so only the native engine
+# may keep facts past their event
+@pytest.mark.parametrize('engineName', ['durable', 'compare'])
+@pytest.mark.parametrize('lifecyclePolicy', ['ttl:600', 'none'])
+def test_heldFactsNeedNativeEngine(feed, engineName, lifecyclePolicy):
+    result, finalState = feed.run('{0}_{1}'.format(engineName, lifecyclePolicy.replace(':', '')), '-e', engineName, '--facts', lifecyclePolicy)
+    assert result.returncode == 2
+    assert 'needs the native engine' in result.stderr
+    assert getDecisionCount(result) == 0
+
+
+#Records skipped as unchanged must not have led to a decision, in either pipeline
+@pytest.mark.parametrize('pipelineArgs', [[], ['--async']])
+def test_skipUnchangedReachesSameFinalState(feed, pipelineArgs):
+    native, nativeState = feed.run('native_all', '-e', 'native')
+    skipped, skippedState = feed.run('native_skip' + ''.join(pipelineArgs).replace('-', '_'), '-e', 'native', '--skipunchanged', *pipelineArgs)
+    assert skipped.returncode == 0, skipped.stderr
+    assert getDecisionCount(skipped) == getDecisionCount(native) > 0
+    assert skippedState == nativeState
@@ -0,0 +1,21 @@
+import pytest
+
+from engineRuns import getDecisionCount
+
+
+#Partition workers must leave the store exactly as a sequential run does, whichever engine evaluates the rules
+@pytest.mark.parametrize('engineName', ['durable', 'native'])
+@pytest.mark.parametrize('workerCount', [2, 4])
+def test_partitionsMatchSequential(feed, engineName, workerCount):
+    sequential, sequentialState = feed.run(engineName + '_sequential', '-e', engineName)
+    partitioned, partitionedState = feed.run('{0}_w{1}'.format(engineName, workerCount), '-e', engineName, '-w', workerCount)
+    assert sequential.returncode == 0, sequential.stderr
+    assert partitioned.returncode == 0, partitioned.stderr
+    assert getDecisionCount(partitioned) == getDecisionCount(sequential) > 0
+    assert partitionedState == sequentialState
+
+
+def test_partitionsWithDurableNeedEventLifecycle(feed):
+    result, finalState = feed.run('durable_ttl_w2', '-e', 'durable', '-w', 2, '--facts', 'ttl:60')
+    assert result.returncode == 2
+    assert 'needs the native engine' in result.stderr